@@ -1,16 +1,63 @@
 import os
 import json
+import time
 import logging
 
-from fpltools.extract import (retrieve_data, retrieve_player_details,
-                              save_intermediate_data)
+import boto3
+
+from extract import (retrieve_data, retrieve_player_details,
+                     save_intermediate_data, load_intermediate_data,
+                     ValidatorCache, NdjsonWriter, RateLimiter, PlayerJournal,
+                     ExtractStopped, max_request_seconds)
+from extract_metrics import ExtractMetrics
 from fpltools.constants import API_URLS
-from fpltools.utils import AwsS3
+from fpltools.compression import CODEC_SUFFIXES
+from fpltools.utils import AwsS3, AwsS3Pipeline
 
 DATA_LOC = '/tmp/'
 FILE_STRING_FIXTURES = 'fixtures'
 FILE_STRING_PLAYERS = 'players'
 FILE_STRING_MAIN = 'main'
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 16))
+USE_ASYNC = os.environ.get('EXTRACT_USE_ASYNC', 'false').lower() == 'true'
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', 50))
+# Maximum requests per second to the API, unlimited if not set
+RATE_LIMIT = float(os.environ.get('RATE_LIMIT', 0))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 10))
+# /tmp survives between invocations of a warm Lambda container
+CACHE_LOC = os.environ.get('HTTP_CACHE_LOC', '/tmp/http_cache')
+# Write players to newline-delimited JSON as they arrive to bound memory use
+STREAM_PLAYERS = os.environ.get('STREAM_PLAYERS', 'false').lower() == 'true'
+# Upload the streamed players file in parts as it is written, and the other
+# files in parallel, rather than uploading each in turn at the end
+PIPELINE_UPLOAD = os.environ.get('PIPELINE_UPLOAD', 'false').lower() == 'true'
+# One of none, gzip or zstd - compresses saved files to cut /tmp and S3 usage
+COMPRESSION = os.environ.get('RAW_COMPRESSION', 'none')
+EXT_JSON = f'json{CODEC_SUFFIXES[COMPRESSION]}'
+EXT_NDJSON = f'ndjson{CODEC_SUFFIXES[COMPRESSION]}'
+JOURNAL_FILE = f'{DATA_LOC}/{FILE_STRING_PLAYERS}.journal.ndjson'
+# Timeout (seconds) of each attempt of a request, and retries of each
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', 30))
+REQUEST_RETRIES = int(os.environ.get('REQUEST_RETRIES', 3))
+# Time needed to save progress and invoke a follow-up to continue
+SAVE_RESERVE_MS = int(os.environ.get('SAVE_RESERVE_MS', 20000))
+# Stop starting requests when less than this remains of the Lambda timeout,
+# so requests in flight can finish (however many retries they need) and
+# progress be saved before the Lambda times out
+TIME_RESERVE_MS = int(os.environ.get(
+    'TIME_RESERVE_MS',
+    max_request_seconds(REQUEST_RETRIES, timeout=REQUEST_TIMEOUT) * 1000
+    + SAVE_RESERVE_MS))
+# Limit on follow-up invocations of one extract, in case it stops progressing
+MAX_INVOCATIONS = int(os.environ.get('MAX_INVOCATIONS', 10))
+# S3 folder in which a partial extract is saved for the follow-up invocation
+PROGRESS_FOLDER = os.environ.get('AWS_S3_PROGRESS_FOLDER',
+                                 'etl_staging/progress')
+# Continue in this process, keeping progress in DATA_LOC, rather than saving
+# to S3 and invoking the Lambda again (for running locally)
+LOCAL_INVOKE = os.environ.get('LOCAL_INVOKE', 'false').lower() == 'true'
+# Time each local follow-up invocation has, as the Lambda timeout would give
+LOCAL_TIMEOUT_MS = int(os.environ.get('LOCAL_TIMEOUT_MS', 900000))
 # LOG_FILE = '/tmp/extract.log'
 
 s3_bucket = os.environ.get('AWS_S3_BUCKET')
@@ -21,31 +68,191 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+def save_progress(files):
+    """Save the files needed to continue a partial extract to S3"""
+    if LOCAL_INVOKE:
+        return
+    s3_client = boto3.client('s3')
+    for fl in files:
+        s3_client.upload_file(fl, s3_bucket,
+                              f'{PROGRESS_FOLDER}/{os.path.basename(fl)}')
+
+
+def load_progress(files):
+    """Restore the files saved by save_progress"""
+    if LOCAL_INVOKE:
+        return
+    s3_client = boto3.client('s3')
+    for fl in files:
+        s3_client.download_file(s3_bucket,
+                                f'{PROGRESS_FOLDER}/{os.path.basename(fl)}',
+                                fl)
+
+
+class LocalContext:
+    """Stand-in for the Lambda context of a local follow-up invocation, with
+    timeout_ms remaining when it is created"""
+
+    def __init__(self, function_name, timeout_ms=LOCAL_TIMEOUT_MS):
+        self.function_name = function_name
+        self._deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+def invoke_self(context, payload):
+    """Invoke this Lambda asynchronously with payload as its event. Locally,
+    the follow-up runs in this process with a fresh time budget, as the
+    context of this invocation has run out of time."""
+    if LOCAL_INVOKE:
+        return lambda_handler(payload, LocalContext(context.function_name))
+    boto3.client('lambda').invoke(FunctionName=context.function_name,
+                                  InvocationType='Event',
+                                  Payload=json.dumps(payload).encode('utf-8'))
+
+
 def lambda_handler(event, context):
+    event = event or {}
+    invocation = event.get('invocation', 1)
     try:
         # logging.basicConfig(level=logging.INFO,
         #                     filename=LOG_FILE,
         #                     filemode='w',
         #                     format='%(levelname)s - %(asctime)s - %(message)s')
 
-        main_data = retrieve_data(API_URLS['static'])
-        fixtures_data = retrieve_data(API_URLS['fixtures'])
-        player_data = retrieve_player_details(API_URLS['player'],
-                                              main_data['elements'],
-                                              verbose=True)
+        players_file = f'{DATA_LOC}/{FILE_STRING_PLAYERS}.{EXT_JSON}'
+        metrics = ExtractMetrics()
+        s3_pipeline = AwsS3Pipeline(s3_bucket, s3_folder) \
+            if PIPELINE_UPLOAD else None
+        stream_upload = None
+        limiter = RateLimiter(RATE_LIMIT, burst=RATE_LIMIT_BURST) \
+            if RATE_LIMIT else None
+        if USE_ASYNC and STREAM_PLAYERS:
+            # As run_extract.py, which rejects --stream-players with
+            # --use-async
+            logging.warning('STREAM_PLAYERS cannot be combined with '
+                            'EXTRACT_USE_ASYNC, players will not be streamed')
+        if USE_ASYNC:
+            # aiohttp is only required for the asyncio engine
+            from extract_async import retrieve_extract
+            main_data, fixtures_data, player_data = retrieve_extract(
+                API_URLS['static'],
+                API_URLS['fixtures'],
+                API_URLS['player'],
+                max_concurrency=MAX_CONCURRENCY,
+                verbose=True,
+                limiter=limiter)
+        else:
+            cache = ValidatorCache(CACHE_LOC)
+            # Bounded so requests in flight finish within TIME_RESERVE_MS
+            request_kwargs = {'timeout': REQUEST_TIMEOUT,
+                              'retries': REQUEST_RETRIES}
+            progress_files = [f'{DATA_LOC}/{FILE_STRING_MAIN}.{EXT_JSON}',
+                              f'{DATA_LOC}/{FILE_STRING_FIXTURES}.{EXT_JSON}',
+                              JOURNAL_FILE]
+            if event.get('resume'):
+                logging.info(f'Continuing extract (invocation {invocation})')
+                load_progress(progress_files)
+                main_data = load_intermediate_data(FILE_STRING_MAIN, DATA_LOC,
+                                                   EXT_JSON)
+                fixtures_data = load_intermediate_data(FILE_STRING_FIXTURES,
+                                                       DATA_LOC, EXT_JSON)
+            else:
+                if os.path.exists(JOURNAL_FILE):
+                    os.remove(JOURNAL_FILE)
+                main_data = retrieve_data(API_URLS['static'],
+                                          raise_errors=True, cache=cache,
+                                          limiter=limiter, metrics=metrics,
+                                          **request_kwargs)
+                fixtures_data = retrieve_data(API_URLS['fixtures'],
+                                              raise_errors=True, cache=cache,
+                                              limiter=limiter,
+                                              metrics=metrics,
+                                              **request_kwargs)
+
+            journal = PlayerJournal(JOURNAL_FILE)
+
+            def stop():
+                return context.get_remaining_time_in_millis() \
+                    < TIME_RESERVE_MS
+
+            try:
+                if STREAM_PLAYERS:
+                    players_file = \
+                        f'{DATA_LOC}/{FILE_STRING_PLAYERS}.{EXT_NDJSON}'
+                    if s3_pipeline is not None:
+                        stream_upload = s3_pipeline.stream(players_file)
+                    with NdjsonWriter(players_file,
+                                      upload=stream_upload) as sink:
+                        retrieve_player_details(API_URLS['player'],
+                                                main_data['elements'],
+                                                verbose=True,
+                                                max_workers=MAX_WORKERS,
+                                                cache=cache,
+                                                limiter=limiter,
+                                                metrics=metrics,
+                                                journal=journal,
+                                                stop=stop,
+                                                sink=sink,
+                                                **request_kwargs)
+                else:
+                    player_data = retrieve_player_details(
+                        API_URLS['player'],
+                        main_data['elements'],
+                        verbose=True,
+                        max_workers=MAX_WORKERS,
+                        cache=cache,
+                        limiter=limiter,
+                        metrics=metrics,
+                        journal=journal,
+                        stop=stop,
+                        **request_kwargs)
+            except ExtractStopped as err:
+                journal.close()
+                if journal.written == 0 or invocation >= MAX_INVOCATIONS:
+                    raise RuntimeError(f'Extract not progressing after '
+                                       f'{invocation} invocations') from err
+                save_intermediate_data(main_data, FILE_STRING_MAIN, DATA_LOC,
+                                       EXT_JSON)
+                save_intermediate_data(fixtures_data, FILE_STRING_FIXTURES,
+                                       DATA_LOC, EXT_JSON)
+                save_progress(progress_files)
+                logging.info(f'{err}, continuing in invocation '
+                             f'{invocation + 1}')
+                invoke_self(context, {'resume': True,
+                                      'invocation': invocation + 1})
+                return {
+                    'statusCode': 202,
+                    'body': json.dumps('Extract continuing')
+                }
+            journal.remove()
 
-        save_intermediate_data(main_data, FILE_STRING_MAIN, DATA_LOC)
-        save_intermediate_data(fixtures_data, FILE_STRING_FIXTURES, DATA_LOC)
-        save_intermediate_data(player_data, FILE_STRING_PLAYERS, DATA_LOC)
+        save_intermediate_data(main_data, FILE_STRING_MAIN, DATA_LOC,
+                               EXT_JSON)
+        save_intermediate_data(fixtures_data, FILE_STRING_FIXTURES, DATA_LOC,
+                               EXT_JSON)
+        if not STREAM_PLAYERS or USE_ASYNC:
+            save_intermediate_data(player_data, FILE_STRING_PLAYERS, DATA_LOC,
+                                   EXT_JSON)
 
         dfiles = [
-            f'{DATA_LOC}/{FILE_STRING_FIXTURES}.json',
-            f'{DATA_LOC}/{FILE_STRING_MAIN}.json',
-            f'{DATA_LOC}/{FILE_STRING_PLAYERS}.json'
+            f'{DATA_LOC}/{FILE_STRING_FIXTURES}.{EXT_JSON}',
+            f'{DATA_LOC}/{FILE_STRING_MAIN}.{EXT_JSON}',
+            players_file
         ]
 
-        s3 = AwsS3()
-        s3.upload(dfiles, s3_bucket, s3_folder)
+        if s3_pipeline is not None:
+            # The streamed players file is already uploading
+            s3_pipeline.upload([fl for fl in dfiles
+                                if stream_upload is None
+                                or fl != stream_upload.path])
+            s3_pipeline.wait()
+        else:
+            s3 = AwsS3()
+            s3.upload(dfiles, s3_bucket, s3_folder)
+        # Machine-readable summary of requests made by this invocation
+        logging.info(f'Extract metrics: {json.dumps(metrics.summary())}')
         logging.info('================Extract complete================')
         # lfiles = [LOG_FILE]
         # logging.info(f'Uploading {LOG_FILE} to S3')
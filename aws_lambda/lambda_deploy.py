@@ -29,7 +29,12 @@ LAMBDA_FUNCTIONS = {'Extract':
                         {'function_module':'aws_lambda/aws_lambda_extract.py',
                          'dependencies':
                              {'internal': ['fpltools'],
-                              'external': ['requests']
+                              'modules': ['etl/extract.py',
+                                          'etl/extract_async.py',
+                                          'etl/extract_metrics.py'],
+                              # zstandard for RAW_COMPRESSION=zstd
+                              'external': ['requests', 'aiohttp', 'zstandard',
+                                           'orjson']
                               },
                          's3':
                              {'bucket': 'fpl-alldata',
@@ -47,6 +52,34 @@ LAMBDA_FUNCTIONS = {'Extract':
                               'role': 'arn:aws:iam::627712154013:role/lambda-fpl',
                               'handler': 'aws_lambda_extract.lambda_handler'
                               }
+                         },
+                    'Transform':
+                        {'function_module':'aws_lambda/aws_lambda_transform.py',
+                         'dependencies':
+                             {'internal': ['fpltools'],
+                              'modules': ['etl/transform.py',
+                                          'etl/transform_tables.py'],
+                              # pyarrow for TRANSFORM_OUTPUT_FORMAT=parquet,
+                              # zstandard for zstd compressed raw data
+                              'external': ['pandas', 'zstandard', 'orjson',
+                                           'pyarrow']
+                              },
+                         's3':
+                             {'bucket': 'fpl-alldata',
+                              'out_object': 'lambda_layers/live_fpl_transform.zip'},
+                         'function':
+                             {'layer_name': 'lyrTransformFpl',
+                              'runtime': 'python3.7',
+                              'function_name': 'transformFpl',
+                              'timeout': 300,
+                              'memory': 1024,
+                              'env_vars': {
+                                  'AWS_S3_BUCKET': 'fpl-alldata',
+                                  'AWS_S3_BUCKET_FOLDER': 'etl_staging',
+                                  'AWS_S3_LOG_OUTPUT': 'etl_staging/logs'},
+                              'role': 'arn:aws:iam::627712154013:role/lambda-fpl',
+                              'handler': 'aws_lambda_transform.lambda_handler'
+                              }
                          }
                     }
 
@@ -76,6 +109,9 @@ class AwsLambdaDeploy:
         self.ls_build_deps = os.path.join(self.lf_build_loc, self.deps_folder)
         self.lambda_function = self.lf_v['function_module']
         self.internal_dependencies = lf_v['dependencies']['internal']
+        # Single modules copied to the top level of the package, so that they
+        # import each other as they do when run from their own directory
+        self.internal_modules = self.lf_v['dependencies'].get('modules', [])
         self.external_dependencies = " ".join(lf_v['dependencies']['external'])
         self.deploy_package = os.path.join(self.build_location,
                                            f'{self.lf_n}_deploy_package')
@@ -96,6 +132,11 @@ class AwsLambdaDeploy:
             shutil.copytree(dep_internal, os.path.join(self.ls_build_deps,
                                                        dep_internal))
 
+    def __retrieve_internal_modules(self):
+        for module in self.internal_modules:
+            shutil.copy(module, os.path.join(self.ls_build_deps,
+                                             os.path.split(module)[-1]))
+
     def __retrieve_external_dependencies(self):
         pip_cmd = f"pip install {self.external_dependencies} -t {self.ls_build_deps}"
         os.system(pip_cmd)
@@ -117,6 +158,7 @@ class AwsLambdaDeploy:
         self.__setup_build_loc()
         self.__retrieve_lambda_function()
         self.__retrieve_internal_dependencies()
+        self.__retrieve_internal_modules()
         self.__retrieve_external_dependencies()
         self.__zip()
         self.__upload()
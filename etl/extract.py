@@ -1,45 +1,644 @@
 import os
+import time
+import asyncio
+import random
 import logging
 import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from fpltools.compression import open_file
+from fpltools import json_codec
+
+DEFAULT_POOL_SIZE = 20
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Transient errors which are retried (others, such as redirect loops, are not)
+RETRY_ERRORS = (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError)
+
+# Fields in bootstrap-static elements which change whenever a player's
+# element-summary history does
+PLAYER_CHANGE_FIELDS = ('event_points', 'total_points', 'minutes', 'now_cost',
+                        'transfers_in_event', 'transfers_out_event',
+                        'selected_by_percent', 'bonus', 'bps', 'team')
+# Fields of a fixture which also appear in element-summary fixtures
+FIXTURE_CHANGE_FIELDS = ('event', 'kickoff_time', 'provisional_start_time',
+                         'finished', 'minutes', 'team_h_score',
+                         'team_a_score', 'team_h_difficulty',
+                         'team_a_difficulty')
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    """Create a requests session which keeps up to pool_size connections per
+    host alive and requests compressed responses"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                            'Connection': 'keep-alive'})
+    return session
+
+
+def get_session():
+    """Return the session shared by every request in this process, creating
+    it on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def backoff_delay(attempt, backoff_factor=0.5, max_backoff=30,
+                  retry_after=None):
+    """Seconds to wait before retry number attempt (starting at 0). Uses
+    exponential backoff with full jitter, but never waits less than any
+    Retry-After (seconds) given by the server."""
+    delay = random.uniform(0, min(max_backoff, backoff_factor * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def max_request_seconds(retries=3, backoff_factor=0.5, timeout=30,
+                        max_backoff=30):
+    """Longest a retrieve_data call with these arguments can take: every
+    attempt timing out, with the longest backoff before each retry. A longer
+    Retry-After asked for by the server is not included."""
+    return timeout * (retries + 1) + sum(
+        min(max_backoff, backoff_factor * 2 ** attempt)
+        for attempt in range(retries))
+
+
+def parse_retry_after(response):
+    """Seconds requested by a Retry-After header, or None if absent or given
+    as an HTTP date"""
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Token bucket limiting the rate of requests made across all threads (or
+    coroutines) sharing it. Tokens are added at rate per second up to burst,
+    and each request takes one.
+
+    The rate adapts to the API (additive increase, multiplicative decrease):
+    when the API throttles requests (429s, Retry-After) the rate is cut by
+    decrease and requests pause for any Retry-After; each healthy response
+    then adds recovery * max_rate back until max_rate is reached again.
+
+    rate: float
+        maximum (and initial) requests per second
+    burst: int
+        number of requests which may be made at once after a quiet period
+    min_rate: float
+        rate will not be cut below this. Defaults to rate / 20.
+    """
+
+    def __init__(self, rate, burst=1, min_rate=None, decrease=0.5,
+                 recovery=0.02):
+        if rate <= 0:
+            raise ValueError(f'rate must be positive, not {rate}')
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate if min_rate is not None else rate / 20
+        self.decrease = decrease
+        self.recovery = recovery
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token, returning the seconds to wait before it may be used.
+        Tokens may be taken ahead of time, leaving the bucket in debt, so that
+        waiting requests are queued at rate rather than all retrying at
+        once."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return max(0, self._paused_until - now, -self._tokens / self.rate)
+
+    def acquire(self):
+        """Block until a request may be made"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """As acquire, without blocking the event loop"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """Slow down after the API has throttled a request"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Keep any debt of requests already queued
+            self._tokens = min(self._tokens, 0)
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until,
+                                         time.monotonic() + retry_after)
+        logging.warning(f'Request rate reduced to {self.rate:.2f}/s')
+
+    def succeeded(self):
+        """Speed back up after a healthy response"""
+        with self._lock:
+            self.rate = min(self.max_rate,
+                            self.rate + self.recovery * self.max_rate)
+
+
+class ExtractStopped(Exception):
+    """Raised when player retrieval is stopped early (e.g. to stay within a
+    time budget). Players retrieved so far are in the journal, if any."""
+
+
+class ValidatorCache:
+    """On-disk store of the last response body for each link along with its
+    validators (ETag and Last-Modified headers). Used to make conditional
+    requests, so that the API only sends data that has changed.
+
+    cache_loc: str
+        folder in which to store cached responses, created if it does not
+        exist
+    """
+
+    def __init__(self, cache_loc):
+        self.cache_loc = cache_loc
+        os.makedirs(self.cache_loc, exist_ok=True)
+
+    def _path(self, link, extension):
+        key = hashlib.sha1(link.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_loc, f'{key}.{extension}')
+
+    def request_headers(self, link):
+        """Conditional request headers for link, empty if nothing is cached"""
+        try:
+            with open(self._path(link, 'meta'), 'r') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if not os.path.exists(self._path(link, 'body')):
+            return {}
+
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def load_body(self, link):
+        with open(self._path(link, 'body'), 'rb') as f:
+            return f.read()
+
+    def store(self, link, response):
+        """Store the body and validators of response, if it has any"""
+        meta = {'link': link,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')}
+        if meta['etag'] is None and meta['last_modified'] is None:
+            return
+        # Write to temporary files first so that a concurrent or interrupted
+        # run never sees a body which does not match its validators
+        for extension, contents, mode in (('body', response.content, 'wb'),
+                                          ('meta', json.dumps(meta), 'w')):
+            path = self._path(link, extension)
+            with open(f'{path}.tmp', mode) as f:
+                f.write(contents)
+            os.replace(f'{path}.tmp', path)
+
+
+class NdjsonWriter:
+    """Write player records to a newline-delimited JSON file as they are
+    retrieved, so that only one player needs to be held in memory at a time.
+    Each line is an object {"id": <player id>, "data": <element-summary>}.
+
+    path: str
+        file to write to, compressed as it is written if ending .gz or .zst
+    mode: str
+        'w' to overwrite or 'a' to append to an existing file
+    upload: S3StreamUpload
+        if given, told of each write so that the file is uploaded in parts
+        as it is written, finishing when the writer is closed (or aborting if
+        closed by an error)
+    """
+
+    def __init__(self, path, mode='w', upload=None):
+        self.path = path
+        self.upload = upload
+        self._file = open_file(path, f'{mode}b')
+
+    def write(self, player_id, data):
+        self._file.write(json_codec.dumps({'id': player_id, 'data': data}))
+        self._file.write(b'\n')
+        if self.upload is not None:
+            self.upload.update()
+
+    def close(self):
+        self._file.close()
+        if self.upload is not None:
+            self.upload.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self.upload is not None:
+            self._file.close()
+            self.upload.abort()
+        else:
+            self.close()
+
+
+class PlayerJournal(NdjsonWriter):
+    """Checkpoint journal of the players retrieved so far. Each player is
+    appended and flushed as soon as it is retrieved, so that an interrupted
+    extract can resume from the journal rather than starting again.
+
+    path: str
+        journal file. Players already in it are loaded into completed.
+    """
+
+    def __init__(self, path):
+        self.completed = self.load(path)
+        # Players added by this run
+        self.written = 0
+        super().__init__(path, mode='a')
+        if self._file.tell() > 0 and not self._ends_with_newline(path):
+            # Finish a line cut short when the previous run was interrupted
+            self._file.write(b'\n')
+
+    @staticmethod
+    def _ends_with_newline(path):
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    @staticmethod
+    def load(path):
+        """Players in the journal at path keyed by id, ignoring any line cut
+        short by an interruption"""
+        completed = {}
+        if not os.path.exists(path):
+            return completed
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json_codec.loads(line)
+                except ValueError:
+                    continue
+                completed[record['id']] = record['data']
+        return completed
+
+    def write(self, player_id, data):
+        super().write(player_id, data)
+        self._file.flush()
+        self.written += 1
+
+    def remove(self):
+        """Close and delete the journal once the extract has completed"""
+        self.close()
+        os.remove(self.path)
+
+
+def iter_player_details(link, player_ids, verbose=False, max_workers=1,
+                        stop=None, label='Player', **request_kwargs):
+    """Retrieve each player's data as in retrieve_player_details, yielding
+    (player_id, data) as soon as each is retrieved. With max_workers above 1
+    players are yielded in the order they complete. label names what is
+    retrieved in logs, for ids which are not players (e.g. entries).
+
+    If stop is given it is called before each request is started, and once it
+    returns True no more are started (requests in progress still finish)."""
+    if max_workers > 1:
+        yield from _iter_player_details_concurrent(link, player_ids, verbose,
+                                                   max_workers, stop,
+                                                   request_kwargs, label)
+        return
 
-def retrieve_player_details(link, player_ids, verbose=False):
-    """For each player - retrieve a dictionary of their data by cycling through
-    their player_ids (derived from main data set). Set verbose=True to print
-    output for every one in ten players."""
-    players_full = {}
     for i, pl in enumerate(player_ids):
+        if stop is not None and stop():
+            return
         if verbose and i % 10 == 0:
-            logging.info(f"Player number: {str(i)} of {str(len(player_ids))}")
+            logging.info(f"{label} number: {str(i)} of "
+                         f"{str(len(player_ids))}")
 
         player_id = pl['id']
-        players_full[player_id] = retrieve_data(link.format(player_id))
+        yield player_id, retrieve_data(link.format(player_id),
+                                       **request_kwargs)
+
+
+def _iter_player_details_concurrent(link, player_ids, verbose, max_workers,
+                                    stop, request_kwargs, label='Player'):
+    """Thread pool version of iter_player_details. Requests are I/O bound
+    so threads spend nearly all of their time waiting on the network.
+
+    Only max_workers requests are submitted at a time, each being replaced as
+    it completes, so that stop is checked before every request starts."""
+    logging.info(f'Retrieving {label.lower()} data for {len(player_ids)} ids '
+                 f'with {max_workers} workers')
+    remaining = iter(player_ids)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+
+        def _submit():
+            if stop is not None and stop():
+                return
+            pl = next(remaining, None)
+            if pl is not None:
+                futures[executor.submit(retrieve_data, link.format(pl['id']),
+                                        **request_kwargs)] = pl['id']
+
+        for _ in range(max_workers):
+            _submit()
+        i = 0
+        while futures:
+            completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in completed:
+                if verbose and i % 10 == 0:
+                    logging.info(f"{label} number: {str(i)} of "
+                                 f"{str(len(player_ids))}")
+                i += 1
+                # Drop the reference to the future so its result can be freed
+                # once the caller has finished with it
+                yield futures.pop(future), future.result()
+                _submit()
+
+
+def _latch(stop):
+    """Wrap stop so that once it has returned True it always does"""
+    stopped = False
+
+    def _stop():
+        nonlocal stopped
+        stopped = stopped or stop()
+        return stopped
+    return _stop
+
+
+def retrieve_player_details(link, player_ids, verbose=False, max_workers=1,
+                            sink=None, journal=None, dead_letter_passes=1,
+                            stop=None, **request_kwargs):
+    """For each player - retrieve a dictionary of their data by cycling through
+    their player_ids (derived from main data set). Set verbose=True to print
+    output for every one in ten players. Set max_workers above 1 to fetch up to
+    that many players concurrently; the returned dictionary is ordered as
+    player_ids regardless. Other keyword arguments (session, cache, limiter,
+    ...) are passed to retrieve_data.
+
+    Players which fail are put in a dead-letter queue and retried, one at a
+    time, in up to dead_letter_passes passes at the end. Players still failing
+    are logged and left out rather than stored as None.
+
+    If a PlayerJournal is given, players already in it are not retrieved
+    again and each newly retrieved player is added to it.
+
+    If stop (a callable) returns True no more requests are started and
+    ExtractStopped is raised once those in progress have finished, leaving
+    the rest to a later call resuming from the journal.
 
-    return players_full
+    If a sink (e.g. NdjsonWriter) is given, each player is written to it as
+    soon as it is retrieved rather than being kept, and None is returned."""
+    retrieved = {}
+    done = set()
+    if stop is not None:
+        stop = _latch(stop)
 
+    def _keep(player_id, data):
+        done.add(player_id)
+        if sink is not None:
+            sink.write(player_id, data)
+        else:
+            retrieved[player_id] = data
 
-def retrieve_data(link):
-    """Retrieve JSON formatted data from an API endpoint (link)"""
+    wanted = {pl['id'] for pl in player_ids}
+    to_retrieve = player_ids
+    if journal is not None:
+        resumed = wanted & set(journal.completed)
+        if resumed:
+            logging.info(f'Resuming from journal with {len(resumed)} of '
+                         f'{len(player_ids)} players already retrieved')
+        for player_id in resumed:
+            _keep(player_id, journal.completed[player_id])
+        to_retrieve = [pl for pl in player_ids if pl['id'] not in resumed]
+
+    dead_letters = []
+    players = iter_player_details(link, to_retrieve, verbose=verbose,
+                                  max_workers=max_workers, stop=stop,
+                                  **request_kwargs)
+    for attempt in range(dead_letter_passes + 1):
+        if attempt > 0:
+            if not dead_letters:
+                break
+            logging.warning(f'Retrying {len(dead_letters)} failed players '
+                            f'(pass {attempt} of {dead_letter_passes})')
+            players = iter_player_details(
+                link, [{'id': player_id} for player_id in dead_letters],
+                stop=stop, **request_kwargs)
+            dead_letters = []
+        for player_id, data in players:
+            if data is None:
+                dead_letters.append(player_id)
+                continue
+            if journal is not None:
+                journal.write(player_id, data)
+            _keep(player_id, data)
+        if stop is not None and stop() and wanted - done:
+            raise ExtractStopped(f'Stopped with {len(wanted - done)} players '
+                                 f'left to retrieve')
+
+    if dead_letters:
+        logging.error(f'Could not retrieve {len(dead_letters)} players, '
+                      f'leaving out ids: {sorted(dead_letters)}')
+    if sink is not None:
+        return None
+    # Keep the same ordering as a serial run so saved output is unchanged
+    return {pl['id']: retrieved[pl['id']] for pl in player_ids
+            if pl['id'] in retrieved}
+
+
+def retrieve_data(link, session=None, retries=3, backoff_factor=0.5,
+                  timeout=30, raise_errors=False, cache=None, limiter=None,
+                  metrics=None):
+    """Retrieve JSON formatted data from an API endpoint (link)
+
+    Requests go through session (or the shared session if None) so that
+    connections are reused. Connection errors, timeouts, interrupted
+    responses and 429/5xx responses are retried up to retries times with
+    exponential backoff. If every attempt fails (or any other request error
+    occurs) the error is logged and None returned, or raised if raise_errors.
+    If a ValidatorCache is given the request is conditional and the cached
+    body is used when the API responds 304 Not Modified. If a RateLimiter is
+    given each attempt waits for it, and it is told of throttled and healthy
+    responses. If an ExtractMetrics is given the request is recorded in it.
+    """
+    session = session or get_session()
+    headers = cache.request_headers(link) if cache is not None else {}
     logging.info(f'Reading data from link ({link}')
+    start = time.perf_counter()
+
+    def _record(status, latency, size=0, parse=0):
+        if metrics is not None:
+            metrics.record(link, status, latency, time.perf_counter() - start,
+                           size, attempt, parse)
+
+    for attempt in range(retries + 1):
+        retry_after = None
+        if limiter is not None:
+            limiter.acquire()
+        attempt_start = time.perf_counter()
+        response = None
+        try:
+            response = session.get(link, timeout=timeout, headers=headers)
+            if response.status_code in RETRY_STATUSES:
+                retry_after = parse_retry_after(response)
+            if limiter is not None:
+                if response.status_code == 429 or retry_after is not None:
+                    limiter.throttled(retry_after)
+                elif response.status_code < 400:
+                    limiter.succeeded()
+            response.raise_for_status()
+        except requests.exceptions.RequestException as err:
+            if isinstance(err, requests.exceptions.HTTPError):
+                retryable = err.response.status_code in RETRY_STATUSES
+            else:
+                retryable = isinstance(err, RETRY_ERRORS)
+            if retryable and attempt < retries:
+                delay = backoff_delay(attempt, backoff_factor,
+                                      retry_after=retry_after)
+                logging.warning(f'Retrying link {link} in {delay:.2f}s '
+                                f'after error: {err}')
+                time.sleep(delay)
+                continue
+            logging.warning(
+                f'Could not load from link {link} with error: {err}')
+            _record(getattr(response, 'status_code', None),
+                    time.perf_counter() - attempt_start)
+            if raise_errors:
+                raise
+            return None
+        else:
+            latency = time.perf_counter() - attempt_start
+            if response.status_code == 304:
+                logging.info(f'Link {link} not modified, using cached data')
+                body = cache.load_body(link)
+            else:
+                logging.info(f'Link {link} successfully accessed')
+                if cache is not None:
+                    cache.store(link, response)
+                body = response.content
+            parse_start = time.perf_counter()
+            # Decode straight from bytes, skipping the decode to str
+            data = json_codec.loads(body)
+            _record(response.status_code, latency, len(response.content),
+                    time.perf_counter() - parse_start)
+            return data
+
+
+def changed_player_ids(elements, previous_elements,
+                       fields=PLAYER_CHANGE_FIELDS):
+    """Ids of players in elements (bootstrap-static) which are new or differ
+    in any of fields from previous_elements"""
+    previous = {pl['id']: pl for pl in previous_elements}
+    changed = set()
+    for pl in elements:
+        prev = previous.get(pl['id'])
+        if prev is None or any(pl.get(fld) != prev.get(fld) for fld in fields):
+            changed.add(pl['id'])
+    return changed
+
+
+def changed_fixture_teams(fixtures, previous_fixtures,
+                          fields=FIXTURE_CHANGE_FIELDS):
+    """Ids of teams with a fixture which is new or differs in any of fields.
+    These players' remaining fixtures in element-summary will have changed."""
+    previous = {fx['id']: fx for fx in previous_fixtures}
+    teams = set()
+    for fx in fixtures:
+        prev = previous.get(fx['id'])
+        if prev is None or any(fx.get(fld) != prev.get(fld) for fld in fields):
+            teams.update((fx['team_h'], fx['team_a']))
+    return teams
+
+
+def merge_player_details(previous_players, updated_players, player_ids):
+    """Combine players retrieved in this run with those from a previous run,
+    keeping only players in player_ids and in that order. Players retrieved
+    in neither are left out. Keys of previous_players may be strings as
+    loaded from JSON."""
+    previous = {int(k): v for k, v in previous_players.items()}
+    merged = {}
+    for pl in player_ids:
+        player_id = pl['id']
+        if player_id in updated_players:
+            merged[player_id] = updated_players[player_id]
+        elif previous.get(player_id) is not None:
+            merged[player_id] = previous[player_id]
+    return merged
+
+
+def shard_players(player_ids, shard_index, shard_count):
+    """Players of player_ids in shard shard_index of shard_count, partitioned
+    by id so that every shard can select its players independently"""
+    return [pl for pl in player_ids if pl['id'] % shard_count == shard_index]
+
+
+def shard_name(data_name, shard_index, shard_count):
+    """Name under which a shard saves its part of data_name"""
+    return f'{data_name}.shard-{shard_index}-of-{shard_count}'
+
+
+def merge_player_shards(shards, player_ids):
+    """Combine the players retrieved by each shard, ordered as player_ids as
+    a single run would be. Keys may be strings as loaded from JSON."""
+    combined = {}
+    for shard in shards:
+        combined.update({int(k): v for k, v in shard.items()})
+    missing = [pl['id'] for pl in player_ids if pl['id'] not in combined]
+    if missing:
+        logging.warning(f'{len(missing)} players missing from shards, '
+                        f'ids: {missing}')
+    return {pl['id']: combined[pl['id']] for pl in player_ids
+            if pl['id'] in combined}
+
+
+def load_intermediate_data(data_name, data_loc, extension='json'):
+    """Load unedited data saved by save_intermediate_data, returning None if
+    it does not exist"""
+    logging.info(f'Loading {data_name} from {data_loc}')
     try:
-        response = requests.get(link)
-        response.raise_for_status()
-    except Exception as err:
-        logging.warning(
-            f'Could not load from link {link} with error: {err}')
-    else:
-        logging.info(f'Link {link} successfully accessed')
-        return json.loads(response.text)
+        with open_file(os.path.join(data_loc, f'{data_name}.{extension}'),
+                       'rb') as f:
+            return json_codec.load(f)
+    except FileNotFoundError:
+        logging.warning(f'No previous {data_name} found in {data_loc}')
 
 
-def save_intermediate_data(data, data_name, data_loc):
-    """Save unedited data as JSON files"""
+def save_intermediate_data(data, data_name, data_loc, extension='json'):
+    """Save unedited data as JSON files. An extension of json.gz or json.zst
+    compresses the file as it is written."""
     logging.info(f'Saving {data_name} as JSON in {data_loc}')
     try:
-        with open(os.path.join(data_loc, f'{data_name}.json'), 'w') as f:
-            json.dump(data, f)
+        with open_file(os.path.join(data_loc, f'{data_name}.{extension}'),
+                       'wb') as f:
+            json_codec.dump(data, f)
     except FileNotFoundError as e:
         logging.exception('Unable to find save location')
     else:
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+
+import aiohttp
+
+from extract import RETRY_STATUSES, backoff_delay, parse_retry_after
+from fpltools import json_codec
+
+
+async def _fetch_json(session, semaphore, link, retries=3,
+                      backoff_factor=0.5, raise_errors=False, limiter=None):
+    """Retrieve JSON formatted data from an API endpoint (link) as a coroutine.
+    As with retrieve_data, 429/5xx responses and connection errors are retried
+    with backoff, failures (including invalid JSON) are logged and None is
+    returned, or raised if raise_errors, and requests are paced by limiter if
+    given."""
+    for attempt in range(retries + 1):
+        retry_after = None
+        async with semaphore:
+            if limiter is not None:
+                await limiter.acquire_async()
+            logging.info(f'Reading data from link ({link}')
+            try:
+                async with session.get(link) as response:
+                    if response.status in RETRY_STATUSES:
+                        retry_after = parse_retry_after(response)
+                    if limiter is not None:
+                        if response.status == 429 or retry_after is not None:
+                            limiter.throttled(retry_after)
+                        elif response.status < 400:
+                            limiter.succeeded()
+                    response.raise_for_status()
+                    body = await response.read()
+                data = json_codec.loads(body)
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    ValueError) as err:
+                # Invalid JSON (a ValueError) will not be fixed by retrying
+                status = getattr(err, 'status', None)
+                retryable = not isinstance(err, ValueError) \
+                    and (status is None or status in RETRY_STATUSES)
+                if not retryable or attempt == retries:
+                    logging.warning(
+                        f'Could not load from link {link} with error: '
+                        f'{err!r}')
+                    if raise_errors:
+                        raise
+                    return None
+            else:
+                logging.info(f'Link {link} successfully accessed')
+                return data
+        # Back off outside of the semaphore so other requests can proceed
+        await asyncio.sleep(backoff_delay(attempt, backoff_factor,
+                                          retry_after=retry_after))
+
+
+def _create_session(limit_per_host, timeout):
+    connector = aiohttp.TCPConnector(limit_per_host=limit_per_host)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def retrieve_many_async(links, max_concurrency=50, limit_per_host=20,
+                              timeout=60, limiter=None):
+    """Retrieve every link in links under a single event loop, returning a list
+    of results in the same order. At most max_concurrency requests are in
+    flight at once, and at most limit_per_host connections are opened to any
+    one host. A RateLimiter additionally limits requests per second."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with _create_session(limit_per_host, timeout) as session:
+        return await asyncio.gather(
+            *[_fetch_json(session, semaphore, link, limiter=limiter)
+              for link in links])
+
+
+async def retrieve_extract_async(link_static, link_fixtures, link_player,
+                                 max_concurrency=50, limit_per_host=20,
+                                 timeout=60, verbose=False, limiter=None):
+    """Retrieve bootstrap-static, fixtures and every player's element-summary
+    as coroutines. Static and fixtures are requested together, followed by
+    all players listed in the static data. Returns (main, fixtures, players)
+    where players is keyed by player id as in retrieve_player_details. As in
+    the threaded extract, failing to retrieve static or fixtures raises."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with _create_session(limit_per_host, timeout) as session:
+        main_data, fixtures_data = await asyncio.gather(
+            _fetch_json(session, semaphore, link_static, raise_errors=True,
+                        limiter=limiter),
+            _fetch_json(session, semaphore, link_fixtures, raise_errors=True,
+                        limiter=limiter))
+
+        player_ids = [pl['id'] for pl in main_data['elements']]
+        if verbose:
+            logging.info(f'Retrieving {len(player_ids)} players with up to '
+                         f'{max_concurrency} concurrent requests')
+        players = await asyncio.gather(
+            *[_fetch_json(session, semaphore, link_player.format(player_id),
+                          limiter=limiter)
+              for player_id in player_ids])
+
+    failed = [player_id for player_id, data in zip(player_ids, players)
+              if data is None]
+    if failed:
+        logging.error(f'Could not retrieve {len(failed)} players, leaving '
+                      f'out ids: {failed}')
+    return main_data, fixtures_data, {
+        player_id: data for player_id, data in zip(player_ids, players)
+        if data is not None}
+
+
+def _run(coroutine):
+    """Run a coroutine to completion on a fresh event loop (asyncio.run is not
+    available on Python 3.6)"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def retrieve_many(links, max_concurrency=50, limit_per_host=20, timeout=60,
+                  limiter=None):
+    """Synchronous wrapper around retrieve_many_async"""
+    return _run(retrieve_many_async(links,
+                                    max_concurrency=max_concurrency,
+                                    limit_per_host=limit_per_host,
+                                    timeout=timeout,
+                                    limiter=limiter))
+
+
+def retrieve_extract(link_static, link_fixtures, link_player,
+                     max_concurrency=50, limit_per_host=20, timeout=60,
+                     verbose=False, limiter=None):
+    """Synchronous wrapper around retrieve_extract_async for use in scripts
+    and the extract Lambda"""
+    return _run(retrieve_extract_async(link_static, link_fixtures,
+                                       link_player,
+                                       max_concurrency=max_concurrency,
+                                       limit_per_host=limit_per_host,
+                                       timeout=timeout,
+                                       verbose=verbose,
+                                       limiter=limiter))
@@ -0,0 +1,137 @@
+import logging
+
+from extract import retrieve_data, iter_player_details
+
+# Columns kept from each endpoint's records
+STANDINGS_COLUMNS = ('entry', 'rank', 'last_rank', 'total', 'event_total',
+                     'entry_name', 'player_name')
+PICKS_COLUMNS = ('entry', 'event', 'element', 'position', 'multiplier',
+                 'is_captain', 'is_vice_captain')
+HISTORY_COLUMNS = ('entry', 'event', 'points', 'total_points', 'rank',
+                   'overall_rank', 'value', 'bank', 'event_transfers',
+                   'event_transfers_cost', 'points_on_bench')
+TRANSFERS_COLUMNS = ('entry', 'event', 'element_in', 'element_in_cost',
+                     'element_out', 'element_out_cost', 'time')
+
+
+class ColumnTable:
+    """Records stored column by column (a list per column), which is far
+    more compact than a list of dictionaries for thousands of managers and
+    saves as JSON of the form {column: [values]}
+
+    columns: tuple
+        names of the columns, taken from the keys of each record
+    """
+
+    def __init__(self, columns):
+        self.columns = {col: [] for col in columns}
+
+    def append(self, record, **values):
+        """Add a record, with values overriding (or adding to) its fields"""
+        for col, column in self.columns.items():
+            column.append(values[col] if col in values else record.get(col))
+
+    def __len__(self):
+        return len(self.columns[next(iter(self.columns))])
+
+
+def retrieve_league_entries(link, league_id, max_pages=None,
+                            **request_kwargs):
+    """Page through the standings of classic league league_id, returning a
+    ColumnTable of STANDINGS_COLUMNS with one row per entry"""
+    standings = ColumnTable(STANDINGS_COLUMNS)
+    page = 1
+    while max_pages is None or page <= max_pages:
+        data = retrieve_data(link.format(league_id, page), raise_errors=True,
+                             **request_kwargs)
+        for row in data['standings']['results']:
+            standings.append(row)
+        if not data['standings']['has_next']:
+            break
+        page += 1
+    logging.info(f'Found {len(standings)} entries in league {league_id}')
+    return standings
+
+
+def _iter_entries(link, entry_ids, max_workers, request_kwargs):
+    """Retrieve link for each entry, yielding (entry_id, data) as each
+    completes. Only max_workers requests are in flight at once so memory is
+    bounded whatever the number of entries."""
+    logging.info(f'Retrieving {link} for {len(entry_ids)} entries')
+    entries = [{'id': entry_id} for entry_id in entry_ids]
+    for entry_id, data in iter_player_details(link, entries,
+                                              max_workers=max_workers,
+                                              label='Entry',
+                                              **request_kwargs):
+        if data is None:
+            logging.warning(f'Could not retrieve entry {entry_id} from '
+                            f'{link}')
+            continue
+        yield entry_id, data
+
+
+def retrieve_entry_picks(link, entry_ids, gameweeks, max_workers=1,
+                         **request_kwargs):
+    """Each entry's picks for each of gameweeks as a ColumnTable of
+    PICKS_COLUMNS"""
+    picks = ColumnTable(PICKS_COLUMNS)
+    for gw in gameweeks:
+        # Leave the entry placeholder to be filled for each entry
+        link_gw = link.format('{}', gw)
+        for entry_id, data in _iter_entries(link_gw, entry_ids, max_workers,
+                                            request_kwargs):
+            for pick in data['picks']:
+                picks.append(pick, entry=entry_id, event=gw)
+    return picks
+
+
+def retrieve_entry_history(link, entry_ids, max_workers=1,
+                           **request_kwargs):
+    """Each entry's gameweek history this season as a ColumnTable of
+    HISTORY_COLUMNS"""
+    history = ColumnTable(HISTORY_COLUMNS)
+    for entry_id, data in _iter_entries(link, entry_ids, max_workers,
+                                        request_kwargs):
+        for row in data['current']:
+            history.append(row, entry=entry_id)
+    return history
+
+
+def retrieve_entry_transfers(link, entry_ids, max_workers=1,
+                             **request_kwargs):
+    """Each entry's transfers this season as a ColumnTable of
+    TRANSFERS_COLUMNS"""
+    transfers = ColumnTable(TRANSFERS_COLUMNS)
+    for entry_id, data in _iter_entries(link, entry_ids, max_workers,
+                                        request_kwargs):
+        for row in data:
+            transfers.append(row, entry=entry_id)
+    return transfers
+
+
+def effective_ownership(picks):
+    """Effective ownership of each element in each gameweek from picks: the
+    sum of pick multipliers (2 for captain, 3 for triple captain, 0 on the
+    bench) over the number of entries with picks that gameweek. Returned as
+    a ColumnTable of event, element and effective_ownership.
+
+    Picks are as made at the deadline, so automatic substitutions are not
+    applied: a starter who did not play still counts, the substitute who
+    replaced them does not, and the captain's multiplier is not passed to
+    the vice captain."""
+    entries = {}
+    multipliers = {}
+    cols = picks.columns
+    for entry, event, element, multiplier in zip(cols['entry'],
+                                                 cols['event'],
+                                                 cols['element'],
+                                                 cols['multiplier']):
+        entries.setdefault(event, set()).add(entry)
+        multipliers[(event, element)] = \
+            multipliers.get((event, element), 0) + multiplier
+
+    ownership = ColumnTable(('event', 'element', 'effective_ownership'))
+    for (event, element), total in sorted(multipliers.items()):
+        ownership.append({}, event=event, element=element,
+                         effective_ownership=total / len(entries[event]))
+    return ownership
@@ -0,0 +1,186 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from extract import retrieve_data, retrieve_player_details
+
+# Per-fixture statistics in element-summary history which event/{gw}/live
+# also provides (as totals over the gameweek)
+LIVE_HISTORY_STATS = ('minutes', 'goals_scored', 'assists', 'clean_sheets',
+                      'goals_conceded', 'own_goals', 'penalties_saved',
+                      'penalties_missed', 'yellow_cards', 'red_cards', 'saves',
+                      'bonus', 'bps', 'influence', 'creativity', 'threat',
+                      'ict_index')
+
+def live_gameweeks(main_data):
+    """Ids of gameweeks which have started, i.e. have live data"""
+    return [ev['id'] for ev in main_data['events']
+            if ev['finished'] or ev['is_current']]
+
+
+def retrieve_live_data(link, gameweeks, max_workers=1, **request_kwargs):
+    """Retrieve event/{gw}/live for each of gameweeks, keyed by gameweek"""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda gw: retrieve_data(link.format(gw), raise_errors=True,
+                                     **request_kwargs),
+            gameweeks)
+        return dict(zip(gameweeks, results))
+
+
+def _player_fixtures(team_id, fixtures_data, event_names):
+    """Remaining fixtures for a team in the form of element-summary fixtures"""
+    remaining = [fx for fx in fixtures_data
+                 if not fx['finished'] and team_id in (fx['team_h'],
+                                                       fx['team_a'])]
+    remaining.sort(key=lambda fx: (fx['kickoff_time'] is None,
+                                   fx['kickoff_time'] or '', fx['id']))
+    player_fixtures = []
+    for fx in remaining:
+        is_home = fx['team_h'] == team_id
+        player_fixtures.append({
+            'id': fx['id'],
+            'code': fx['code'],
+            'team_h': fx['team_h'],
+            'team_h_score': fx['team_h_score'],
+            'team_a': fx['team_a'],
+            'team_a_score': fx['team_a_score'],
+            'event': fx['event'],
+            'finished': fx['finished'],
+            'minutes': fx['minutes'],
+            'provisional_start_time': fx['provisional_start_time'],
+            'kickoff_time': fx['kickoff_time'],
+            'event_name': event_names.get(fx['event']),
+            'is_home': is_home,
+            'difficulty': (fx['team_h_difficulty'] if is_home
+                           else fx['team_a_difficulty'])})
+    return player_fixtures
+
+
+def _player_history(player, live_elements, fixtures, team_fixtures,
+                    previous_history):
+    """Element-summary history for player built from live data and their
+    history in a previous extract, or None if it cannot be built exactly"""
+    player_id = player['id']
+    team_id = player['team']
+    previous_rows = {row['fixture']: row for row in previous_history}
+    history = []
+    for gw in sorted(live_elements):
+        element = live_elements[gw].get(player_id)
+        if element is None:
+            # Player was not in the game for this gameweek
+            continue
+        fixture_ids = [ex['fixture'] for ex in element['explain']] \
+            or [fx_id for fx_id in team_fixtures.get((team_id, gw), [])
+                if fixtures[fx_id]['started']]
+        if not fixture_ids:
+            continue
+        fx = fixtures[fixture_ids[0]]
+        if len(fixture_ids) > 1 or team_id not in (fx['team_h'],
+                                                   fx['team_a']):
+            return None
+
+        # The fixture's previous row or, for a newly played fixture, the
+        # player's latest row. Its other fields, including the transfer
+        # market fields (value, selected and transfers) which the live
+        # endpoint does not give, are kept.
+        previous_row = previous_rows.get(fx['id'])
+        if previous_row is None:
+            latest = history or previous_history
+            if not latest:
+                return None
+            previous_row = latest[-1]
+
+        is_home = fx['team_h'] == team_id
+        row = dict(previous_row)
+        row.update({'element': player_id,
+                    'fixture': fx['id'],
+                    'opponent_team': fx['team_a'] if is_home else fx['team_h'],
+                    'total_points': element['stats']['total_points'],
+                    'was_home': is_home,
+                    'kickoff_time': fx['kickoff_time'],
+                    'team_h_score': fx['team_h_score'],
+                    'team_a_score': fx['team_a_score'],
+                    'round': gw})
+        row.update({k: v for k, v in element['stats'].items()
+                    if k in LIVE_HISTORY_STATS or k in previous_row})
+        history.append(row)
+    return history
+
+
+def build_players_from_live(main_data, fixtures_data, live_data,
+                            previous_players=None):
+    """Build each player's element-summary (history, fixtures and
+    history_past) from gameweek live data, fixtures and a previous extract.
+
+    Returns the players keyed by id along with the set of ids which could not
+    be built exactly and must be retrieved from element-summary instead. This
+    is the case for players with more than one fixture in a gameweek (the
+    live endpoint gives gameweek totals), players whose fixture was for a
+    team they are no longer at, and players missing from previous_players or
+    without any history in it. A player's row for a newly played fixture is
+    built from the live stats and their latest previous row, whose transfer
+    market fields (not available elsewhere) it carries over until the player
+    is next retrieved from element-summary.
+    """
+    previous_players = {int(k): v for k, v in
+                        (previous_players or {}).items() if v is not None}
+    fixtures = {fx['id']: fx for fx in fixtures_data}
+    event_names = {ev['id']: ev['name'] for ev in main_data['events']}
+    team_fixtures = {}
+    for fx in fixtures_data:
+        for team_id in (fx['team_h'], fx['team_a']):
+            team_fixtures.setdefault((team_id, fx['event']), []).append(fx['id'])
+
+    live_elements = {gw: {el['id']: el for el in data['elements']}
+                     for gw, data in live_data.items()}
+
+    players = {}
+    fallback = set()
+    for player in main_data['elements']:
+        player_id = player['id']
+        if player_id not in previous_players:
+            fallback.add(player_id)
+            continue
+
+        history = _player_history(player, live_elements, fixtures,
+                                  team_fixtures,
+                                  previous_players[player_id]['history'])
+        if history is None:
+            fallback.add(player_id)
+            continue
+
+        players[player_id] = {
+            'fixtures': _player_fixtures(player['team'], fixtures_data,
+                                         event_names),
+            'history': history,
+            'history_past': previous_players[player_id]['history_past']}
+
+    return players, fallback
+
+
+def retrieve_player_details_live(link_live, link_player, main_data,
+                                 fixtures_data, previous_players=None,
+                                 verbose=False, max_workers=1,
+                                 **request_kwargs):
+    """Alternative to retrieve_player_details which takes per fixture stats
+    from event/{gw}/live (one request per gameweek) rather than one
+    element-summary request per player. Players which cannot be built from
+    the live data and previous_players are retrieved from element-summary.
+    Output is keyed and ordered as retrieve_player_details, and other keyword
+    arguments are passed to retrieve_data."""
+    gameweeks = live_gameweeks(main_data)
+    logging.info(f'Retrieving live data for {len(gameweeks)} gameweeks')
+    live_data = retrieve_live_data(link_live, gameweeks,
+                                   max_workers=max_workers, **request_kwargs)
+
+    players, fallback = build_players_from_live(main_data, fixtures_data,
+                                                live_data, previous_players)
+    logging.info(f'Built {len(players)} players from live data, retrieving '
+                 f'{len(fallback)} from element-summary')
+    players.update(retrieve_player_details(
+        link_player,
+        [pl for pl in main_data['elements'] if pl['id'] in fallback],
+        verbose=verbose, max_workers=max_workers, **request_kwargs))
+
+    return {pl['id']: players[pl['id']] for pl in main_data['elements']
+            if pl['id'] in players}
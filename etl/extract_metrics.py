@@ -0,0 +1,102 @@
+import re
+import math
+import time
+import logging
+import threading
+from urllib.parse import urlparse
+
+from fpltools import json_codec
+
+PERCENTILES = (50, 95, 99)
+
+
+def endpoint_name(link):
+    """Endpoint of a link with ids replaced, e.g. element-summary/{id}/ for
+    every player, so requests to the same endpoint are summarised together"""
+    path = urlparse(link).path
+    path = re.sub(r'^/(api/)?', '', path)
+    return re.sub(r'(?<=/)\d+(?=/|$)', '{id}', path)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values (which must be sorted)"""
+    if not values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+class ExtractMetrics:
+    """Collects a record of each API request made during an extract, and the
+    duration of each stage, for a summary at the end of the run. Pass to
+    retrieve_data (and so retrieve_player_details) as metrics; it may be
+    shared by all threads. Stages are timed by calling mark at the end of
+    each.
+
+    Each request records the endpoint, HTTP status (None if no response),
+    latency of the final attempt and total time including retries and
+    backoff (seconds), response size (bytes), number of retries and time
+    spent decoding JSON (seconds).
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.stages = {}
+        self._last_mark = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, link, status, latency, total, size, retries, parse):
+        with self._lock:
+            self.requests.append({'endpoint': endpoint_name(link),
+                                  'status': status,
+                                  'latency': latency,
+                                  'total': total,
+                                  'bytes': size,
+                                  'retries': retries,
+                                  'parse': parse})
+
+    def mark(self, stage):
+        """Record the time since the previous mark (or creation) as the
+        duration of stage"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self._last_mark
+        self._last_mark = now
+
+    @staticmethod
+    def _distribution(values):
+        values = sorted(values)
+        summary = {f'p{pct}': percentile(values, pct) for pct in PERCENTILES}
+        summary['max'] = values[-1] if values else None
+        summary['sum'] = sum(values)
+        return summary
+
+    def summary(self):
+        """Per endpoint request counts, statuses, bytes and retries, with
+        p50/p95/p99 of latency, total time and JSON decoding time"""
+        with self._lock:
+            requests = list(self.requests)
+        endpoints = {}
+        for req in requests:
+            endpoints.setdefault(req['endpoint'], []).append(req)
+
+        summary = {'stages': dict(self.stages), 'endpoints': {}}
+        for endpoint, reqs in sorted(endpoints.items()):
+            statuses = {}
+            for req in reqs:
+                status = str(req['status'])
+                statuses[status] = statuses.get(status, 0) + 1
+            summary['endpoints'][endpoint] = {
+                'requests': len(reqs),
+                'statuses': statuses,
+                'bytes': sum(req['bytes'] for req in reqs),
+                'retries': sum(req['retries'] for req in reqs),
+                'latency': self._distribution(req['latency'] for req in reqs),
+                'total': self._distribution(req['total'] for req in reqs),
+                'parse': self._distribution(req['parse'] for req in reqs)}
+        return summary
+
+    def save(self, path):
+        """Save the summary as JSON"""
+        with open(path, 'wb') as f:
+            f.write(json_codec.dumps(self.summary()))
+        logging.info(f'Saved extract metrics to {path}')
@@ -5,6 +5,8 @@ import logging
 
 import sqlalchemy.exc as sqlaexc
 
+from fpltools.columnar import read_table
+
 
 def load_pickle_data(data_name, data_loc):
     """Load in transformed and pickled dataframes"""
@@ -19,6 +21,20 @@ def load_pickle_data(data_name, data_loc):
         return loaded
 
 
+def load_parquet_data(data_name, data_loc, columns=None):
+    """Load in a transformed dataframe saved as Parquet, reading only columns
+    (and the index) if given"""
+    logging.info(f'Reading in Parquet {data_name} from {data_loc}')
+    try:
+        loaded = read_table(os.path.join(data_loc, data_name),
+                            columns=columns)
+    except FileNotFoundError as e:
+        logging.exception('Could not find file')
+    else:
+        logging.info(f'Successfully loaded {data_name}')
+        return loaded
+
+
 def table_get_columns(table_name, dbengine):
     with dbengine.connect() as con:
         return con.execute(f"""SELECT * FROM {table_name} LIMIT 0""").keys()
@@ -0,0 +1,165 @@
+import time
+import random
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+from extract import get_session, RETRY_ERRORS
+from extract_live import live_gameweeks
+from fpltools.compression import open_file
+from fpltools.constants import API_URLS, API_URL_BASE
+from fpltools import json_codec
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is not available on Python 3.6
+    daemon_threads = True
+
+
+def _request_path(link):
+    """Path and query of a link, which is what the replay server is asked
+    for"""
+    parsed = urlparse(link)
+    return f'{parsed.path}?{parsed.query}' if parsed.query else parsed.path
+
+
+def recording_links(main_data, entry_ids=()):
+    """Every link the extracts request: the static data and fixtures, plus
+    element-summary for every player and live data for every started
+    gameweek (from main_data), and the entry extract links for each of
+    entry_ids"""
+    links = [API_URLS['static'], API_URLS['fixtures']]
+    gameweeks = live_gameweeks(main_data)
+    links += [API_URLS['player'].format(pl['id'])
+              for pl in main_data['elements']]
+    links += [API_URLS['gameweek_current'].format(gw) for gw in gameweeks]
+    for entry_id in entry_ids:
+        links += [API_URLS['entry'].format(entry_id),
+                  API_URLS['user_history'].format(entry_id),
+                  API_URLS['user_transfers'].format(entry_id)]
+        links += [API_URLS['user_picks'].format(entry_id, gw)
+                  for gw in gameweeks]
+    return links
+
+
+def record_responses(path, entry_ids=(), session=None, timeout=30):
+    """Request every link from recording_links and save the responses to
+    path as newline-delimited JSON objects {"path", "status", "body"}
+    (compressed if path ends .gz or .zst), returning the number saved.
+    Requests which fail to connect or do not return 200 are logged and
+    skipped, so errors when replaying come only from its error_rate."""
+    session = session or get_session()
+    response = session.get(API_URLS['static'], timeout=timeout)
+    response.raise_for_status()
+    main_data = json_codec.loads(response.content)
+    links = recording_links(main_data, entry_ids)
+    logging.info(f'Recording {len(links)} responses to {path}')
+    n_recorded = 0
+    with open_file(path, 'wb') as f:
+        for link in links:
+            try:
+                response = session.get(link, timeout=timeout)
+            except RETRY_ERRORS as err:
+                logging.warning(f'Skipping link {link}: {err}')
+                continue
+            if response.status_code != 200:
+                logging.warning(f'Skipping link {link}: status '
+                                f'{response.status_code}')
+                continue
+            f.write(json_codec.dumps({'path': _request_path(link),
+                                      'status': response.status_code,
+                                      'body': response.text}))
+            f.write(b'\n')
+            n_recorded += 1
+    return n_recorded
+
+
+def load_recording(path):
+    """Responses saved by record_responses keyed by request path as
+    (status, body bytes)"""
+    with open_file(path, 'rb') as f:
+        records = [json_codec.loads(line) for line in f if line.strip()]
+    return {r['path']: (r['status'], r['body'].encode('utf-8'))
+            for r in records}
+
+
+class ReplayServer:
+    """Local HTTP server replaying recorded API responses, for benchmarking
+    and load testing without the live API. Runs on a background thread.
+
+    responses: dict
+        (status, body bytes) keyed by request path, as from load_recording
+    latency: float
+        seconds to wait before each response
+    jitter: float
+        up to this many seconds are added to latency at random
+    error_rate: float
+        fraction of requests answered with 503 Service Unavailable
+    port: int
+        port to listen on, any free port if 0
+    """
+
+    def __init__(self, responses, latency=0, jitter=0, error_rate=0,
+                 host='127.0.0.1', port=0):
+        self.responses = responses
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port),
+                                            self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def api_urls(self):
+        """API_URLS pointing at this server"""
+        base = f'{self.url}{urlparse(API_URL_BASE).path}'
+        return {k: v.replace(API_URL_BASE, base)
+                for k, v in API_URLS.items()}
+
+    def _handler_class(self):
+        replay = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with replay._lock:
+                    replay.requests += 1
+                time.sleep(replay.latency + random.uniform(0, replay.jitter))
+                if random.random() < replay.error_rate:
+                    status, body = 503, b'{}'
+                else:
+                    status, body = replay.responses.get(self.path,
+                                                        (404, b'{}'))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return _Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
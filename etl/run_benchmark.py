@@ -0,0 +1,130 @@
+import time
+import logging
+import argparse
+
+from extract import retrieve_data, retrieve_player_details, create_session
+from replay import ReplayServer, record_responses, load_recording
+from fpltools import json_codec
+
+# Modules whose info logs are dropped while benchmarking
+QUIET_MODULES = ('extract', 'extract_async')
+
+
+def benchmark(name, run, server):
+    """Time run(), returning its wall time and requests per second as seen
+    by the replay server"""
+    requests_before = server.requests
+    start = time.perf_counter()
+    run()
+    wall_time = time.perf_counter() - start
+    requests = server.requests - requests_before
+    result = {'variant': name,
+              'wall_time': wall_time,
+              'requests': requests,
+              'requests_per_second': requests / wall_time}
+    logging.info(f'{name}: {requests} requests in {wall_time:.2f}s '
+                 f'({requests / wall_time:.1f}/s)')
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record FPL API responses, '
+                                                 'or benchmark extraction '
+                                                 'against a local replay of '
+                                                 'them')
+
+    parser.add_argument('recording',
+                        type=str,
+                        help='File of recorded responses, e.g. '
+                             'data/recording.ndjson.gz')
+    parser.add_argument('--record',
+                        action='store_true',
+                        help='Record responses from the live API to '
+                             'recording rather than benchmarking')
+    parser.add_argument('-e',
+                        '--entry-ids',
+                        type=int,
+                        nargs='*',
+                        default=[],
+                        help='Entries whose endpoints to also record')
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0.05,
+                        help='Seconds the replay server waits per response')
+    parser.add_argument('--jitter',
+                        type=float,
+                        default=0.02,
+                        help='Up to this many seconds are added to latency')
+    parser.add_argument('--error-rate',
+                        type=float,
+                        default=0,
+                        help='Fraction of responses to fail with 503')
+    parser.add_argument('-w',
+                        '--max-workers',
+                        type=int,
+                        nargs='+',
+                        default=[1, 8, 16, 32],
+                        help='Thread pool sizes to benchmark')
+    parser.add_argument('--max-concurrency',
+                        type=int,
+                        nargs='*',
+                        default=[50],
+                        help='asyncio concurrency limits to benchmark (needs '
+                             'aiohttp)')
+    parser.add_argument('-o',
+                        '--output',
+                        type=str,
+                        default='logs/benchmark.json',
+                        help='Location to save results as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(levelname)s - %(asctime)s - %(message)s')
+    # Per request logs from the extract would dominate the timings, but
+    # its warnings and errors (e.g. retries) are kept
+    logging.getLogger().addFilter(
+        lambda record: record.levelno >= logging.WARNING
+        or record.module not in QUIET_MODULES)
+
+    if args.record:
+        n_recorded = record_responses(args.recording, args.entry_ids)
+        print(f'Recorded {n_recorded} responses to {args.recording}')
+    else:
+        server = ReplayServer(load_recording(args.recording),
+                              latency=args.latency, jitter=args.jitter,
+                              error_rate=args.error_rate).start()
+        urls = server.api_urls()
+        players = retrieve_data(urls['static'],
+                                raise_errors=True)['elements']
+
+        results = []
+        for workers in args.max_workers:
+            session = create_session(pool_size=max(workers, 1))
+            results.append(benchmark(
+                f'threads-{workers}',
+                lambda: retrieve_player_details(urls['player'], players,
+                                                max_workers=workers,
+                                                session=session),
+                server))
+        if args.max_concurrency:
+            from extract_async import retrieve_extract
+            for concurrency in args.max_concurrency:
+                results.append(benchmark(
+                    f'asyncio-{concurrency}',
+                    lambda: retrieve_extract(urls['static'],
+                                             urls['fixtures'],
+                                             urls['player'],
+                                             max_concurrency=concurrency),
+                    server))
+        server.stop()
+
+        with open(args.output, 'wb') as f:
+            f.write(json_codec.dumps({'latency': args.latency,
+                                      'jitter': args.jitter,
+                                      'error_rate': args.error_rate,
+                                      'players': len(players),
+                                      'results': results}))
+        print(f'{"variant":<16}{"requests":>10}{"wall time":>12}{"req/s":>10}')
+        for r in results:
+            print(f'{r["variant"]:<16}{r["requests"]:>10}'
+                  f'{r["wall_time"]:>11.2f}s{r["requests_per_second"]:>10.1f}')
@@ -1,11 +1,14 @@
+import os
 import logging
 import warnings
 
 import pandas as pd
 import numpy as np
 
-from fpltools.transform import (check_unique_index, check_not_null_index,
-                                pickle_data, pandas_integerstr_to_int)
+from transform import (check_unique_index, check_not_null_index,
+                       save_data, integerstr_to_int, compact_dtypes,
+                       player_dataframes)
+from transform_tables import TABLE_DTYPES
 from fpltools.utils import AwsS3, AwsS3Download
 
 
@@ -30,6 +33,8 @@ OUT_LEAGUE_TABLE = 'league_table'
 s3_bucket = 'fpl-alldata'
 s3_folder = 'etl_staging'
 s3_out_folder = '/transformed'
+# pickle, or parquet (which needs pyarrow in the image)
+OUTPUT_FORMAT = os.environ.get('TRANSFORM_OUTPUT_FORMAT', 'pickle')
 
 if __name__ == '__main__':
     logger = logging.getLogger()
@@ -72,7 +77,7 @@ if __name__ == '__main__':
     df_fixtures.drop(columns=['stats'] + fixtures_drop, inplace=True)
     df_fixtures.rename(columns=fixtures_rename, inplace=True)
     df_fixtures[fixtures_str_cols] = df_fixtures[fixtures_str_cols] \
-        .applymap(pandas_integerstr_to_int)
+        .pipe(integerstr_to_int)
     df_fixtures.sort_values(fixtures_index, inplace=True)
 
     # Case exists where if a fixture has been postponed without being rescheduled,
@@ -124,7 +129,7 @@ if __name__ == '__main__':
     df_gameweeks.drop(columns=gameweek_drop, inplace=True)
     df_gameweeks.rename(columns=gameweek_rename, inplace=True)
     df_gameweeks[gameweek_str_cols] = df_gameweeks[gameweek_str_cols]\
-        .applymap(pandas_integerstr_to_int)
+        .pipe(integerstr_to_int)
     df_gameweeks.sort_values(gameweek_index, inplace=True)
     logging.info('Completed transform of gameweek data')
 
@@ -151,7 +156,7 @@ if __name__ == '__main__':
     df_teams.rename(columns=teams_rename, inplace=True)
     df_teams.drop(columns=teams_drop, inplace=True)
     df_teams[teams_str_cols] = df_teams[teams_str_cols] \
-        .applymap(pandas_integerstr_to_int)
+        .pipe(integerstr_to_int)
     df_teams.sort_values(teams_index, inplace=True)
     logging.info('Completed transform of teams data')
 
@@ -169,7 +174,7 @@ if __name__ == '__main__':
     df_positions.rename(columns=positions_rename, inplace=True)
     df_positions.drop(columns=positions_drop, inplace=True)
     df_positions[positions_str_cols] = df_positions[positions_str_cols] \
-        .applymap(pandas_integerstr_to_int)
+        .pipe(integerstr_to_int)
 
     df_positions.sort_values(positions_index, inplace=True)
     logging.info('Completed transform of positions data')
@@ -194,22 +199,15 @@ if __name__ == '__main__':
     df_players_sum.rename(columns=players_sum_rename, inplace=True)
     df_players_sum.drop(columns=players_sum_drop, inplace=True)
     df_players_sum[players_sum_str_cols] = df_players_sum[players_sum_str_cols] \
-        .applymap(pandas_integerstr_to_int)
+        .pipe(integerstr_to_int)
     df_players_sum.sort_values(players_sum_index, inplace=True)
     logging.info('Completed transform of player summary data')
 
     # Data: players - one row per player per fixture with stats for that
     # fixture only
     logging.info('Extracting players from dictionary into dataframes')
-    df_players_past = []
-    df_players_future = []
-    df_players_prev_seasons = []
-    for k, p in player_data.items():
-        df_players_past.append(pd.DataFrame(p['history']))
-        fut = pd.DataFrame(p['fixtures'])
-        fut['player_id'] = k
-        df_players_future.append(fut)
-        df_players_prev_seasons.append(pd.DataFrame(p['history_past']))
+    df_players_past, df_players_future, df_players_prev_seasons =\
+        player_dataframes(player_data.items())
 
     # Data: player performance in previous seasons
     logging.info('Beginning transform of player previous seasons data')
@@ -218,14 +216,13 @@ if __name__ == '__main__':
     players_prev_seasons_index = ['player_id_long', 'season_name']
     players_prev_seasons_str_cols = ['player_id_long']
 
-    df_players_prev_seasons = pd.concat(df_players_prev_seasons)
     df_players_prev_seasons.rename(columns=players_prev_seasons_rename,
                                    inplace=True)
     df_players_prev_seasons.drop(columns=players_prev_seasons_drop,
                                  inplace=True)
     df_players_prev_seasons[players_prev_seasons_str_cols] =\
         df_players_prev_seasons[players_prev_seasons_str_cols]\
-            .applymap(pandas_integerstr_to_int)
+            .pipe(integerstr_to_int)
     df_players_prev_seasons.sort_values(players_prev_seasons_index,
                                         inplace=True)
     logging.info('Completed transform of player previous seasons data')
@@ -241,7 +238,6 @@ if __name__ == '__main__':
     players_past_drop = ['kickoff_time', 'opponent_team']
     players_past_str_cols = ['player_id', 'fixture_id', 'gameweek_id']
     players_past_index = ['player_id', 'fixture_id']
-    df_players_past = pd.concat(df_players_past)
 
     df_players_past.rename(columns=players_past_rename, inplace=True)
     df_players_past['kickoff_datetime'] = pd.to_datetime(
@@ -249,7 +245,7 @@ if __name__ == '__main__':
         errors='coerce')
     df_players_past.drop(columns=players_past_drop, inplace=True)
     df_players_past[players_past_str_cols] = df_players_past[players_past_str_cols] \
-            .applymap(pandas_integerstr_to_int)
+            .pipe(integerstr_to_int)
     df_players_past = pd.merge(df_players_past, df_fixtures[
         ['fixture_id', 'fixture_id_long', 'away_team_id', 'home_team_id']],
                                how='inner',
@@ -274,7 +270,6 @@ if __name__ == '__main__':
                                'home_team_id',
                                'away_team_id']
     players_future_index = ['player_id', 'fixture_id_long']
-    df_players_future = pd.concat(df_players_future)
     df_players_future.rename(columns=player_future_rename, inplace=True)
     df_players_future['kickoff_datetime'] =\
         pd.to_datetime(df_players_future['kickoff_time'], errors='coerce')
@@ -293,7 +288,7 @@ if __name__ == '__main__':
         df_players_future = df_players_future[~missing_gameweek_player_rows]
 
     df_players_future[players_future_str_cols] = df_players_future[players_future_str_cols] \
-        .applymap(pandas_integerstr_to_int)
+        .pipe(integerstr_to_int)
 
     df_players_future = pd.merge(df_players_future,
                                  df_fixtures[['fixture_id',
@@ -399,7 +394,7 @@ if __name__ == '__main__':
     df_table.sort_values(['points', 'goal_difference', 'goals_scored'],
                          ascending=False,
                          inplace=True)
-    df_table[tbl_cols] = df_table[tbl_cols].applymap(pandas_integerstr_to_int)
+    df_table[tbl_cols] = df_table[tbl_cols].pipe(integerstr_to_int)
     df_table.reset_index(drop=True, inplace=True)
     df_table.index.rename('table_position', inplace=True)
     logging.info('Completed transform of Premier League table data')
@@ -464,34 +459,23 @@ if __name__ == '__main__':
                          raise_errors=True)
 
 
-    # Pickle dataframes so as to retain column information (types etc.) and
-    # indexes
-    logging.info('Pickling final dataframes')
-    pickle_data(df_fixtures, OUT_FIXTURES, DATA_LOC)
-    pickle_data(df_gameweeks, OUT_GAMEWEEKS, DATA_LOC)
-    pickle_data(df_teams, OUT_TEAMS, DATA_LOC)
-    pickle_data(df_positions, OUT_POSITIONS, DATA_LOC)
-    pickle_data(df_players_sum, OUT_PLAYERS_SUM, DATA_LOC)
-    pickle_data(df_players_prev_seasons, OUT_PLAYERS_PREVIOUS_SEASONS, DATA_LOC)
-    pickle_data(df_players_past, OUT_PLAYERS_PAST, DATA_LOC)
-    pickle_data(df_players_future, OUT_PLAYERS_FUTURE, DATA_LOC)
-    pickle_data(df_players_full, OUT_PLAYERS_FULL, DATA_LOC)
-    pickle_data(df_team_results, OUT_TEAM_RESULTS, DATA_LOC)
-    pickle_data(df_table, OUT_LEAGUE_TABLE, DATA_LOC)
-
-
-    dfiles = [f'{DATA_LOC}/{OUT_FIXTURES}.pkl',
-              f'{DATA_LOC}/{OUT_GAMEWEEKS}.pkl',
-              f'{DATA_LOC}/{OUT_TEAMS}.pkl',
-              f'{DATA_LOC}/{OUT_POSITIONS}.pkl',
-              f'{DATA_LOC}/{OUT_PLAYERS_SUM}.pkl',
-              f'{DATA_LOC}/{OUT_PLAYERS_PREVIOUS_SEASONS}.pkl',
-              f'{DATA_LOC}/{OUT_PLAYERS_PAST}.pkl',
-              f'{DATA_LOC}/{OUT_PLAYERS_FUTURE}.pkl',
-              f'{DATA_LOC}/{OUT_PLAYERS_FULL}.pkl',
-              f'{DATA_LOC}/{OUT_TEAM_RESULTS}.pkl',
-              f'{DATA_LOC}/{OUT_LEAGUE_TABLE}.pkl'
-              ]
+    # Save dataframes, with compact dtypes, in a format which retains column
+    # information (types etc.) and indexes
+    logging.info(f'Saving final dataframes as {OUTPUT_FORMAT}')
+    outputs = [(df_fixtures, OUT_FIXTURES),
+               (df_gameweeks, OUT_GAMEWEEKS),
+               (df_teams, OUT_TEAMS),
+               (df_positions, OUT_POSITIONS),
+               (df_players_sum, OUT_PLAYERS_SUM),
+               (df_players_prev_seasons, OUT_PLAYERS_PREVIOUS_SEASONS),
+               (df_players_past, OUT_PLAYERS_PAST),
+               (df_players_future, OUT_PLAYERS_FUTURE),
+               (df_players_full, OUT_PLAYERS_FULL),
+               (df_team_results, OUT_TEAM_RESULTS),
+               (df_table, OUT_LEAGUE_TABLE)]
+    dfiles = [save_data(compact_dtypes(df, name, TABLE_DTYPES[name]),
+                        name, DATA_LOC, OUTPUT_FORMAT, TABLE_DTYPES[name])
+              for df, name in outputs]
 
     s3 = AwsS3()
     s3.upload(dfiles, s3_bucket, s3_folder + s3_out_folder)
@@ -1,10 +1,19 @@
+import os
 import logging
 import argparse
 
 from extract import (retrieve_data, retrieve_player_details,
-                              save_intermediate_data)
+                     save_intermediate_data, create_session,
+                     ValidatorCache, load_intermediate_data,
+                     changed_player_ids, changed_fixture_teams,
+                     merge_player_details, NdjsonWriter, RateLimiter,
+                     PlayerJournal, shard_players, shard_name,
+                     merge_player_shards)
+from extract_live import retrieve_player_details_live
+from extract_metrics import ExtractMetrics
 from fpltools.constants import API_URLS
-from fpltools.utils import AwsS3
+from fpltools.compression import CODEC_SUFFIXES
+from fpltools.utils import AwsS3, AwsS3Pipeline
 
 FILE_STRING_FIXTURES = 'fixtures'
 FILE_STRING_PLAYERS = 'players'
@@ -15,6 +24,11 @@ if __name__ == '__main__':
                                                  'website endpoints and save'
                                                  'as JSON')
 
+    parser.add_argument('-p',
+                        '--pipeline-upload',
+                        action='store_true',
+                        help='Upload to S3 in the background as data is '
+                             'retrieved rather than once all is saved')
     parser.add_argument('--data_location',
                         type=str,
                         default='data/',
@@ -42,33 +56,307 @@ if __name__ == '__main__':
                         type=str,
                         default='logs/extract.log',
                         help='Location to save logs locally')
+    parser.add_argument('--metrics-file',
+                        type=str,
+                        default=None,
+                        help='Location to save a JSON summary of request '
+                             'latency, sizes and retries. Defaults to '
+                             'extract_metrics.json next to the log file.')
+    parser.add_argument('-w',
+                        '--max-workers',
+                        type=int,
+                        default=16,
+                        help='Number of players to retrieve concurrently')
+    parser.add_argument('--pool-size',
+                        type=int,
+                        default=20,
+                        help='Number of keep-alive connections to pool')
+    parser.add_argument('-c',
+                        '--cache-location',
+                        type=str,
+                        default=None,
+                        help='path in which to cache responses so that '
+                             'unchanged data is not downloaded again')
+    parser.add_argument('-a',
+                        '--use-async',
+                        action='store_true',
+                        help='Retrieve all endpoints under one asyncio event '
+                             'loop instead of a thread pool')
+    parser.add_argument('--max-concurrency',
+                        type=int,
+                        default=50,
+                        help='Maximum requests in flight when using --use-async')
+    parser.add_argument('--limit-per-host',
+                        type=int,
+                        default=20,
+                        help='Maximum connections per host when using '
+                             '--use-async')
+    parser.add_argument('-r',
+                        '--rate-limit',
+                        type=float,
+                        default=None,
+                        help='Maximum requests per second, reduced '
+                             'automatically if the API throttles requests')
+    parser.add_argument('--burst',
+                        type=int,
+                        default=10,
+                        help='Requests which may be made at once within '
+                             '--rate-limit')
+    parser.add_argument('-i',
+                        '--incremental',
+                        action='store_true',
+                        help='Only retrieve players which have changed since '
+                             'the data previously saved in data_location')
+    parser.add_argument('--use-live',
+                        action='store_true',
+                        help='Build player history from one live request per '
+                             'gameweek, using the players previously saved in '
+                             'data_location for fields the live data lacks')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Resume retrieving players from the journal of '
+                             'an interrupted extract in data_location')
+    parser.add_argument('--shard-count',
+                        type=int,
+                        default=None,
+                        help='Split players by id into this many shards, '
+                             'retrieving only --shard-index. Shard 0 also '
+                             'saves static and fixtures data.')
+    parser.add_argument('--shard-index',
+                        type=int,
+                        default=None,
+                        help='Shard to retrieve, from 0 to --shard-count - 1')
+    parser.add_argument('--merge-shards',
+                        type=int,
+                        default=None,
+                        help='Instead of retrieving, merge this many shards '
+                             'saved in data_location into the players file')
+    parser.add_argument('--stream-players',
+                        action='store_true',
+                        help='Write each player to '
+                             f'{FILE_STRING_PLAYERS}.ndjson as it is '
+                             'retrieved rather than holding all in memory')
+    parser.add_argument('--compression',
+                        type=str,
+                        choices=list(CODEC_SUFFIXES),
+                        default='none',
+                        help='Codec with which to compress saved data')
     args = parser.parse_args()
 
+    if args.rate_limit is not None and args.rate_limit <= 0:
+        parser.error('--rate-limit must be positive')
+    if args.incremental and args.use_async:
+        parser.error('--incremental cannot be combined with --use-async')
+    if args.use_live and (args.use_async or args.incremental):
+        parser.error('--use-live cannot be combined with --use-async or '
+                     '--incremental')
+    if args.resume and args.use_async:
+        parser.error('--resume cannot be combined with --use-async')
+    sharded = args.shard_count is not None or args.shard_index is not None
+    if sharded and not (args.shard_count is not None
+                        and args.shard_index is not None
+                        and 0 <= args.shard_index < args.shard_count):
+        parser.error('--shard-count and --shard-index must be given together '
+                     'with 0 <= --shard-index < --shard-count')
+    if (sharded or args.merge_shards) and (args.use_async or args.incremental
+                                           or args.use_live
+                                           or args.stream_players):
+        parser.error('--shard-count and --merge-shards cannot be combined '
+                     'with --use-async, --incremental, --use-live or '
+                     '--stream-players')
+    if sharded and args.merge_shards:
+        parser.error('--merge-shards cannot be combined with --shard-count')
+    if args.stream_players and (args.use_async or args.incremental
+                                or args.use_live):
+        parser.error('--stream-players cannot be combined with --use-async, '
+                     '--incremental or --use-live')
+
     DATA_LOC = args.data_location
+    EXT_JSON = f'json{CODEC_SUFFIXES[args.compression]}'
+    EXT_NDJSON = f'ndjson{CODEC_SUFFIXES[args.compression]}'
+    PLAYERS_NAME = shard_name(FILE_STRING_PLAYERS, args.shard_index,
+                              args.shard_count) \
+        if sharded else FILE_STRING_PLAYERS
+    JOURNAL = os.path.join(DATA_LOC, f'{PLAYERS_NAME}.journal.ndjson')
 
     logging.basicConfig(level=logging.INFO,
                         filename=args.log_file,
                         filemode='w',
                         format='%(levelname)s - %(asctime)s - %(message)s')
 
-    main_data = retrieve_data(API_URLS['static'])
-    fixtures_data = retrieve_data(API_URLS['fixtures'])
-    player_data = retrieve_player_details(API_URLS['player'],
-                                          main_data['elements'],
-                                          verbose=True)
+    metrics = ExtractMetrics()
+    metrics_file = args.metrics_file or os.path.join(
+        os.path.dirname(args.log_file), 'extract_metrics.json')
+    # Files are uploaded as soon as each is complete if pipelining uploads
+    s3_pipeline = AwsS3Pipeline(args.s3_bucket, args.s3_folder) \
+        if args.pipeline_upload and not (args.skip_s3_upload or sharded) \
+        else None
+    uploaded = []
 
-    save_intermediate_data(main_data, FILE_STRING_MAIN, DATA_LOC)
-    save_intermediate_data(fixtures_data, FILE_STRING_FIXTURES, DATA_LOC)
-    save_intermediate_data(player_data, FILE_STRING_PLAYERS, DATA_LOC)
+    limiter = RateLimiter(args.rate_limit, burst=args.burst) \
+        if args.rate_limit is not None else None
 
-    if not args.skip_s3_upload:
-        dfiles = [f'{DATA_LOC}/{FILE_STRING_FIXTURES}.json',
-                  f'{DATA_LOC}/{FILE_STRING_MAIN}.json',
-                  f'{DATA_LOC}/{FILE_STRING_PLAYERS}.json']
+    if args.merge_shards:
+        main_data = load_intermediate_data(FILE_STRING_MAIN, DATA_LOC,
+                                           EXT_JSON)
+        fixtures_data = load_intermediate_data(FILE_STRING_FIXTURES, DATA_LOC,
+                                               EXT_JSON)
+        shards = [load_intermediate_data(
+                      shard_name(FILE_STRING_PLAYERS, i, args.merge_shards),
+                      DATA_LOC, EXT_JSON)
+                  for i in range(args.merge_shards)]
+        if main_data is None or None in shards:
+            raise FileNotFoundError(f'Static data and all {args.merge_shards}'
+                                    f' shards must be in {DATA_LOC} to merge')
+        player_data = merge_player_shards(shards, main_data['elements'])
+    elif args.use_async:
+        # aiohttp is only required for the asyncio engine
+        from extract_async import retrieve_extract
+        main_data, fixtures_data, player_data = retrieve_extract(
+            API_URLS['static'],
+            API_URLS['fixtures'],
+            API_URLS['player'],
+            max_concurrency=args.max_concurrency,
+            limit_per_host=args.limit_per_host,
+            verbose=True,
+            limiter=limiter)
+    else:
+        session = create_session(pool_size=args.pool_size)
+        cache = ValidatorCache(args.cache_location) \
+            if args.cache_location else None
+        main_data = retrieve_data(API_URLS['static'], session=session,
+                                  raise_errors=True, cache=cache,
+                                  limiter=limiter, metrics=metrics)
+        fixtures_data = retrieve_data(API_URLS['fixtures'], session=session,
+                                      raise_errors=True, cache=cache,
+                                      limiter=limiter, metrics=metrics)
+        players_to_retrieve = main_data['elements']
+        if sharded:
+            players_to_retrieve = shard_players(players_to_retrieve,
+                                                args.shard_index,
+                                                args.shard_count)
+            logging.info(f'Shard {args.shard_index} of {args.shard_count}: '
+                         f'retrieving {len(players_to_retrieve)} players')
+        if not args.resume and os.path.exists(JOURNAL):
+            os.remove(JOURNAL)
+        journal = PlayerJournal(JOURNAL)
+
+        if args.incremental:
+            previous_main = load_intermediate_data(FILE_STRING_MAIN, DATA_LOC,
+                                                   EXT_JSON)
+            previous_fixtures = load_intermediate_data(FILE_STRING_FIXTURES,
+                                                       DATA_LOC, EXT_JSON)
+            previous_players = load_intermediate_data(FILE_STRING_PLAYERS,
+                                                      DATA_LOC, EXT_JSON)
+            if None in (previous_main, previous_fixtures, previous_players):
+                logging.warning('Previous data incomplete, retrieving all '
+                                'players')
+                args.incremental = False
+            else:
+                changed = changed_player_ids(main_data['elements'],
+                                             previous_main['elements'])
+                teams = changed_fixture_teams(fixtures_data,
+                                              previous_fixtures)
+                # Includes players stored as null after a failed request
+                missing = {pl['id'] for pl in main_data['elements']
+                           if previous_players.get(str(pl['id'])) is None}
+                players_to_retrieve = [pl for pl in main_data['elements']
+                                       if pl['id'] in changed
+                                       or pl['team'] in teams
+                                       or pl['id'] in missing]
+                logging.info(f'Incremental extract: {len(players_to_retrieve)}'
+                             f' of {len(main_data["elements"])} players '
+                             f'changed')
+
+        if s3_pipeline is not None:
+            for data, name in ((main_data, FILE_STRING_MAIN),
+                               (fixtures_data, FILE_STRING_FIXTURES)):
+                save_intermediate_data(data, name, DATA_LOC, EXT_JSON)
+                uploaded.append(f'{DATA_LOC}/{name}.{EXT_JSON}')
+            s3_pipeline.upload(uploaded)
+
+        if args.use_live:
+            player_data = retrieve_player_details_live(
+                API_URLS['gameweek_current'],
+                API_URLS['player'],
+                main_data,
+                fixtures_data,
+                load_intermediate_data(FILE_STRING_PLAYERS, DATA_LOC,
+                                       EXT_JSON),
+                verbose=True,
+                max_workers=args.max_workers,
+                session=session,
+                cache=cache,
+                limiter=limiter,
+                metrics=metrics)
+        elif args.stream_players:
+            players_stream = os.path.join(DATA_LOC,
+                                          f'{FILE_STRING_PLAYERS}.{EXT_NDJSON}')
+            stream_upload = s3_pipeline.stream(players_stream) \
+                if s3_pipeline is not None else None
+            with NdjsonWriter(players_stream, upload=stream_upload) as sink:
+                retrieve_player_details(API_URLS['player'],
+                                        players_to_retrieve,
+                                        verbose=True,
+                                        max_workers=args.max_workers,
+                                        session=session,
+                                        cache=cache,
+                                        limiter=limiter,
+                                        metrics=metrics,
+                                        journal=journal,
+                                        sink=sink)
+            player_data = None
+            if stream_upload is not None:
+                uploaded.append(f'{DATA_LOC}/{FILE_STRING_PLAYERS}.'
+                                f'{EXT_NDJSON}')
+        else:
+            player_data = retrieve_player_details(API_URLS['player'],
+                                                  players_to_retrieve,
+                                                  verbose=True,
+                                                  max_workers=args.max_workers,
+                                                  session=session,
+                                                  cache=cache,
+                                                  limiter=limiter,
+                                                  metrics=metrics,
+                                                  journal=journal)
+
+        if args.incremental:
+            player_data = merge_player_details(previous_players, player_data,
+                                               main_data['elements'])
+
+    metrics.mark('retrieve')
+
+    if (not sharded or args.shard_index == 0) and not uploaded:
+        save_intermediate_data(main_data, FILE_STRING_MAIN, DATA_LOC,
+                               EXT_JSON)
+        save_intermediate_data(fixtures_data, FILE_STRING_FIXTURES, DATA_LOC,
+                               EXT_JSON)
+    if args.stream_players:
+        players_file = f'{DATA_LOC}/{FILE_STRING_PLAYERS}.{EXT_NDJSON}'
+    else:
+        save_intermediate_data(player_data, PLAYERS_NAME, DATA_LOC, EXT_JSON)
+        players_file = f'{DATA_LOC}/{FILE_STRING_PLAYERS}.{EXT_JSON}'
+    if not (args.use_async or args.merge_shards):
+        # Players are saved so the journal is no longer needed to resume
+        journal.remove()
+
+    metrics.mark('save')
+
+    # Shards are uploaded once merged
+    if not args.skip_s3_upload and not sharded:
+        dfiles = [f'{DATA_LOC}/{FILE_STRING_FIXTURES}.{EXT_JSON}',
+                  f'{DATA_LOC}/{FILE_STRING_MAIN}.{EXT_JSON}',
+                  players_file]
 
-        s3 = AwsS3()
-        s3.upload(dfiles, args.s3_bucket, args.s3_folder)
+        if s3_pipeline is not None:
+            s3_pipeline.upload([fl for fl in dfiles if fl not in uploaded])
+            s3_pipeline.wait()
+        else:
+            s3 = AwsS3()
+            s3.upload(dfiles, args.s3_bucket, args.s3_folder)
 
+    metrics.mark('upload')
+    metrics.save(metrics_file)
     logging.info('================Extract complete================')
 
     if not args.skip_s3_upload:
@@ -0,0 +1,142 @@
+import logging
+import argparse
+
+from extract import (retrieve_data, save_intermediate_data, create_session,
+                     RateLimiter)
+from extract_entries import (retrieve_league_entries, retrieve_entry_picks,
+                             retrieve_entry_history, retrieve_entry_transfers,
+                             effective_ownership)
+from fpltools.constants import API_URLS
+from fpltools.compression import CODEC_SUFFIXES
+
+FILE_STRING_STANDINGS = 'entries_standings'
+FILE_STRING_PICKS = 'entries_picks'
+FILE_STRING_HISTORY = 'entries_history'
+FILE_STRING_TRANSFERS = 'entries_transfers'
+FILE_STRING_OWNERSHIP = 'entries_ownership'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawl the picks, history '
+                                                 'and transfers of managers '
+                                                 'in a classic league or a '
+                                                 'list of entries, saving '
+                                                 'them as columnar JSON')
+
+    parser.add_argument('-g',
+                        '--league-id',
+                        type=int,
+                        default=None,
+                        help='Classic league whose entries to crawl')
+    parser.add_argument('-e',
+                        '--entry-ids',
+                        type=int,
+                        nargs='+',
+                        default=None,
+                        help='Entries to crawl instead of a league')
+    parser.add_argument('--max-pages',
+                        type=int,
+                        default=None,
+                        help='Maximum pages of league standings (50 entries '
+                             'each) to crawl')
+    parser.add_argument('--gameweeks',
+                        type=int,
+                        nargs='+',
+                        default=None,
+                        help='Gameweeks of picks to retrieve. Defaults to the '
+                             'current gameweek.')
+    parser.add_argument('--data_location',
+                        type=str,
+                        default='data/',
+                        help='path in which to store data')
+    parser.add_argument('--log-file',
+                        type=str,
+                        default='logs/extract_entries.log',
+                        help='Location to save logs locally')
+    parser.add_argument('-w',
+                        '--max-workers',
+                        type=int,
+                        default=16,
+                        help='Number of entries to retrieve concurrently')
+    parser.add_argument('--pool-size',
+                        type=int,
+                        default=20,
+                        help='Number of keep-alive connections to pool')
+    parser.add_argument('-r',
+                        '--rate-limit',
+                        type=float,
+                        default=None,
+                        help='Maximum requests per second, reduced '
+                             'automatically if the API throttles requests')
+    parser.add_argument('--burst',
+                        type=int,
+                        default=10,
+                        help='Requests which may be made at once within '
+                             '--rate-limit')
+    parser.add_argument('--compression',
+                        type=str,
+                        choices=list(CODEC_SUFFIXES),
+                        default='gzip',
+                        help='Codec with which to compress saved data')
+    args = parser.parse_args()
+
+    if (args.league_id is None) == (args.entry_ids is None):
+        parser.error('Exactly one of --league-id and --entry-ids is required')
+    if args.rate_limit is not None and args.rate_limit <= 0:
+        parser.error('--rate-limit must be positive')
+
+    DATA_LOC = args.data_location
+    EXT_JSON = f'json{CODEC_SUFFIXES[args.compression]}'
+
+    logging.basicConfig(level=logging.INFO,
+                        filename=args.log_file,
+                        filemode='w',
+                        format='%(levelname)s - %(asctime)s - %(message)s')
+
+    request_kwargs = {
+        'session': create_session(pool_size=args.pool_size),
+        'limiter': RateLimiter(args.rate_limit, burst=args.burst)
+        if args.rate_limit is not None else None}
+
+    if args.league_id is not None:
+        standings = retrieve_league_entries(API_URLS['league_classic'],
+                                            args.league_id,
+                                            max_pages=args.max_pages,
+                                            **request_kwargs)
+        save_intermediate_data(standings.columns, FILE_STRING_STANDINGS,
+                               DATA_LOC, EXT_JSON)
+        entry_ids = standings.columns['entry']
+    else:
+        entry_ids = args.entry_ids
+
+    gameweeks = args.gameweeks
+    if gameweeks is None:
+        main_data = retrieve_data(API_URLS['static'], raise_errors=True,
+                                  **request_kwargs)
+        gameweeks = [ev['id'] for ev in main_data['events']
+                     if ev['is_current']]
+
+    picks = retrieve_entry_picks(API_URLS['user_picks'], entry_ids, gameweeks,
+                                 max_workers=args.max_workers,
+                                 **request_kwargs)
+    save_intermediate_data(picks.columns, FILE_STRING_PICKS, DATA_LOC,
+                           EXT_JSON)
+    save_intermediate_data(effective_ownership(picks).columns,
+                           FILE_STRING_OWNERSHIP, DATA_LOC, EXT_JSON)
+    # Picks are saved, so free them before retrieving the next endpoint
+    del picks
+
+    history = retrieve_entry_history(API_URLS['user_history'], entry_ids,
+                                     max_workers=args.max_workers,
+                                     **request_kwargs)
+    save_intermediate_data(history.columns, FILE_STRING_HISTORY, DATA_LOC,
+                           EXT_JSON)
+    del history
+
+    transfers = retrieve_entry_transfers(API_URLS['user_transfers'],
+                                         entry_ids,
+                                         max_workers=args.max_workers,
+                                         **request_kwargs)
+    save_intermediate_data(transfers.columns, FILE_STRING_TRANSFERS, DATA_LOC,
+                           EXT_JSON)
+
+    logging.info('================Entry crawl complete================')
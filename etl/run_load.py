@@ -5,7 +5,8 @@ from datetime import datetime
 
 import sqlalchemy
 
-from load import (load_pickle_data, BatchSQLUpdate, RecordTable)
+from load import (load_pickle_data, load_parquet_data, BatchSQLUpdate,
+                  RecordTable)
 from load import (QUERY_RECORD, QUERY_PLAYERS_FULL,
                   QUERY_PLAYERS_PAST, QUERY_FIXTURES,
                   QUERY_GAMEWEEKS, QUERY_PLAYERS_FUTURE,
@@ -62,6 +63,12 @@ if __name__ == '__main__':
                         type=str,
                         default='data/',
                         help='path from which to load data')
+    parser.add_argument('--input-format',
+                        type=str,
+                        choices=['pickle', 'parquet'],
+                        default='pickle',
+                        help='Format in which run_transform.py saved the '
+                             'transformed tables')
     parser.add_argument('-s',
                         '--skip-s3-upload',
                         action='store_true',
@@ -97,29 +104,22 @@ if __name__ == '__main__':
 
     load_date = datetime.utcnow().isoformat().replace('T', ' ')
 
-    # Dataframes to be loaded are originally pickled from run_transform.py
-    df_fixtures = load_pickle_data(IN_FIXTURES + '.pkl',
-                                   DATA_LOC)
-    df_gameweeks = load_pickle_data(IN_GAMEWEEKS + '.pkl',
-                                    DATA_LOC)
-    df_league_table = load_pickle_data(IN_LEAGUE_TABLE + '.pkl',
-                                       DATA_LOC)
-    df_players_future = load_pickle_data(IN_PLAYERS_FUTURE + '.pkl',
-                                         DATA_LOC)
-    df_players_past = load_pickle_data(IN_PLAYERS_PAST + '.pkl',
-                                       DATA_LOC)
-    df_players_full = load_pickle_data(IN_PLAYERS_FULL + '.pkl',
-                                       DATA_LOC)
-    df_players_previous_seasons = load_pickle_data(IN_PLAYERS_PREVIOUS_SEASONS + '.pkl',
-                                                   DATA_LOC)
-    df_players_summary = load_pickle_data(IN_PLAYERS_SUM + '.pkl',
-                                          DATA_LOC)
-    df_positions = load_pickle_data(IN_POSITIONS + '.pkl',
-                                    DATA_LOC)
-    df_team_results = load_pickle_data(IN_TEAM_RESULTS + '.pkl',
-                                       DATA_LOC)
-    df_teams = load_pickle_data(IN_TEAMS + '.pkl',
-                                DATA_LOC)
+    # Dataframes to be loaded are originally saved from run_transform.py
+    if args.input_format == 'parquet':
+        load_data, in_ext = load_parquet_data, '.parquet'
+    else:
+        load_data, in_ext = load_pickle_data, '.pkl'
+    df_fixtures = load_data(IN_FIXTURES + in_ext, DATA_LOC)
+    df_gameweeks = load_data(IN_GAMEWEEKS + in_ext, DATA_LOC)
+    df_league_table = load_data(IN_LEAGUE_TABLE + in_ext, DATA_LOC)
+    df_players_future = load_data(IN_PLAYERS_FUTURE + in_ext, DATA_LOC)
+    df_players_past = load_data(IN_PLAYERS_PAST + in_ext, DATA_LOC)
+    df_players_full = load_data(IN_PLAYERS_FULL + in_ext, DATA_LOC)
+    df_players_previous_seasons = load_data(IN_PLAYERS_PREVIOUS_SEASONS + in_ext, DATA_LOC)
+    df_players_summary = load_data(IN_PLAYERS_SUM + in_ext, DATA_LOC)
+    df_positions = load_data(IN_POSITIONS + in_ext, DATA_LOC)
+    df_team_results = load_data(IN_TEAM_RESULTS + in_ext, DATA_LOC)
+    df_teams = load_data(IN_TEAMS + in_ext, DATA_LOC)
 
     engine = sqlalchemy.create_engine(
         f'postgresql://{DB_USER}:{DB_PSWD}@{DB_HOST}:{DB_PORT}/{DB_NAME}')
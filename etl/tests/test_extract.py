@@ -0,0 +1,350 @@
+import os
+import json
+
+import pytest
+import requests
+
+import etl.extract as extract
+from fpltools import json_codec
+from fpltools import compression
+from etl.extract import (retrieve_player_details, retrieve_data, backoff_delay,
+                         max_request_seconds,
+                         ValidatorCache, changed_player_ids,
+                         changed_fixture_teams, merge_player_details,
+                         NdjsonWriter, save_intermediate_data,
+                         load_intermediate_data, RateLimiter,
+                         PlayerJournal, ExtractStopped, shard_players,
+                         merge_player_shards)
+
+
+@pytest.fixture
+def fake_retrieve(monkeypatch):
+    """Replace network access with a lookup on the requested link"""
+    def _retrieve(link, **kwargs):
+        return {'link': link}
+    monkeypatch.setattr(extract, 'retrieve_data', _retrieve)
+
+
+def test_player_details_serial(fake_retrieve):
+    players = [{'id': 3}, {'id': 1}, {'id': 2}]
+    found = retrieve_player_details('player/{}/', players)
+    assert found == {3: {'link': 'player/3/'},
+                     1: {'link': 'player/1/'},
+                     2: {'link': 'player/2/'}}
+
+
+def test_player_details_concurrent_matches_serial(fake_retrieve):
+    players = [{'id': i} for i in range(50, 0, -1)]
+    serial = retrieve_player_details('player/{}/', players)
+    concurrent = retrieve_player_details('player/{}/', players, max_workers=8)
+    assert concurrent == serial
+    assert list(concurrent) == list(serial)
+
+
+class FakeResponse:
+    def __init__(self, status_code, body='{}', headers=None):
+        self.status_code = status_code
+        self.text = body
+        self.content = body.encode()
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'{self.status_code} error',
+                                                response=self)
+
+
+class FakeSession:
+    """Session returning a fixed sequence of responses"""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, link, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(extract.time, 'sleep', lambda s: None)
+
+
+def test_retrieve_data_retries_server_errors(no_sleep):
+    session = FakeSession([FakeResponse(503), FakeResponse(429),
+                           FakeResponse(200, '{"a": 1}')])
+    assert retrieve_data('link', session=session) == {'a': 1}
+    assert session.calls == 3
+
+
+def test_retrieve_data_no_retry_client_error(no_sleep):
+    session = FakeSession([FakeResponse(404), FakeResponse(200)])
+    assert retrieve_data('link', session=session) is None
+    assert session.calls == 1
+
+
+class ErrorSession:
+    """Session raising the given errors before responding"""
+    def __init__(self, errors, response):
+        self.errors = list(errors)
+        self.response = response
+        self.calls = 0
+
+    def get(self, link, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.response
+
+
+def test_retrieve_data_request_errors(no_sleep):
+    session = ErrorSession([requests.exceptions.ChunkedEncodingError()],
+                           FakeResponse(200, '{"a": 1}'))
+    assert retrieve_data('link', session=session) == {'a': 1}
+    session = ErrorSession([requests.exceptions.TooManyRedirects()],
+                           FakeResponse(200))
+    assert retrieve_data('link', session=session) is None
+    assert session.calls == 1
+
+
+def test_retrieve_data_raise_errors(no_sleep):
+    session = FakeSession([FakeResponse(500)] * 2)
+    with pytest.raises(requests.exceptions.HTTPError):
+        retrieve_data('link', session=session, retries=1, raise_errors=True)
+
+
+def test_max_request_seconds():
+    assert max_request_seconds() == 30 * 4 + 0.5 + 1 + 2
+    assert max_request_seconds(retries=0, timeout=10) == 10
+    assert max_request_seconds(retries=8, backoff_factor=1, timeout=1,
+                               max_backoff=30) == 9 + 1 + 2 + 4 + 8 + 16 + 90
+
+
+def test_backoff_delay_respects_retry_after():
+    assert backoff_delay(0, backoff_factor=0.1, retry_after=5) == 5
+    assert 0 <= backoff_delay(10, max_backoff=2) <= 2
+
+
+def test_rate_limiter_paces_requests(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(extract.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(extract.time, 'sleep',
+                        lambda s: clock.__setitem__(0, clock[0] + s))
+    limiter = RateLimiter(10, burst=2)
+    for _ in range(12):
+        limiter.acquire()
+    # Two requests from the burst, then ten at 10 per second
+    assert clock[0] == pytest.approx(1.0)
+
+
+def test_rate_limiter_throttle_keeps_queued_debt(monkeypatch):
+    monkeypatch.setattr(extract.time, 'monotonic', lambda: 0.0)
+    limiter = RateLimiter(10, burst=1)
+    waits = [limiter._reserve() for _ in range(20)]
+    assert waits[-1] == pytest.approx(1.9)
+    limiter.throttled()
+    assert limiter._reserve() >= waits[-1]
+
+
+def test_rate_limiter_rejects_non_positive_rate():
+    with pytest.raises(ValueError):
+        RateLimiter(0)
+
+
+def test_rate_limiter_adapts_to_throttling(no_sleep):
+    limiter = RateLimiter(8, burst=8)
+    session = FakeSession([FakeResponse(429, headers={'Retry-After': '2'}),
+                           FakeResponse(200, '{"a": 1}')])
+    assert retrieve_data('link', session=session, limiter=limiter) == {'a': 1}
+    assert limiter.rate == pytest.approx(4 + 0.02 * 8)
+    for _ in range(100):
+        limiter.succeeded()
+    assert limiter.rate == 8
+
+
+def test_retrieve_data_uses_cache_on_not_modified(tmp_path, no_sleep):
+    cache = ValidatorCache(str(tmp_path))
+    session = FakeSession([FakeResponse(200, '{"a": 1}', {'ETag': '"v1"'}),
+                           FakeResponse(304)])
+    assert retrieve_data('link', session=session, cache=cache) == {'a': 1}
+    assert cache.request_headers('link') == {'If-None-Match': '"v1"'}
+    assert retrieve_data('link', session=session, cache=cache) == {'a': 1}
+    assert session.calls == 2
+
+
+def test_cache_ignores_responses_without_validators(tmp_path):
+    cache = ValidatorCache(str(tmp_path))
+    cache.store('link', FakeResponse(200, '{"a": 1}'))
+    assert cache.request_headers('link') == {}
+
+
+def test_changed_player_ids():
+    previous = [{'id': 1, 'total_points': 10, 'minutes': 90},
+                {'id': 2, 'total_points': 3, 'minutes': 45}]
+    current = [{'id': 1, 'total_points': 10, 'minutes': 90},
+               {'id': 2, 'total_points': 5, 'minutes': 135},
+               {'id': 3, 'total_points': 0, 'minutes': 0}]
+    assert changed_player_ids(current, previous) == {2, 3}
+
+
+def test_changed_fixture_teams():
+    previous = [{'id': 1, 'team_h': 1, 'team_a': 2, 'event': 1},
+                {'id': 2, 'team_h': 3, 'team_a': 4, 'event': 2}]
+    current = [{'id': 1, 'team_h': 1, 'team_a': 2, 'event': 1},
+               {'id': 2, 'team_h': 3, 'team_a': 4, 'event': 5}]
+    assert changed_fixture_teams(current, previous) == {3, 4}
+
+
+def test_merge_player_details():
+    previous = {'1': {'v': 'old'}, '2': {'v': 'old'}, '9': {'v': 'gone'}}
+    updated = {2: {'v': 'new'}}
+    merged = merge_player_details(previous, updated, [{'id': 2}, {'id': 1}])
+    assert merged == {2: {'v': 'new'}, 1: {'v': 'old'}}
+    assert list(merged) == [2, 1]
+
+
+def test_player_details_dead_letter_retry(monkeypatch):
+    attempts = {}
+
+    def _retrieve(link, **kwargs):
+        attempts[link] = attempts.get(link, 0) + 1
+        # Player 2 fails once, player 3 always
+        if link == 'player/3/' or (link == 'player/2/'
+                                   and attempts[link] == 1):
+            return None
+        return {'link': link}
+    monkeypatch.setattr(extract, 'retrieve_data', _retrieve)
+    players = [{'id': 1}, {'id': 2}, {'id': 3}]
+    found = retrieve_player_details('player/{}/', players, max_workers=2)
+    assert found == {1: {'link': 'player/1/'}, 2: {'link': 'player/2/'}}
+    assert attempts == {'player/1/': 1, 'player/2/': 2, 'player/3/': 2}
+
+
+def test_player_details_resume_from_journal(monkeypatch, tmp_path):
+    path = str(tmp_path / 'players.journal.ndjson')
+    requested = []
+
+    def _retrieve(link, **kwargs):
+        requested.append(link)
+        return {'link': link}
+    monkeypatch.setattr(extract, 'retrieve_data', _retrieve)
+    with PlayerJournal(path) as journal:
+        journal.write(2, {'link': 'journal'})
+    # Simulate a line cut short by an interruption
+    with open(path, 'ab') as f:
+        f.write(b'{"id": 3, "da')
+
+    journal = PlayerJournal(path)
+    players = [{'id': 1}, {'id': 2}, {'id': 3}]
+    found = retrieve_player_details('player/{}/', players, journal=journal)
+    journal.close()
+    assert found == {1: {'link': 'player/1/'}, 2: {'link': 'journal'},
+                     3: {'link': 'player/3/'}}
+    assert requested == ['player/1/', 'player/3/']
+    assert PlayerJournal.load(path) == found
+    journal.remove()
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_player_details_stop_and_resume(fake_retrieve, tmp_path,
+                                        max_workers):
+    path = str(tmp_path / 'players.journal.ndjson')
+    players = [{'id': i} for i in range(1, 11)]
+    journal = PlayerJournal(path)
+    with pytest.raises(ExtractStopped):
+        retrieve_player_details('player/{}/', players,
+                                max_workers=max_workers, journal=journal,
+                                stop=lambda: journal.written >= 3)
+    journal.close()
+    assert 3 <= len(PlayerJournal.load(path)) < 10
+
+    journal = PlayerJournal(path)
+    found = retrieve_player_details('player/{}/', players, journal=journal,
+                                    stop=lambda: False)
+    journal.close()
+    assert list(found) == list(range(1, 11))
+
+
+def test_shards_merge_to_single_run():
+    players = [{'id': i} for i in range(10, 0, -1)]
+    shards = [shard_players(players, i, 3) for i in range(3)]
+    assert sorted(pl['id'] for shard in shards for pl in shard) \
+        == list(range(1, 11))
+    # As loaded from each shard's JSON file
+    saved = [{str(pl['id']): {'id': pl['id']} for pl in shard}
+             for shard in shards]
+    merged = merge_player_shards(saved, players)
+    assert list(merged) == list(range(10, 0, -1))
+    assert merged[4] == {'id': 4}
+
+
+class FakeUpload:
+    def __init__(self):
+        self.calls = []
+
+    def update(self):
+        self.calls.append('update')
+
+    def finish(self):
+        self.calls.append('finish')
+
+    def abort(self):
+        self.calls.append('abort')
+
+
+def test_ndjson_writer_upload(tmp_path):
+    upload = FakeUpload()
+    with NdjsonWriter(str(tmp_path / 'players.ndjson'), upload=upload) as w:
+        w.write(1, {})
+        w.write(2, {})
+    assert upload.calls == ['update', 'update', 'finish']
+
+    upload = FakeUpload()
+    with pytest.raises(ValueError):
+        with NdjsonWriter(str(tmp_path / 'players.ndjson'),
+                          upload=upload) as w:
+            raise ValueError
+    assert upload.calls == ['abort']
+
+
+def test_player_details_sink(fake_retrieve, tmp_path):
+    players = [{'id': i} for i in range(1, 21)]
+    path = str(tmp_path / 'players.ndjson')
+    with NdjsonWriter(path) as sink:
+        found = retrieve_player_details('player/{}/', players, max_workers=4,
+                                        sink=sink)
+    assert found is None
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert sorted(r['id'] for r in records) == list(range(1, 21))
+    assert {r['id']: r['data'] for r in records}[7] == {'link': 'player/7/'}
+
+
+@pytest.mark.parametrize('extension', [
+    'json', 'json.gz',
+    pytest.param('json.zst', marks=pytest.mark.skipif(
+        compression.zstandard is None, reason='zstandard is not installed'))])
+def test_save_load_intermediate_data(tmp_path, extension):
+    data = {'elements': [{'id': 1, 'web_name': 'Salah'}]}
+    save_intermediate_data(data, 'main', str(tmp_path), extension)
+    assert load_intermediate_data('main', str(tmp_path), extension) == data
+
+
+def test_save_intermediate_data_compresses(tmp_path):
+    data = {'elements': [{'id': i, 'minutes': 90} for i in range(500)]}
+    save_intermediate_data(data, 'main', str(tmp_path))
+    save_intermediate_data(data, 'main', str(tmp_path), 'json.gz')
+    assert os.path.getsize(tmp_path / 'main.json.gz') \
+        < os.path.getsize(tmp_path / 'main.json') / 5
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_save_intermediate_data_int_keys(tmp_path, monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(json_codec, 'orjson', None)
+    data = {1: {'history': []}, 2: {'history': [{'influence': '1.5'}]}}
+    save_intermediate_data(data, 'players', str(tmp_path))
+    with open(tmp_path / 'players.json') as f:
+        assert json.load(f) == {'1': {'history': []},
+                                '2': {'history': [{'influence': '1.5'}]}}
@@ -0,0 +1,90 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+import etl.extract_async as extract_async
+from etl.extract_async import retrieve_many, retrieve_extract
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves {'path': path} for each request, except paths listed in the
+    server's failures which first fail with the given statuses"""
+    def do_GET(self):
+        failures = self.server.failures.get(self.path, [])
+        self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        if failures:
+            status = failures.pop(0)
+            body = b'{}' if status < 600 else b'not json'
+            status = 200 if status >= 600 else status
+        else:
+            status = 200
+            body = json.dumps(self.server.bodies.get(
+                self.path, {'path': self.path})).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Local API server. Status 600 in failures serves invalid JSON."""
+    async def _no_sleep(seconds):
+        pass
+    monkeypatch.setattr(extract_async.asyncio, 'sleep', _no_sleep)
+    httpd = HTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.failures = {}
+    httpd.bodies = {}
+    httpd.hits = {}
+    httpd.url = f'http://127.0.0.1:{httpd.server_port}'
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_retrieve_many_keeps_order(server):
+    links = [f'{server.url}/player/{i}/' for i in range(20, 0, -1)]
+    found = retrieve_many(links, max_concurrency=5)
+    assert found == [{'path': f'/player/{i}/'} for i in range(20, 0, -1)]
+
+
+def test_retrieve_many_retries_server_errors(server):
+    server.failures['/a/'] = [503, 429]
+    assert retrieve_many([f'{server.url}/a/']) == [{'path': '/a/'}]
+    assert server.hits['/a/'] == 3
+
+
+def test_retrieve_many_failures_return_none(server):
+    server.failures['/missing/'] = [404]
+    server.failures['/invalid/'] = [600]
+    found = retrieve_many([f'{server.url}/missing/', f'{server.url}/invalid/',
+                           f'{server.url}/ok/'])
+    assert found == [None, None, {'path': '/ok/'}]
+    assert server.hits['/missing/'] == 1
+
+
+def test_retrieve_extract_raises_if_static_fails(server):
+    server.failures['/static/'] = [500] * 4
+    with pytest.raises(aiohttp.ClientResponseError):
+        retrieve_extract(f'{server.url}/static/', f'{server.url}/fixtures/',
+                         server.url + '/player/{}/')
+
+
+def test_retrieve_extract(server):
+    server.bodies['/static/'] = {'elements': [{'id': 2}, {'id': 1}]}
+    main, fixtures, players = retrieve_extract(
+        f'{server.url}/static/', f'{server.url}/fixtures/',
+        server.url + '/player/{}/')
+    assert fixtures == {'path': '/fixtures/'}
+    assert players == {2: {'path': '/player/2/'}, 1: {'path': '/player/1/'}}
+    assert list(players) == [2, 1]
@@ -0,0 +1,65 @@
+import pytest
+
+# The module under test imports extract as run from etl/
+import extract
+import etl.extract_entries as extract_entries
+from etl.extract_entries import (ColumnTable, retrieve_league_entries,
+                                 retrieve_entry_picks, effective_ownership)
+
+PAGES = {1: {'standings': {'has_next': True,
+                           'results': [{'entry': 11, 'rank': 1, 'total': 90},
+                                       {'entry': 12, 'rank': 2, 'total': 80}]}},
+         2: {'standings': {'has_next': False,
+                           'results': [{'entry': 13, 'rank': 3, 'total': 70}]}}}
+
+
+def _picks(captain, bench):
+    return {'picks': [{'element': captain, 'position': 1, 'multiplier': 2,
+                       'is_captain': True, 'is_vice_captain': False},
+                      {'element': 5, 'position': 2, 'multiplier': 1,
+                       'is_captain': False, 'is_vice_captain': True},
+                      {'element': bench, 'position': 12, 'multiplier': 0,
+                       'is_captain': False, 'is_vice_captain': False}]}
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    responses = {'league/1/2': PAGES[2], 'league/1/1': PAGES[1],
+                 'picks/11/3': _picks(7, 8), 'picks/12/3': _picks(7, 8),
+                 'picks/13/3': None}
+
+    def _retrieve(link, **kwargs):
+        return responses[link]
+    monkeypatch.setattr(extract, 'retrieve_data', _retrieve)
+    monkeypatch.setattr(extract_entries, 'retrieve_data', _retrieve)
+
+
+def test_retrieve_league_entries(fake_api):
+    standings = retrieve_league_entries('league/{}/{}', 1)
+    assert standings.columns['entry'] == [11, 12, 13]
+    assert standings.columns['rank'] == [1, 2, 3]
+    assert standings.columns['entry_name'] == [None] * 3
+    assert len(retrieve_league_entries('league/{}/{}', 1, max_pages=1)) == 2
+
+
+def test_picks_and_effective_ownership(fake_api, caplog):
+    caplog.set_level('INFO')
+    picks = retrieve_entry_picks('picks/{}/{}', [11, 12, 13], [3],
+                                 max_workers=2)
+    assert 'Retrieving entry data for 3 ids with 2 workers' in caplog.text
+    assert 'player' not in caplog.text.lower()
+    # Entry 13 could not be retrieved so is left out
+    assert sorted(set(picks.columns['entry'])) == [11, 12]
+    assert set(picks.columns['event']) == {3}
+
+    ownership = effective_ownership(picks).columns
+    eo = dict(zip(ownership['element'], ownership['effective_ownership']))
+    assert eo == {5: 1.0, 7: 2.0, 8: 0.0}
+
+
+def test_column_table():
+    table = ColumnTable(('a', 'b'))
+    table.append({'a': 1, 'c': 3}, b=2)
+    table.append({'b': 4})
+    assert table.columns == {'a': [1, None], 'b': [2, 4]}
+    assert len(table) == 2
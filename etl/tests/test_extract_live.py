@@ -0,0 +1,105 @@
+from etl.extract_live import build_players_from_live, live_gameweeks
+
+
+def _fixture(fixture_id, event, team_h, team_a, finished=True, started=True):
+    return {'id': fixture_id, 'code': 1000 + fixture_id, 'event': event,
+            'team_h': team_h, 'team_a': team_a,
+            'team_h_score': 1 if finished else None,
+            'team_a_score': 0 if finished else None,
+            'finished': finished, 'started': started, 'minutes': 90,
+            'provisional_start_time': False,
+            'kickoff_time': f'2020-01-0{event}T15:00:00Z',
+            'team_h_difficulty': 2, 'team_a_difficulty': 4}
+
+
+def _live(player_id, fixture_id, points):
+    stats = {'minutes': 90, 'goals_scored': 0, 'assists': 0,
+             'clean_sheets': 1, 'goals_conceded': 0, 'own_goals': 0,
+             'penalties_saved': 0, 'penalties_missed': 0, 'yellow_cards': 0,
+             'red_cards': 0, 'saves': 0, 'bonus': 0, 'bps': 20,
+             'influence': '1.0', 'creativity': '2.0', 'threat': '3.0',
+             'ict_index': '0.6', 'total_points': points}
+    return {'id': player_id, 'stats': stats,
+            'explain': [{'fixture': fixture_id, 'stats': []}]}
+
+
+MAIN = {'total_players': 1000,
+        'events': [{'id': 1, 'name': 'Gameweek 1', 'finished': True,
+                    'is_current': False},
+                   {'id': 2, 'name': 'Gameweek 2', 'finished': False,
+                    'is_current': True},
+                   {'id': 3, 'name': 'Gameweek 3', 'finished': False,
+                    'is_current': False}],
+        'elements': [{'id': 1, 'team': 1, 'now_cost': 55,
+                      'selected_by_percent': '10.0', 'transfers_in_event': 7,
+                      'transfers_out_event': 2},
+                     {'id': 2, 'team': 2, 'now_cost': 45,
+                      'selected_by_percent': '1.0', 'transfers_in_event': 0,
+                      'transfers_out_event': 1}]}
+FIXTURES = [_fixture(1, 1, 1, 2), _fixture(2, 2, 2, 1, finished=False),
+            _fixture(3, 3, 1, 2, finished=False, started=False)]
+PREVIOUS = {'1': {'history': [{'fixture': 1, 'value': 54,
+                               'transfers_balance': 3, 'selected': 90,
+                               'transfers_in': 4, 'transfers_out': 1},
+                              {'fixture': 2, 'value': 55,
+                               'transfers_balance': 5, 'selected': 100,
+                               'transfers_in': 7, 'transfers_out': 2}],
+                  'history_past': [{'season_name': '2018/19'}],
+                  'fixtures': []}}
+
+
+def test_live_gameweeks():
+    assert live_gameweeks(MAIN) == [1, 2]
+
+
+def test_build_players_from_live():
+    live = {1: {'elements': [_live(1, 1, 6), _live(2, 1, 1)]},
+            2: {'elements': [_live(1, 2, 2), _live(2, 2, 3)]}}
+    players, fallback = build_players_from_live(MAIN, FIXTURES, live, PREVIOUS)
+
+    # No previous extract for player 2 so it must come from element-summary
+    assert fallback == {2}
+    history = players[1]['history']
+    assert [row['fixture'] for row in history] == [1, 2]
+    assert history[0]['was_home'] and not history[1]['was_home']
+    assert history[0]['value'] == 54
+    assert history[1]['value'] == 55
+    assert history[1]['transfers_balance'] == 5
+    assert history[1]['selected'] == 100
+    assert [row['total_points'] for row in history] == [6, 2]
+    assert players[1]['history_past'] == [{'season_name': '2018/19'}]
+    assert [fx['id'] for fx in players[1]['fixtures']] == [2, 3]
+    assert players[1]['fixtures'][1]['event_name'] == 'Gameweek 3'
+    assert players[1]['fixtures'][1]['difficulty'] == 2
+
+
+def test_build_players_from_live_new_fixture():
+    # Fixture 2 was not played at the previous extract
+    history = [dict(PREVIOUS['1']['history'][0], modified=False)]
+    previous = {'1': dict(PREVIOUS['1'], history=history)}
+    live = {1: {'elements': [_live(1, 1, 6)]},
+            2: {'elements': [_live(1, 2, 2)]}}
+    players, fallback = build_players_from_live(MAIN, FIXTURES, live, previous)
+    assert 1 not in fallback
+    row = players[1]['history'][1]
+    assert row['fixture'] == 2 and row['round'] == 2
+    assert row['total_points'] == 2 and not row['was_home']
+    # Market fields and fields not from the live endpoint are carried over
+    assert row['value'] == 54 and row['selected'] == 90
+    assert row['modified'] is False
+    assert history[0]['fixture'] == 1
+
+
+def test_build_players_from_live_no_history_falls_back():
+    previous = {'1': dict(PREVIOUS['1'], history=[])}
+    live = {1: {'elements': [_live(1, 1, 6)]}}
+    players, fallback = build_players_from_live(MAIN, FIXTURES, live, previous)
+    assert 1 in fallback and 1 not in players
+
+
+def test_build_players_from_live_double_gameweek_falls_back():
+    double = _live(1, 1, 6)
+    double['explain'].append({'fixture': 3, 'stats': []})
+    live = {1: {'elements': [double]}}
+    players, fallback = build_players_from_live(MAIN, FIXTURES, live, PREVIOUS)
+    assert 1 in fallback and 1 not in players
@@ -0,0 +1,41 @@
+import json
+
+from etl.extract import retrieve_data
+from etl.extract_metrics import ExtractMetrics, endpoint_name, percentile
+from etl.tests.test_extract import FakeResponse, FakeSession, no_sleep
+
+
+def test_endpoint_name():
+    base = 'https://fantasy.premierleague.com/api/'
+    assert endpoint_name(f'{base}element-summary/123/') \
+        == 'element-summary/{id}/'
+    assert endpoint_name(f'{base}event/5/live/') == 'event/{id}/live/'
+    assert endpoint_name(f'{base}bootstrap-static/') == 'bootstrap-static/'
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (50, 95, 99)] == [50, 95, 99]
+    assert percentile([], 50) is None
+
+
+def test_retrieve_data_records_metrics(no_sleep, tmp_path):
+    metrics = ExtractMetrics()
+    session = FakeSession([FakeResponse(503), FakeResponse(200, '{"a": 1}'),
+                           FakeResponse(404)])
+    retrieve_data('http://x/api/element-summary/1/', session=session,
+                  metrics=metrics)
+    retrieve_data('http://x/api/element-summary/2/', session=session,
+                  metrics=metrics)
+    metrics.mark('retrieve')
+
+    path = tmp_path / 'extract_metrics.json'
+    metrics.save(str(path))
+    summary = json.loads(path.read_text())
+    players = summary['endpoints']['element-summary/{id}/']
+    assert players['requests'] == 2
+    assert players['statuses'] == {'200': 1, '404': 1}
+    assert players['retries'] == 1
+    assert players['bytes'] == len('{"a": 1}')
+    assert set(players['latency']) == {'p50', 'p95', 'p99', 'max', 'sum'}
+    assert 'retrieve' in summary['stages']
@@ -0,0 +1,80 @@
+import requests
+
+import extract
+from etl.replay import ReplayServer, record_responses, load_recording
+from etl.tests.test_extract import FakeResponse, no_sleep
+
+from fpltools.constants import API_URLS
+
+MAIN_DATA = '{"elements": [{"id": 1}, {"id": 2}], ' \
+            '"events": [{"id": 1, "finished": true, "is_current": false}]}'
+
+
+class LinkSession:
+    """Session answering 200 with the static data, or with the link itself,
+    unless given a status (or exception) to answer for it in failures"""
+    def __init__(self, failures=None):
+        self.links = []
+        self.failures = failures or {}
+
+    def get(self, link, **kwargs):
+        self.links.append(link)
+        failure = self.failures.get(link)
+        if isinstance(failure, Exception):
+            raise failure
+        if failure is not None:
+            return FakeResponse(failure)
+        if link == API_URLS['static']:
+            return FakeResponse(200, MAIN_DATA)
+        return FakeResponse(200, f'"{link}"')
+
+
+def test_record_and_load(tmp_path):
+    path = str(tmp_path / 'recording.ndjson.gz')
+    session = LinkSession()
+    n_recorded = record_responses(path, entry_ids=[7], session=session)
+    assert API_URLS['player'].format(2) in session.links
+    assert API_URLS['user_picks'].format(7, 1) in session.links
+    assert n_recorded == len(session.links) - 1
+
+    responses = load_recording(path)
+    assert responses['/api/element-summary/2/'] \
+        == (200, f'"{API_URLS["player"].format(2)}"'.encode())
+    assert responses['/api/bootstrap-static/'] == (200, MAIN_DATA.encode())
+
+
+def test_record_skips_failures(tmp_path):
+    path = str(tmp_path / 'recording.ndjson')
+    session = LinkSession({
+        API_URLS['player'].format(1): 404,
+        API_URLS['player'].format(2): requests.exceptions.ConnectionError()})
+    n_recorded = record_responses(path, session=session)
+    # Only links the extract requests are recorded
+    assert API_URLS['me'] not in session.links
+    assert API_URLS['dynamic'] not in session.links
+
+    responses = load_recording(path)
+    assert n_recorded == len(responses) == len(session.links) - 3
+    assert '/api/element-summary/1/' not in responses
+    assert '/api/element-summary/2/' not in responses
+
+
+def test_replay_server():
+    responses = {'/api/element-summary/1/': (200, b'{"history": [1]}'),
+                 '/api/element-summary/2/': (200, b'{"history": [2]}')}
+    with ReplayServer(responses) as server:
+        urls = server.api_urls()
+        players = extract.retrieve_player_details(
+            urls['player'], [{'id': 1}, {'id': 2}, {'id': 3}], max_workers=2,
+            retries=0)
+        assert players == {1: {'history': [1]}, 2: {'history': [2]}}
+        # Player 3 is unknown so 404s, and again in the dead letter pass
+        assert server.requests == 4
+
+
+def test_replay_server_errors(no_sleep):
+    responses = {'/api/bootstrap-static/': (200, b'{}')}
+    with ReplayServer(responses, error_rate=1) as server:
+        assert extract.retrieve_data(server.api_urls()['static'],
+                                     retries=2) is None
+        assert server.requests == 3
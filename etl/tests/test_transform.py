@@ -1,6 +1,8 @@
 import os
+import gzip
 import json
 import pickle
+from functools import partial
 
 import pytest
 import pandas as pd
@@ -9,8 +11,12 @@ import numpy as np
 
 from etl.transform import (dval_unique_index, dval_notnull_index,
                            check_unique_index, check_not_null_index,
-                           pandas_integerstr_to_int, load_json,
-                           pickle_data)
+                           pandas_integerstr_to_int, integerstr_to_int,
+                           player_dataframes, compact_dtypes,
+                           load_json, run_dag, validate_table,
+                           validate_tables,
+                           pickle_data, iter_ndjson, save_data)
+from fpltools.columnar import read_table
 
 
 def test_dval_unique_correct_index():
@@ -289,6 +295,204 @@ def test_intstr_correct_nan_df_floats():
     pdt.assert_frame_equal(found, expected, check_like=True)
 
 
+def test_integerstr_series_matches_elementwise():
+    series = pd.Series([1.234, np.nan, -1.001, 43.0, 0.0], name='B')
+    expected = series.apply(pandas_integerstr_to_int)
+    found = integerstr_to_int(series)
+    assert found.equals(expected)
+    assert found.name == 'B'
+
+
+def test_integerstr_series_ints():
+    series = pd.Series([1, 15, -1, 43])
+    expected = pd.Series(['1', '15', '-1', '43'])
+    assert integerstr_to_int(series).equals(expected)
+
+
+def test_integerstr_df_matches_elementwise():
+    df = pd.DataFrame({'A': ['a', 'b', 'c', 'd'],
+                       'B': [1.234, np.nan, -1.001, 43.023],
+                       'C': [0.993, 12.001, np.nan, np.nan]})
+    expected = df[['B', 'C']].applymap(pandas_integerstr_to_int)
+    found = df[['B', 'C']].pipe(integerstr_to_int)
+    pdt.assert_frame_equal(found, expected)
+
+
+def test_player_dataframes_match_concat():
+    players = {'1': {'history': [{'element': 1, 'fixture': 10}],
+                     'fixtures': [{'code': 5, 'event': 2},
+                                  {'code': 6, 'event': None}],
+                     'history_past': []},
+               '2': {'history': [{'element': 2, 'fixture': 10, 'bps': 3}],
+                     'fixtures': [{'code': 5}],
+                     'history_past': [{'element_code': 9,
+                                       'season_name': '2018/19'}]}}
+    past, future, prev_seasons = player_dataframes(players.items())
+
+    def concat(key, **values):
+        frames = [pd.DataFrame(p[key]).assign(**{c: k for c in values})
+                  for k, p in players.items()]
+        return pd.concat(frames, sort=False).reset_index(drop=True)
+
+    pdt.assert_frame_equal(past, concat('history'))
+    pdt.assert_frame_equal(future, concat('fixtures', player_id=True))
+    pdt.assert_frame_equal(prev_seasons, concat('history_past'))
+
+
+COMPACT_DTYPES = {'player_id': 'category',
+                  'team_id': 'category',
+                  'minutes': 'Int16',
+                  'home_team_score': 'Int8',
+                  'ict_index': 'float32',
+                  'was_home': 'bool',
+                  'win': 'Int8',
+                  'news': 'object',
+                  'kickoff_datetime': 'datetime64[ns, UTC]',
+                  'not_built': 'Int8'}
+
+
+def test_compact_dtypes_keeps_values():
+    df = pd.DataFrame({'player_id': ['1', '1', '2', np.nan],
+                       'team_id': [1, 2, 2, 3],
+                       'minutes': [90.0, np.nan, 45.0, 0.0],
+                       'home_team_score': [None] * 4,
+                       'ict_index': ['1.5', '0.0', None, '2.5'],
+                       'was_home': np.array([True, False, True, False],
+                                            dtype=object),
+                       'win': [True, np.nan, False, True],
+                       'news': [None] * 4,
+                       'kickoff_datetime': ['2019-08-10T14:00:00Z'] * 4,
+                       'season_name': ['a', 'b', 'c', 'd']})
+    compact = compact_dtypes(df, 'test', COMPACT_DTYPES)
+    # Declared dtypes whatever the values, e.g. if all null
+    assert {col: str(compact[col].dtype) for col in compact.columns} == {
+        'player_id': 'category', 'team_id': 'category', 'minutes': 'Int16',
+        'home_team_score': 'Int8', 'ict_index': 'float32', 'was_home': 'bool',
+        'win': 'Int8', 'news': 'object',
+        'kickoff_datetime': 'datetime64[ns, UTC]', 'season_name': 'object'}
+    assert compact['player_id'].astype(object).tolist()[:3] == ['1', '1', '2']
+    # Ids as the text of their VARCHAR column
+    assert compact['team_id'].astype(object).tolist() == ['1', '2', '2', '3']
+    assert compact['minutes'].tolist()[:1] == [90]
+    assert compact['minutes'].isna().tolist() == [False, True, False, False]
+    assert compact['ict_index'].tolist()[:2] == [1.5, 0.0]
+    assert compact['win'].isna().tolist() == [False, True, False, False]
+
+
+def test_compact_dtypes_incorrect():
+    df = pd.DataFrame({'minutes': [90, 40000], 'was_home': [True, None],
+                       'influence': [0.5, 1.0]})
+    with pytest.raises(ValueError):
+        compact_dtypes(df, 'test', {'minutes': 'Int8'})
+    with pytest.raises(ValueError):
+        compact_dtypes(df, 'test', {'was_home': 'bool'})
+    with pytest.raises(ValueError):
+        compact_dtypes(df, 'test', {'influence': 'Int8'})
+
+
+def test_run_dag():
+    tasks = {'c': (lambda a, b: a * b + 1, ('a', 'b')),
+             'b': (lambda a: a + 1, ('a',)),
+             'a': (lambda: 1, ())}
+    results, finished = run_dag(tasks, max_workers=2,
+                                finish={'c': lambda c: c * 10})
+    assert results == {'a': 1, 'b': 2, 'c': 3}
+    assert finished == {'c': 30}
+
+
+def test_run_dag_processes():
+    tasks = {'a': (partial(int, '2'), ()),
+             'b': (str, ('a',))}
+    results, finished = run_dag(tasks, use_processes=True,
+                                finish={'b': len})
+    assert results == {'a': 2, 'b': '2'}
+    assert finished == {'b': 1}
+
+
+def test_run_dag_incorrect_inputs():
+    with pytest.raises(ValueError):
+        run_dag({'a': (lambda b: b, ('b',))})
+    with pytest.raises(ValueError):
+        run_dag({'a': (lambda b: b, ('b',)),
+                 'b': (lambda a: a, ('a',))})
+
+
+VALIDATION_RULES = {
+    'teams': {'primary_key': ['team_id'],
+              'unique': ['team_name'],
+              'not_null': ['team_name']},
+    'team_results': {'primary_key': ['team_id', 'fixture_id'],
+                     'references': {'team_id': ('teams', 'team_id'),
+                                    'opponent_team_id': ('teams', 'team_id')},
+                     'ranges': {'goals_scored': (0, 20)}}}
+
+
+def validation_tables():
+    teams = pd.DataFrame({'team_id': ['1', '2'], 'team_name': ['ARS', 'AVL']})
+    teams.set_index('team_id', inplace=True)
+    results = pd.DataFrame({'team_id': ['1', '2', '1'],
+                            'fixture_id': ['1', '1', '2'],
+                            # As numbers, as in players_summary
+                            'opponent_team_id': [2, 1, np.nan],
+                            'goals_scored': [1, np.nan, 0]})
+    return {'teams': teams, 'team_results': results}
+
+
+def test_validate_tables_correct():
+    report = validate_tables(validation_tables(), VALIDATION_RULES)
+    assert report['team_results']['rows'] == 3
+    results = report['team_results']['rules']
+    assert [r['rule'] for r in results] == ['unique', 'not_null', 'not_null',
+                                            'references teams(team_id)',
+                                            'references teams(team_id)',
+                                            'range [0, 20]']
+    assert all(r['violations'] == 0
+               for table in report.values() for r in table['rules'])
+
+
+def test_validate_tables_incorrect():
+    tables = validation_tables()
+    tables['teams'].loc['3'] = ['ARS']
+    tables['team_results'] = pd.concat(
+        [tables['team_results'],
+         pd.DataFrame({'team_id': ['4'], 'fixture_id': ['1'],
+                       'opponent_team_id': [2], 'goals_scored': [21]})],
+        ignore_index=True)
+    with pytest.raises(AssertionError):
+        validate_tables(tables, VALIDATION_RULES)
+
+    report = validate_tables(tables, VALIDATION_RULES, raise_errors=False)
+    failed = {(table, r['rule'], tuple(r['columns'])):
+              (r['violations'], r['examples'])
+              for table, table_report in report.items()
+              for r in table_report['rules'] if r['violations']}
+    assert failed == {
+        ('teams', 'unique', ('team_name',)): (2, ['ARS', 'ARS']),
+        ('team_results', 'references teams(team_id)', ('team_id',)):
+            (1, ['4']),
+        ('team_results', 'range [0, 20]', ('goals_scored',)): (1, ['21.0'])}
+
+
+def test_validate_tables_checked():
+    tables = validation_tables()
+    tables['team_results'].drop(columns='goals_scored', inplace=True)
+    # Checked as the table was built, before the teams it references
+    checked = validate_table(tables['team_results'],
+                             VALIDATION_RULES['team_results'])
+    assert [r['rule'] for r in checked] == ['present', 'unique', 'not_null',
+                                            'not_null']
+    assert checked[0]['violations'] == 3
+
+    report = validate_tables(tables, VALIDATION_RULES, raise_errors=False,
+                             checked={'team_results': checked})
+    assert [r['rule'] for r in report['team_results']['rules']] == \
+        ['present', 'unique', 'not_null', 'not_null',
+         'references teams(team_id)', 'references teams(team_id)']
+    with pytest.raises(AssertionError):
+        validate_tables(tables, VALIDATION_RULES,
+                        checked={'team_results': checked})
+
+
 # TODO: pull out file creation/deletion into a fixture
 def test_json_load_correct():
     fname = 'test_json.json'
@@ -320,6 +524,28 @@ def test_json_load_incorrect_path():
         load_json(non_existant_file, '.')
 
 
+def test_json_load_compressed(tmp_path):
+    to_json_data = {'A': 1, 'B': 2}
+    with gzip.open(tmp_path / 'test_json.json.gz', 'wt') as f:
+        json.dump(to_json_data, f)
+
+    assert load_json('test_json.json.gz', str(tmp_path)) == to_json_data
+
+
+def test_iter_ndjson_correct(tmp_path):
+    with open(tmp_path / 'players.ndjson', 'w') as f:
+        f.write('{"id": 1, "data": {"history": []}}\n')
+        f.write('{"id": 2, "data": {"history": [1]}}\n')
+
+    found = dict(iter_ndjson('players.ndjson', str(tmp_path)))
+    assert found == {'1': {'history': []}, '2': {'history': [1]}}
+
+
+def test_iter_ndjson_incorrect_path(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        list(iter_ndjson('non_existant.ndjson', str(tmp_path)))
+
+
 def test_pickle_correct():
     test_data = {'A': 1,
                  'B': 2,
@@ -338,3 +564,46 @@ def test_pickle_incorrect():
                  'C': 3}
     with pytest.raises(FileNotFoundError):
         pickle_data(test_data, 'test_pickle', 'non_existing_folder')
+
+
+def test_save_parquet_round_trip(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    df = pd.DataFrame({'player_id': ['1', '1', '2'],
+                       'fixture_id': ['10', '11', '10'],
+                       'total_points': [2.0, np.nan, 6.0],
+                       'win': [True, np.nan, False],
+                       'opponent_team_id': [None, None, None],
+                       'kickoff_datetime': pd.to_datetime(
+                           ['2019-08-10T14:00:00Z'] * 3)})
+    df.set_index(['player_id', 'fixture_id'], inplace=True)
+    path = save_data(df, 'players_past', str(tmp_path), 'parquet')
+    assert path == os.path.join(str(tmp_path), 'players_past.parquet')
+
+    reloaded = read_table(path)
+    pdt.assert_frame_equal(reloaded, df, check_dtype=False)
+    # An all null column keeps its (string) type rather than becoming null
+    assert reloaded['opponent_team_id'].isna().all()
+
+    dtypes = {'player_id': 'object', 'total_points': 'Int16', 'win': 'Int8',
+              'opponent_team_id': 'category', 'home_team_score': 'Int8',
+              'kickoff_datetime': 'datetime64[ns, UTC]'}
+    df['home_team_score'] = None
+    compact = compact_dtypes(df, 'players_past', dtypes)
+    save_data(compact, 'players_past', str(tmp_path), 'parquet', dtypes)
+    pdt.assert_frame_equal(read_table(path), compact)
+    # Declared types, though columns are all null
+    schema = pq.read_schema(path)
+    assert str(schema.field('home_team_score').type) == 'int8'
+    assert str(schema.field('opponent_team_id').type) == \
+        'dictionary<values=string, indices=int32, ordered=0>'
+
+    projected = read_table(path, columns=['total_points'])
+    assert list(projected.columns) == ['total_points']
+    assert list(projected.index.names) == ['player_id', 'fixture_id']
+
+
+def test_save_parquet_incorrect():
+    pytest.importorskip('pyarrow')
+    with pytest.raises(FileNotFoundError):
+        save_data(pd.DataFrame({'A': [1]}), 'test', 'non_existing_folder',
+                  'parquet')
@@ -0,0 +1,62 @@
+import json
+import threading
+
+import pandas as pd
+
+from etl.transform_profile import TransformProfiler
+from etl.transform import run_dag
+
+
+def build_table(n):
+    df = pd.DataFrame({'player_id': range(n), 'points': range(n)})
+    df = pd.merge(df, df, on='player_id')
+    df.sort_values('points_x', ascending=False, inplace=True)
+    return df
+
+
+def test_profiler_stages(tmp_path):
+    concat = pd.concat
+    with TransformProfiler() as profiler:
+        tasks = {'small': (lambda: build_table(3), ()),
+                 'large': (lambda: build_table(1000), ()),
+                 'both': (lambda a, b: pd.concat([a, b]), ('small', 'large'))}
+        results, _ = run_dag(profiler.wrap_tasks(tasks, 'build'))
+        with profiler.stage('check') as record:
+            profiler.set_output(record, results['both'])
+    # pandas is restored once profiling stops
+    assert pd.concat is concat
+
+    stages = {s['name']: s for s in profiler.stages
+              if s['category'] != 'operation'}
+    assert stages['build both']['rows'] == 1003
+    assert stages['build both']['columns'] == 3
+    assert stages['check']['rows'] == 1003
+    assert all(s['wall'] >= 0 and s['cpu'] >= 0 and s['peak_memory'] >= 0
+               for s in profiler.stages)
+
+    operations = [s for s in profiler.stages if s['category'] == 'operation']
+    # DataFrame merges within pd.merge are not counted again
+    assert sorted(s['name'] for s in operations) == \
+        ['concat', 'merge', 'merge', 'sort_values', 'sort_values']
+    sort = [s for s in operations if s['parent'] == 'build large'
+            and s['name'] == 'sort_values'][0]
+    assert sort['rows'] == 1000
+    assert profiler.summary()['operations']['merge']['calls'] == 2
+
+    profiler.save(str(tmp_path / 'profile.json'))
+    profiler.save_trace(str(tmp_path / 'trace.json'))
+    with open(tmp_path / 'trace.json') as f:
+        events = json.load(f)['traceEvents']
+    assert len(events) == len(profiler.stages)
+    assert {e['ph'] for e in events} == {'X'}
+
+
+def test_profiler_disabled():
+    profiler = TransformProfiler(enabled=False).start()
+    func = threading.get_ident
+    assert profiler.wrap('f', func) is func
+    with profiler.stage('check') as record:
+        build_table(3)
+    profiler.stop()
+    assert record == {'name': 'check', 'category': 'stage'}
+    assert profiler.stages == []
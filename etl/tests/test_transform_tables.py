@@ -0,0 +1,194 @@
+import os
+import re
+import ast
+import copy
+
+import pandas.testing as pdt
+
+from etl.transform_tables import (build_fixtures, build_team_results,
+                                  build_players_past, find_changes,
+                                  changed_player_records, build_changed_rows,
+                                  TABLE_RULES, TABLE_DTYPES)
+
+# CREATE TABLE query in load.py of each transformed table
+TABLE_QUERIES = {'fixtures': 'QUERY_FIXTURES',
+                 'gameweeks': 'QUERY_GAMEWEEKS',
+                 'teams': 'QUERY_TEAMS',
+                 'positions': 'QUERY_POSITIONS',
+                 'players_summary': 'QUERY_PLAYERS_SUMMARY',
+                 'players_previous_seasons': 'QUERY_PLAYERS_PREVIOUS_SEASONS',
+                 'players_past': 'QUERY_PLAYERS_PAST',
+                 'players_future': 'QUERY_PLAYERS_FUTURE',
+                 'players_full': 'QUERY_PLAYERS_FULL',
+                 'team_results': 'QUERY_TEAM_RESULTS',
+                 'league_table': 'QUERY_TABLE'}
+
+
+def fixture(fixture_id, team_h, team_a, team_h_score, team_a_score):
+    return {'code': 5000 + fixture_id, 'event': 1, 'finished': True,
+            'finished_provisional': True, 'id': fixture_id,
+            'kickoff_time': f'2019-08-0{fixture_id}T14:00:00Z',
+            'minutes': 90, 'provisional_start_time': False, 'started': True,
+            'team_h': team_h, 'team_a': team_a, 'team_h_score': team_h_score,
+            'team_a_score': team_a_score, 'stats': [],
+            'team_h_difficulty': 3, 'team_a_difficulty': 3}
+
+
+def player(player_id, fixture_ids, total_points=2):
+    history = [{'element': player_id, 'fixture': f, 'opponent_team': 2,
+                'total_points': total_points, 'was_home': True,
+                'kickoff_time': f'2019-08-0{f}T14:00:00Z',
+                'team_h_score': 1, 'team_a_score': 0, 'round': 1}
+               for f in fixture_ids]
+    return {'history': history, 'fixtures': [], 'history_past': []}
+
+
+FIXTURES_DATA = [fixture(1, 1, 2, 1, 0), fixture(2, 2, 1, 3, 3)]
+MAIN_DATA = {'elements': [{'id': 1, 'element_type': 1},
+                          {'id': 2, 'element_type': 2}]}
+PLAYER_DATA = {'1': player(1, [1, 2]), '2': player(2, [1])}
+
+
+def incremental_state(player_data, fixtures_data, main_data):
+    """State of an incremental transform which built players_past and
+    team_results from scratch"""
+    changes = find_changes(None, player_data, fixtures_data, main_data)
+    records = changed_player_records(None, player_data, changes)
+    fixtures = build_fixtures(fixtures_data)
+    return {'hashes': changes['hashes'],
+            'record_columns': [list(df.columns) for df in records[:2]],
+            'tables': {'players_past': build_players_past(records, fixtures),
+                       'team_results': build_team_results(fixtures)}}
+
+
+def test_find_changes():
+    changes = find_changes(None, PLAYER_DATA, FIXTURES_DATA, MAIN_DATA)
+    assert changes['players'] == {'1', '2'}
+    assert changes['fixtures'] == {'1', '2'}
+    previous = {'hashes': changes['hashes']}
+
+    player_data = {'1': player(1, [1, 2], total_points=5), '3': player(3, [])}
+    main_data = copy.deepcopy(MAIN_DATA)
+    main_data['elements'][1]['element_type'] = 3
+    fixtures_data = copy.deepcopy(FIXTURES_DATA)
+    fixtures_data[1]['team_h_score'] = 4
+    changes = find_changes(previous, player_data, fixtures_data, main_data)
+    # Changed, removed (and repositioned) and new players
+    assert changes['players'] == {'1', '2', '3'}
+    assert changes['fixtures'] == {'2'}
+
+    unchanged = find_changes(previous, PLAYER_DATA, FIXTURES_DATA, MAIN_DATA)
+    assert unchanged['players'] == set()
+    assert unchanged['fixtures'] == set()
+
+    # Players take fixtures' teams, so every player changes with them
+    fixtures_data[1]['team_h'] = 3
+    changes = find_changes(previous, PLAYER_DATA, fixtures_data, MAIN_DATA)
+    assert changes['players'] == {'1', '2'}
+
+
+def test_build_changed_rows_matches_full_build():
+    previous = incremental_state(PLAYER_DATA, FIXTURES_DATA, MAIN_DATA)
+
+    # A changed, a removed and a new player without any past fixtures
+    player_data = {'1': player(1, [1, 2], total_points=5), '3': player(3, [])}
+    fixtures_data = copy.deepcopy(FIXTURES_DATA)
+    fixtures_data[1]['team_h_score'] = 4
+    changes = find_changes(previous, player_data, fixtures_data, MAIN_DATA)
+    records = changed_player_records(previous, player_data, changes)
+    fixtures = build_fixtures(fixtures_data)
+    full = incremental_state(player_data, fixtures_data, MAIN_DATA)['tables']
+
+    players_past = build_changed_rows('players_past', previous, changes,
+                                      records, fixtures)
+    pdt.assert_frame_equal(players_past.reset_index(drop=True),
+                           full['players_past'].reset_index(drop=True),
+                           check_dtype=False)
+    team_results = build_changed_rows('team_results', previous, changes,
+                                      fixtures)
+    pdt.assert_frame_equal(
+        team_results.sort_values(['team_id', 'fixture_id'])
+        .reset_index(drop=True),
+        full['team_results'].sort_values(['team_id', 'fixture_id'])
+        .reset_index(drop=True),
+        check_dtype=False)
+
+
+def load_queries():
+    """The CREATE TABLE queries of load.py, read from its source as importing
+    it needs sqlalchemy"""
+    path = os.path.join(os.path.dirname(__file__), '..', 'load.py')
+    with open(path) as f:
+        module = ast.parse(f.read())
+    return {node.targets[0].id: ast.literal_eval(node.value)
+            for node in module.body
+            if isinstance(node, ast.Assign)
+            and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id.startswith('QUERY_')}
+
+
+# Dtypes of the columns of each database type
+DATABASE_DTYPES = {'VARCHAR': {'object', 'category'},
+                   'INT': {'Int8', 'Int16', 'Int32'},
+                   'FLOAT': {'float32'},
+                   'BOOL': {'bool'},
+                   'TIMESTAMP': {'datetime64[ns, UTC]'}}
+
+
+def query_columns(query):
+    """Database type of each column of a CREATE TABLE query"""
+    return dict(re.findall(r'^\s*(\w+) (VARCHAR|INT|FLOAT|BOOL|TIMESTAMP)',
+                           query, re.M))
+
+
+def query_rules(query):
+    """Rules, as in TABLE_RULES, of the constraints in a CREATE TABLE query"""
+    rules = {'primary_key': [], 'unique': [], 'not_null': [],
+             'references': {}, 'ranges': {}}
+    primary_key = re.search(r'PRIMARY KEY ?\(([\w, ]+)\)', query)
+    if primary_key:
+        rules['primary_key'] = primary_key.group(1).replace(' ', '').split(',')
+    # Column definitions, with any REFERENCES on the following line
+    columns = re.findall(r'^\s*(\w+) (?:VARCHAR|INT|FLOAT|BOOL|TIMESTAMP)'
+                         r'(.*(?:\n\s+REFERENCES.*)?)$', query, re.M)
+    for column, constraints in columns:
+        if 'PRIMARY KEY' in constraints:
+            rules['primary_key'] = [column]
+        if 'UNIQUE' in constraints:
+            rules['unique'].append(column)
+        if 'NOT NULL' in constraints:
+            rules['not_null'].append(column)
+        reference = re.search(r'REFERENCES (\w+)\((\w+)\)', constraints)
+        if reference:
+            rules['references'][column] = reference.groups()
+        check = re.search(r'CHECK\((\w+)<=(\d+)\)', constraints)
+        if check:
+            rules['ranges'][check.group(1)] = (None, int(check.group(2)))
+    return rules
+
+
+def test_table_rules_match_database():
+    queries = load_queries()
+    for table_name, query_name in TABLE_QUERIES.items():
+        expected = query_rules(queries[query_name])
+        rules = TABLE_RULES[table_name]
+        assert rules['primary_key'] == expected['primary_key'], table_name
+        assert set(rules.get('unique', [])) == set(expected['unique']), \
+            table_name
+        # Primary keys are not null without being listed
+        assert set(rules['primary_key']) | set(rules.get('not_null', [])) \
+            == set(expected['primary_key']) | set(expected['not_null']), \
+            table_name
+        assert rules.get('references', {}) == expected['references'], \
+            table_name
+        assert rules.get('ranges', {}) == expected['ranges'], table_name
+
+
+def test_table_dtypes_match_database():
+    queries = load_queries()
+    for table_name, query_name in TABLE_QUERIES.items():
+        columns = query_columns(queries[query_name])
+        dtypes = TABLE_DTYPES[table_name]
+        assert set(dtypes) == set(columns), table_name
+        for col, db_type in columns.items():
+            assert dtypes[col] in DATABASE_DTYPES[db_type], (table_name, col)
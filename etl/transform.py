@@ -1,12 +1,22 @@
 import os
-import json
 import re
 import logging
 import pickle
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                wait, FIRST_COMPLETED)
 
 import pandas as pd
 import numpy as np
 
+from fpltools.compression import open_file
+from fpltools import json_codec
+from fpltools.columnar import write_table, DEFAULT_COMPRESSION
+
+# File extension of transformed tables saved in each output format
+OUTPUT_EXTENSIONS = {'pickle': 'pkl', 'parquet': 'parquet'}
+# Number of violating values given as examples for each validation rule
+VALIDATION_EXAMPLES = 5
+
 
 # TODO: add checks for empty data
 
@@ -17,17 +27,7 @@ def dval_unique_index(df):
 
 # TODO: consider whether this should return True for empty data or raise error
 def dval_notnull_index(df):
-    df_index = df.index
-    if isinstance(df_index, pd.MultiIndex):
-        nlevels = df_index.nlevels
-        for lvl in range(0, nlevels):
-            lvls = df_index.get_level_values(lvl)
-            if sum(pd.isnull(lvls)) > 0:
-                return False
-        else:
-            return True
-    else:
-        return sum(df_index.isnull()) == 0
+    return not df.index.to_frame(index=False).isna().values.any()
 
 
 def check_unique_index(df, df_name, dval_func=dval_unique_index,
@@ -56,6 +56,164 @@ def check_not_null_index(df, df_name, dval_func=dval_notnull_index,
         logging.info(f'No null index entries for {df_name}')
 
 
+def _column(df, column):
+    """Values of a column, or index level, of df"""
+    if column in df.columns:
+        return df[column]
+    return pd.Series(df.index.get_level_values(column), index=df.index)
+
+
+def _as_text(values):
+    """Values as stored in a VARCHAR column, e.g. team id 2 as '2', so keys
+    are compared as the database does"""
+    if pd.api.types.is_numeric_dtype(values):
+        return integerstr_to_int(values)
+    return values
+
+
+def _rule_result(rule, columns, failed, values):
+    """Report entry for a rule with the number of rows which failed it (a
+    boolean Series) and a few of their values as examples"""
+    examples = values[failed.to_numpy()].head(VALIDATION_EXAMPLES)
+    if isinstance(examples, pd.DataFrame):
+        # Keys of several columns as tuples
+        examples = examples.itertuples(index=False, name=None) \
+            if examples.shape[1] > 1 else examples.iloc[:, 0]
+    return {'rule': rule,
+            'columns': list(columns),
+            'violations': int(failed.sum()),
+            'examples': [str(v) for v in examples]}
+
+
+def _missing_columns(df, rules):
+    """Columns named in rules which are neither columns nor index levels of
+    df"""
+    columns = list(rules.get('primary_key', [])) + \
+        list(rules.get('unique', [])) + list(rules.get('not_null', [])) + \
+        list(rules.get('references', {})) + list(rules.get('ranges', {}))
+    present = set(df.columns) | set(df.index.names)
+    return [col for col in dict.fromkeys(columns) if col not in present]
+
+
+def validate_table(df, rules, parent_keys=None):
+    """Evaluate rules (as in validate_tables) for a single table, with
+    parent_keys a function giving the key values of a referenced (table,
+    column), or None to leave references to be evaluated separately (e.g.
+    before the referenced tables are built). A column missing from the
+    table fails every row, as its load would, rather than its rules being
+    evaluated. Returns a report entry for each rule."""
+    report = []
+    missing = _missing_columns(df, rules)
+    for col in missing:
+        report.append({'rule': 'present', 'columns': [col],
+                       'violations': len(df), 'examples': []})
+
+    for columns in [rules.get('primary_key', [])] + \
+            [[col] for col in rules.get('unique', [])]:
+        if columns and not set(columns) & set(missing):
+            keys = pd.DataFrame({col: _column(df, col).to_numpy()
+                                 for col in columns})
+            report.append(_rule_result('unique', columns,
+                                       keys.duplicated(keep=False), keys))
+
+    not_null = [col for col in dict.fromkeys(
+        list(rules.get('primary_key', [])) + list(rules.get('not_null', [])))
+        if col not in missing]
+    if not_null:
+        values = pd.DataFrame({col: _column(df, col).to_numpy()
+                               for col in not_null})
+        nulls = values.isna()
+        for col in not_null:
+            report.append(_rule_result('not_null', [col], nulls[col],
+                                       values[col]))
+
+    if parent_keys is not None:
+        report.extend(_validate_references(df, rules, parent_keys, missing))
+
+    for col, (low, high) in rules.get('ranges', {}).items():
+        if col in missing:
+            continue
+        values = _column(df, col)
+        numbers = pd.to_numeric(values)
+        failed = pd.Series(False, index=values.index)
+        if low is not None:
+            failed |= numbers < low
+        if high is not None:
+            failed |= numbers > high
+        report.append(_rule_result(f'range [{low}, {high}]', [col], failed,
+                                   values))
+    return report
+
+
+def _validate_references(df, rules, parent_keys, missing=()):
+    """Report entries for the references rules of a single table"""
+    report = []
+    for col, (table, key) in rules.get('references', {}).items():
+        if col in missing:
+            continue
+        values = _as_text(_column(df, col))
+        failed = values.notna() & ~values.isin(parent_keys(table, key))
+        report.append(_rule_result(f'references {table}({key})', [col],
+                                   failed, values))
+    return report
+
+
+def validate_tables(tables, rules, raise_errors=True, checked=None):
+    """Check tables, a dictionary of DataFrames, against rules declared for
+    each: {table name: {'primary_key': [columns], 'unique': [columns],
+    'not_null': [columns], 'references': {column: (table, column)},
+    'ranges': {column: (min, max)}}} as the database constraints will when
+    they are loaded. Columns may be index levels. Primary keys must be
+    unique and not null, referencing columns must only hold (non-null)
+    values of the referenced table's column, and ranges are inclusive
+    (either may be None) with nulls allowed, as SQL CHECK constraints do.
+    checked, {table name: report entries}, gives the rules other than
+    references already evaluated for tables by validate_table (e.g. as each
+    was built), so that only their references are evaluated here.
+
+    Every rule is evaluated, with each referenced key's values found once,
+    and a report returned with, for each table, its number of rows and a
+    list of rules with their columns, number of violations and examples of
+    violating values. AssertionError is raised if any rule is violated and
+    raise_errors."""
+    checked = checked or {}
+    key_values = {}
+
+    def parent_keys(table, key):
+        if (table, key) not in key_values:
+            key_values[(table, key)] = _as_text(
+                _column(tables[table], key)).dropna().unique()
+        return key_values[(table, key)]
+
+    report = {}
+    for table_name, table_rules in rules.items():
+        df = tables[table_name]
+        if table_name in checked:
+            results = checked[table_name] + _validate_references(
+                df, table_rules, parent_keys,
+                _missing_columns(df, table_rules))
+        else:
+            results = validate_table(df, table_rules, parent_keys)
+        report[table_name] = {'rows': len(df), 'rules': results}
+
+    failures = [f"{table_name} {result['rule']} {result['columns']}: "
+                f"{result['violations']} violations, e.g. "
+                f"{result['examples']}"
+                for table_name, table_report in report.items()
+                for result in table_report['rules'] if result['violations']]
+    n_rules = sum(len(r['rules']) for r in report.values())
+    if failures:
+        for failure in failures:
+            logging.error(f'Validation failed for {failure}')
+        if raise_errors:
+            raise AssertionError(f'{len(failures)} of {n_rules} validation '
+                                 f'rules failed: {failures}')
+    else:
+        logging.info(f'All {n_rules} validation rules passed for '
+                     f'{len(report)} tables')
+    return report
+
+
 def pandas_integerstr_to_int(x):
     """Pandas is not able to use int() on columns with NaNs in. This function
     does this by stripping out characters including and after a decimal place,
@@ -66,12 +224,119 @@ def pandas_integerstr_to_int(x):
         return re.sub(r'(\.\d+)', '', str(x))
 
 
+def integerstr_to_int(data):
+    """Vectorised pandas_integerstr_to_int for a whole Series or DataFrame:
+    truncates each (numeric) value to an integer and returns it as a string,
+    leaving NaNs as NaN. Use as df[cols].pipe(integerstr_to_int)."""
+    if isinstance(data, pd.DataFrame):
+        return data.apply(integerstr_to_int)
+    numeric = pd.to_numeric(data)
+    notnull = numeric.notna()
+    converted = pd.Series(np.nan, index=data.index, dtype=object,
+                          name=data.name)
+    converted[notnull] = numeric[notnull].astype(np.int64).astype(str)
+    return converted
+
+
+def _fit_dtype(values, dtype):
+    """values converted to dtype (as declared in TABLE_DTYPES), or None if
+    any do not fit it: ids (category) are kept as the text of their VARCHAR
+    column, bools must not be null and integers must be whole numbers within
+    the range of the (nullable) integer type"""
+    if dtype == 'category':
+        return _as_text(values).astype('category')
+    if dtype == 'object':
+        return values.astype(object)
+    if dtype == 'bool':
+        if values.isna().any():
+            return None
+        return values.astype(bool)
+    if dtype.startswith('datetime64'):
+        return pd.to_datetime(values, utc=True)
+    numbers = pd.to_numeric(values)
+    if dtype == 'float32':
+        return numbers.astype(np.float32)
+    non_null = numbers.dropna()
+    info = np.iinfo(dtype.lower())
+    if not ((non_null % 1 == 0).all() and (non_null >= info.min).all() and
+            (non_null <= info.max).all()):
+        return None
+    return numbers.astype(dtype)
+
+
+def compact_dtypes(df, df_name, dtypes):
+    """Convert df's columns to their dtypes, {column: dtype} declared for the
+    table (e.g. category for repeated ids, float32 for FLOAT(8) columns and
+    small nullable integer types for counts), so the table has the same
+    types on every run. Values are kept as the database stores them (e.g.
+    numbers held as text become numbers), so it loads into the same database
+    tables. Columns without a dtype, and index levels, are left as they are.
+    Raises ValueError if values of a column do not fit its dtype. Logs the
+    memory saved."""
+    before = df.memory_usage(deep=True).sum()
+    converted = {}
+    for col, dtype in dtypes.items():
+        if col not in df.columns:
+            continue
+        values = _fit_dtype(df[col], dtype)
+        if values is None:
+            raise ValueError(f'Values of {df_name} column {col} do not fit '
+                             f'its dtype {dtype}')
+        converted[col] = values
+    df = df.assign(**converted)
+    after = df.memory_usage(deep=True).sum()
+    logging.info(f'Compacted dtypes of {df_name} from {before / 1e6:.2f}MB '
+                 f'to {after / 1e6:.2f}MB ({1 - after / max(before, 1):.0%} '
+                 f'saved)')
+    return df
+
+
+def _append_records(columns, n_rows, records, **values):
+    """Append records (dictionaries) to columns, a dictionary of lists which
+    currently hold n_rows rows, setting values on every record. Columns
+    missing from a record, or first seen in one, are padded with NaN as
+    pd.concat would. Returns the new number of rows."""
+    for record in records:
+        for key, value in (dict(record, **values) if values
+                           else record).items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [np.nan] * n_rows
+            column.append(value)
+        n_rows += 1
+        for column in columns.values():
+            if len(column) < n_rows:
+                column.append(np.nan)
+    return n_rows
+
+
+def player_dataframes(player_items, player_ids=None):
+    """Build the players past fixtures (history), future fixtures (fixtures,
+    tagged with player_id) and previous seasons (history_past) DataFrames
+    from (player id, data) pairs. Records are gathered into columns in a
+    single pass, so each table is built with one DataFrame call rather than
+    by concatenating a DataFrame per player. Past and future fixtures are
+    only gathered for player_ids, if given."""
+    past, future, prev_seasons = {}, {}, {}
+    n_past = n_future = n_prev_seasons = 0
+    for k, p in player_items:
+        if player_ids is None or k in player_ids:
+            n_past = _append_records(past, n_past, p['history'])
+            n_future = _append_records(future, n_future, p['fixtures'],
+                                       player_id=k)
+        n_prev_seasons = _append_records(prev_seasons, n_prev_seasons,
+                                         p['history_past'])
+    return (pd.DataFrame(past), pd.DataFrame(future),
+            pd.DataFrame(prev_seasons))
+
+
 def load_json(data_name, data_loc):
-    """Load data from JSON file in data_loc with name data_name"""
+    """Load data from JSON file in data_loc with name data_name, decompressing
+    if data_name ends .gz or .zst"""
     logging.info(f'Loading {data_name} from {data_loc}')
     try:
-        with open(os.path.join(data_loc, data_name), 'r') as f:
-            loaded = json.load(f)
+        with open_file(os.path.join(data_loc, data_name), 'rb') as f:
+            loaded = json_codec.load(f)
     except FileNotFoundError as e:
         logging.exception('Unable to find load location')
         raise FileNotFoundError(e)
@@ -80,6 +345,24 @@ def load_json(data_name, data_loc):
         return loaded
 
 
+def iter_ndjson(data_name, data_loc):
+    """Iterate over (player id, data) pairs in a newline-delimited JSON file
+    written during extract, reading one player at a time. Player ids are
+    strings to match the keys of the equivalent JSON file from load_json."""
+    logging.info(f'Streaming {data_name} from {data_loc}')
+    try:
+        with open_file(os.path.join(data_loc, data_name), 'rb') as f:
+            for line in f:
+                if line.strip():
+                    record = json_codec.loads(line)
+                    yield str(record['id']), record['data']
+    except FileNotFoundError as e:
+        logging.exception('Unable to find load location')
+        raise FileNotFoundError(e)
+    else:
+        logging.info(f'Successfully streamed {data_name}')
+
+
 def pickle_data(data, data_name, data_loc):
     """Save unedited data as JSON files"""
     logging.info(f'Saving {data_name} as pickle in {data_loc}')
@@ -91,3 +374,70 @@ def pickle_data(data, data_name, data_loc):
         raise FileNotFoundError(e)
     else:
         logging.info(f'Successfully saved {data_name}')
+
+
+def parquet_data(data, data_name, data_loc, compression=DEFAULT_COMPRESSION,
+                 dtypes=None):
+    """Save a dataframe, with its index, as a Parquet file with an explicit
+    schema, in which columns declared in dtypes, {column: dtype}, have the
+    type of their dtype"""
+    logging.info(f'Saving {data_name} as Parquet in {data_loc}')
+    try:
+        write_table(data, os.path.join(data_loc, f'{data_name}.parquet'),
+                    compression=compression, dtypes=dtypes)
+    except FileNotFoundError as e:
+        logging.exception('Unable to find save location')
+        raise FileNotFoundError(e)
+    else:
+        logging.info(f'Successfully saved {data_name}')
+
+
+def save_data(data, data_name, data_loc, output_format='pickle', dtypes=None):
+    """Save a transformed dataframe in output_format (one of
+    OUTPUT_EXTENSIONS), returning the path saved to. dtypes, {column:
+    dtype}, gives the schema of Parquet files (see parquet_data)."""
+    if output_format == 'parquet':
+        parquet_data(data, data_name, data_loc, dtypes=dtypes)
+    else:
+        pickle_data(data, data_name, data_loc)
+    return os.path.join(data_loc,
+                        f'{data_name}.{OUTPUT_EXTENSIONS[output_format]}')
+
+
+def run_dag(tasks, max_workers=4, use_processes=False, finish=None):
+    """Run tasks, {name: (function, names of the tasks whose results are its
+    arguments)}, on a pool of max_workers threads (or processes), starting
+    each as soon as its inputs are ready so that independent tasks run
+    concurrently. finish, {name: function}, gives functions to also run on
+    the pool with the result of the named task as soon as it completes (e.g.
+    to save it). Functions must be picklable to use processes. Returns the
+    results, and finish results, of the tasks keyed by name."""
+    unknown = {i for _, inputs in tasks.values() for i in inputs} - set(tasks)
+    if unknown:
+        raise ValueError(f'Tasks have unknown inputs: {sorted(unknown)}')
+    executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    results, finished = {}, {}
+    pending = dict(tasks)
+    running = {}
+    with executor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name, (func, inputs) in list(pending.items()):
+                if all(i in results for i in inputs):
+                    args = [results[i] for i in inputs]
+                    running[pool.submit(func, *args)] = (name, False)
+                    del pending[name]
+            if not running:
+                raise ValueError(f'Tasks have cyclic inputs: '
+                                 f'{sorted(pending)}')
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, is_finish = running.pop(future)
+                if is_finish:
+                    finished[name] = future.result()
+                    continue
+                results[name] = future.result()
+                logging.info(f'Completed task {name}')
+                if finish and name in finish:
+                    running[pool.submit(finish[name], results[name])] = \
+                        (name, True)
+    return results, finished
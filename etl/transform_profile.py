@@ -0,0 +1,206 @@
+import os
+import time
+import logging
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+from fpltools import json_codec
+
+# pandas operations timed within stages when profiling: (owner, attribute)
+PROFILED_OPERATIONS = ((pd, 'concat'),
+                       (pd, 'merge'),
+                       (pd.DataFrame, 'merge'),
+                       (pd.DataFrame, 'sort_values'),
+                       (pd.DataFrame, 'applymap'))
+
+# CPU time of the current thread, so concurrent stages are not counted
+# together (time.thread_time is not available on Python 3.6)
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+
+class TransformProfiler:
+    """Records the wall time, CPU time, peak traced memory (tracemalloc) and
+    output rows and columns of each stage of a transform: each task run
+    through wrap_tasks (e.g. a table build), each block run in stage and,
+    while started, each pandas operation in PROFILED_OPERATIONS (other than
+    those called by another). Stages may run in any number of threads, but
+    not in other processes. Does nothing if not enabled, so the transform
+    can be written the same way whether profiling or not.
+
+    Peak memory is the most traced memory above that in use when the stage
+    began, including that of stages running at the same time in other
+    threads. Before Python 3.9 it is the peak since profiling started.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = []
+        self._open = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._originals = {}
+        self._started = None
+
+    def start(self):
+        """Start tracing memory and timing pandas operations"""
+        if not self.enabled:
+            return self
+        tracemalloc.start()
+        self._started = time.perf_counter()
+        for owner, attr in PROFILED_OPERATIONS:
+            original = getattr(owner, attr)
+            self._originals[(owner, attr)] = original
+            setattr(owner, attr, self._operation(attr, original))
+        return self
+
+    def stop(self):
+        """Stop tracing memory and restore pandas operations"""
+        if not self.enabled:
+            return
+        for (owner, attr), original in self._originals.items():
+            setattr(owner, attr, original)
+        self._originals = {}
+        tracemalloc.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _sample_memory(self):
+        """Attribute the peak traced memory since the last sample to every
+        open stage"""
+        current, peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        for stage in self._open:
+            stage['_peak'] = max(stage['_peak'], peak)
+        return current
+
+    @contextmanager
+    def stage(self, name, category='stage'):
+        """Profile the block as stage name, yielding its record. Call
+        set_output(record, df) to record the rows and columns it made."""
+        record = {'name': name, 'category': category}
+        if not self.enabled:
+            yield record
+            return
+        stack = self._local.__dict__.setdefault('stack', [])
+        record['parent'] = stack[-1]['name'] if stack else None
+        record['thread'] = threading.get_ident()
+        with self._lock:
+            start_memory = self._sample_memory()
+            record['_peak'] = start_memory
+            self._open.append(record)
+        stack.append(record)
+        start_cpu = _cpu_time()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['start'] = start - self._started
+            record['wall'] = time.perf_counter() - start
+            record['cpu'] = _cpu_time() - start_cpu
+            stack.pop()
+            with self._lock:
+                self._sample_memory()
+                self._open.remove(record)
+                record['peak_memory'] = record.pop('_peak') - start_memory
+                self.stages.append(record)
+
+    @staticmethod
+    def set_output(record, data):
+        """Record the rows and columns of data, if a DataFrame"""
+        if isinstance(data, pd.DataFrame):
+            record['rows'], record['columns'] = data.shape
+
+    def _operation(self, name, func):
+        """func profiled as an operation stage, unless called by another"""
+        profiler = self
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = getattr(profiler._local, 'stack', [])
+            if stack and stack[-1]['category'] == 'operation':
+                return func(*args, **kwargs)
+            with profiler.stage(name, 'operation') as record:
+                result = func(*args, **kwargs)
+                # Operations done inplace leave the result in self
+                profiler.set_output(record, result if result is not None
+                                    else args[0])
+            return result
+
+        return wrapper
+
+    def wrap(self, name, func, category='stage'):
+        """func profiled as stage name, recording the output it returns"""
+        if not self.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name, category) as record:
+                result = func(*args, **kwargs)
+                self.set_output(record, result)
+            return result
+
+        return wrapper
+
+    def wrap_tasks(self, tasks, category):
+        """Tasks for run_dag, each profiled as a stage named for its category
+        (e.g. build) and task"""
+        return {name: (self.wrap(f'{category} {name}', func, category),
+                       inputs)
+                for name, (func, inputs) in tasks.items()}
+
+    def summary(self):
+        """Each stage's record, in the order they began, with the total wall
+        and CPU time, the number of calls and the highest peak memory of each
+        operation"""
+        stages = sorted(self.stages, key=lambda s: s['start'])
+        operations = {}
+        for stage in stages:
+            if stage['category'] == 'operation':
+                op = operations.setdefault(stage['name'], {
+                    'calls': 0, 'wall': 0, 'cpu': 0, 'peak_memory': 0})
+                op['calls'] += 1
+                op['wall'] += stage['wall']
+                op['cpu'] += stage['cpu']
+                op['peak_memory'] = max(op['peak_memory'],
+                                        stage['peak_memory'])
+        return {'stages': stages, 'operations': operations}
+
+    def save(self, path):
+        """Save the summary as JSON"""
+        with open(path, 'wb') as f:
+            f.write(json_codec.dumps(self.summary()))
+        logging.info(f'Saved transform profile to {path}')
+
+    def trace(self):
+        """Stages as complete events in the Chrome trace event format, which
+        chrome://tracing, Perfetto and speedscope show as a flame graph per
+        thread"""
+        pid = os.getpid()
+        events = [{'name': stage['name'],
+                   'cat': stage['category'],
+                   'ph': 'X',
+                   'ts': stage['start'] * 1e6,
+                   'dur': stage['wall'] * 1e6,
+                   'pid': pid,
+                   'tid': stage['thread'],
+                   'args': {k: stage[k] for k in ('cpu', 'peak_memory',
+                                                  'rows', 'columns')
+                            if k in stage}}
+                  for stage in self.stages]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_trace(self, path):
+        """Save the trace as JSON"""
+        with open(path, 'wb') as f:
+            f.write(json_codec.dumps(self.trace()))
+        logging.info(f'Saved transform trace to {path}')
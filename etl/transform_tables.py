@@ -0,0 +1,853 @@
+import os
+import pickle
+import hashlib
+import logging
+import warnings
+from functools import partial
+
+import pandas as pd
+import numpy as np
+
+from transform import (load_json, iter_ndjson, save_data, compact_dtypes,
+                       integerstr_to_int, player_dataframes, pickle_data,
+                       validate_table)
+from fpltools import json_codec
+
+# Index (primary key) of each transformed table. The league table's index is
+# its position, set when it is built.
+TABLE_INDEXES = {'fixtures': ['fixture_id'],
+                 'gameweeks': ['gameweek_id'],
+                 'teams': ['team_id'],
+                 'positions': ['position_id'],
+                 'players_summary': ['player_id'],
+                 'players_previous_seasons': ['player_id_long', 'season_name'],
+                 'players_past': ['player_id', 'fixture_id'],
+                 'players_future': ['player_id', 'fixture_id_long'],
+                 'players_full': ['player_id', 'gameweek_id', 'fixture_id'],
+                 'team_results': ['team_id', 'fixture_id'],
+                 'league_table': None}
+# Constraints each table has in the database (see load.py), checked as each
+# table is saved and, for references, once every table is built: its primary
+# key (its index), other unique columns, not-null columns, columns
+# referencing other tables' keys and CHECK constraints on the range of values
+# of columns
+_TEAMS = ('teams', 'team_id')
+_FIXTURES = ('fixtures', 'fixture_id')
+_GAMEWEEKS = ('gameweeks', 'gameweek_id')
+_PLAYERS = ('players_summary', 'player_id')
+_POSITIONS = ('positions', 'position_id')
+# Player statistics, all NOT NULL, of the players summary, past fixtures and
+# previous seasons tables
+_PLAYER_STATS = ['minutes', 'goals_scored', 'assists', 'clean_sheets',
+                 'goals_conceded', 'own_goals', 'penalties_saved',
+                 'penalties_missed', 'yellow_cards', 'red_cards', 'saves',
+                 'bonus', 'bps', 'influence', 'creativity', 'threat',
+                 'ict_index']
+TABLE_RULES = {
+    'fixtures': {'primary_key': TABLE_INDEXES['fixtures'],
+                 'unique': ['fixture_id_long'],
+                 'not_null': ['fixture_id_long'],
+                 'references': {'gameweek_id': _GAMEWEEKS,
+                                'home_team_id': _TEAMS,
+                                'away_team_id': _TEAMS},
+                 # The database checks the home team's difficulty for both
+                 # difficulty columns
+                 'ranges': {'fixture_minutes': (None, 90),
+                            'home_team_fixture_difficulty': (None, 4)}},
+    'gameweeks': {'primary_key': TABLE_INDEXES['gameweeks'],
+                  'unique': ['gameweek_name'],
+                  'not_null': ['gameweek_name', 'gameweek_deadline_time',
+                               'gameweek_previous', 'gameweek_current',
+                               'gameweek_next', 'gameweek_finished',
+                               'gameweek_data_checked'],
+                  'references': {'player_id_most_selected': _PLAYERS,
+                                 'player_id_most_transferred_in': _PLAYERS,
+                                 'player_id_highest_score': _PLAYERS,
+                                 'player_id_most_captained': _PLAYERS,
+                                 'player_id_most_vice_captained': _PLAYERS}},
+    'teams': {'primary_key': TABLE_INDEXES['teams'],
+              'unique': ['team_id_long', 'team_name_long', 'team_name'],
+              'not_null': ['team_id_long', 'team_name_long', 'team_name',
+                           'team_strength', 'team_strength_overall_home',
+                           'team_strength_overall_away',
+                           'team_strength_attack_home',
+                           'team_strength_attack_away',
+                           'team_strength_defence_home',
+                           'team_strength_defence_away']},
+    'positions': {'primary_key': TABLE_INDEXES['positions'],
+                  'unique': ['position_name', 'position_name_long'],
+                  'not_null': ['position_name', 'position_name_long',
+                               'squad_select', 'squad_min_play',
+                               'squad_max_play']},
+    'players_summary': {'primary_key': TABLE_INDEXES['players_summary'],
+                        'unique': ['player_id_long'],
+                        'not_null': ['player_id_long', 'first_name',
+                                     'second_name', 'position_id', 'team_id',
+                                     'team_id_long', 'now_cost',
+                                     'selected_by_percent', 'form',
+                                     'cost_change_event',
+                                     'cost_change_event_fall',
+                                     'cost_change_start',
+                                     'cost_change_start_fall',
+                                     'in_dreamteam', 'dreamteam_count',
+                                     'gameweek_points', 'photo', 'special',
+                                     'status', 'total_points',
+                                     'transfers_in', 'transfers_out',
+                                     'transfers_in_event',
+                                     'transfers_out_event', 'value_form',
+                                     'value_season'] + _PLAYER_STATS,
+                        'references': {'position_id': _POSITIONS,
+                                       'team_id': _TEAMS}},
+    'players_previous_seasons': {
+        'primary_key': TABLE_INDEXES['players_previous_seasons'],
+        'not_null': ['start_cost', 'end_cost', 'total_points'] +
+        _PLAYER_STATS},
+    'players_past': {'primary_key': TABLE_INDEXES['players_past'],
+                     'not_null': ['fixture_id_long', 'gameweek_id',
+                                  'total_points', 'fixture_home',
+                                  'home_team_id', 'away_team_id'] +
+                     _PLAYER_STATS +
+                     ['value', 'transfers_balance', 'selected',
+                      'transfers_in', 'transfers_out', 'kickoff_datetime'],
+                     'references': {'player_id': _PLAYERS,
+                                    'fixture_id': _FIXTURES,
+                                    'gameweek_id': _GAMEWEEKS,
+                                    'home_team_id': _TEAMS,
+                                    'away_team_id': _TEAMS}},
+    # Indexed by the long fixture id, but keyed in the database by the id
+    'players_future': {'primary_key': ['player_id', 'fixture_id'],
+                       'not_null': ['fixture_id_long', 'home_team_id',
+                                    'away_team_id', 'finished',
+                                    'fixture_home', 'kickoff_datetime'],
+                       'references': {'player_id': _PLAYERS,
+                                      'fixture_id': _FIXTURES,
+                                      'gameweek_id': _GAMEWEEKS,
+                                      'home_team_id': _TEAMS,
+                                      'away_team_id': _TEAMS},
+                       'ranges': {'minutes': (None, 90)}},
+    'players_full': {'primary_key': TABLE_INDEXES['players_full'],
+                     'not_null': ['fixture_id_long', 'gameweek_id', 'team_id',
+                                  'position_id', 'fixture_home',
+                                  'home_team_id', 'away_team_id',
+                                  'kickoff_datetime'],
+                     'references': {'player_id': _PLAYERS,
+                                    'fixture_id': _FIXTURES,
+                                    'gameweek_id': _GAMEWEEKS,
+                                    'team_id': _TEAMS,
+                                    'position_id': _POSITIONS,
+                                    'home_team_id': _TEAMS,
+                                    'away_team_id': _TEAMS}},
+    'team_results': {'primary_key': TABLE_INDEXES['team_results'],
+                     'not_null': ['fixture_id_long', 'opponent_team_id',
+                                  'played', 'fixture_home'],
+                     'references': {'team_id': _TEAMS,
+                                    'fixture_id': _FIXTURES,
+                                    'gameweek_id': _GAMEWEEKS}},
+    'league_table': {'primary_key': ['table_position'],
+                     'unique': ['team_name_long'],
+                     'not_null': ['team_id', 'team_name_long', 'points',
+                                  'goal_difference', 'played', 'win', 'draw',
+                                  'loss', 'goals_scored', 'goals_conceded'],
+                     'references': {'team_id': _TEAMS},
+                     'ranges': {'table_position': (None, 20)}}}
+# Dtype of each column loaded into the database, fixed so that every run
+# saves a table with the same types (see compact_dtypes): text (object) for
+# VARCHAR columns, category for ids which repeat, float32 for FLOAT(8),
+# bool for BOOL, UTC datetimes for TIMESTAMP and, for INT, the smallest
+# nullable integer type holding any value the column can take
+_STATS_DTYPES = {'minutes': 'Int16', 'goals_scored': 'Int8',
+                 'assists': 'Int8', 'clean_sheets': 'Int8',
+                 'goals_conceded': 'Int16', 'own_goals': 'Int8',
+                 'penalties_saved': 'Int8', 'penalties_missed': 'Int8',
+                 'yellow_cards': 'Int8', 'red_cards': 'Int8',
+                 'saves': 'Int16', 'bonus': 'Int8', 'bps': 'Int16',
+                 'influence': 'float32', 'creativity': 'float32',
+                 'threat': 'float32', 'ict_index': 'float32'}
+# Columns of the player fixture tables taken from fixtures
+_PLAYER_FIXTURE_DTYPES = {'player_id': 'object',
+                          'fixture_id': 'category',
+                          'fixture_id_long': 'category',
+                          'gameweek_id': 'category',
+                          'fixture_home': 'bool',
+                          'home_team_id': 'category',
+                          'away_team_id': 'category',
+                          'home_team_score': 'Int8',
+                          'away_team_score': 'Int8',
+                          'kickoff_datetime': 'datetime64[ns, UTC]'}
+_PLAYER_MATCH_DTYPES = {'total_points': 'Int16', 'value': 'Int16',
+                        'transfers_balance': 'Int32', 'selected': 'Int32',
+                        'transfers_in': 'Int32', 'transfers_out': 'Int32'}
+TABLE_DTYPES = {
+    'fixtures': {'fixture_id': 'object',
+                 'fixture_id_long': 'object',
+                 'gameweek_id': 'category',
+                 'fixture_kickoff_datetime': 'datetime64[ns, UTC]',
+                 'fixture_started': 'bool',
+                 'fixture_finished': 'bool',
+                 'fixture_finished_provisional': 'bool',
+                 'fixture_minutes': 'Int8',
+                 'home_team_id': 'category',
+                 'away_team_id': 'category',
+                 'home_team_score': 'Int8',
+                 'away_team_score': 'Int8',
+                 'home_team_fixture_difficulty': 'Int8',
+                 'away_team_fixture_difficulty': 'Int8'},
+    'gameweeks': {'gameweek_id': 'object',
+                  'gameweek_name': 'object',
+                  'gameweek_deadline_time': 'datetime64[ns, UTC]',
+                  'gameweek_previous': 'bool',
+                  'gameweek_current': 'bool',
+                  'gameweek_next': 'bool',
+                  'gameweek_finished': 'bool',
+                  'gameweek_data_checked': 'bool',
+                  'average_entry_score': 'Int16',
+                  'highest_scoring_entry': 'object',
+                  'highest_scoring_entry_score': 'Int16',
+                  'player_id_most_selected': 'category',
+                  'player_id_most_transferred_in': 'category',
+                  'player_id_highest_score': 'category',
+                  'player_id_most_captained': 'category',
+                  'player_id_most_vice_captained': 'category',
+                  'transfers_made': 'Int32'},
+    'teams': {'team_id': 'object',
+              'team_id_long': 'object',
+              'team_name_long': 'object',
+              'team_name': 'object',
+              'team_strength': 'Int8',
+              'team_strength_overall_home': 'Int16',
+              'team_strength_overall_away': 'Int16',
+              'team_strength_attack_home': 'Int16',
+              'team_strength_attack_away': 'Int16',
+              'team_strength_defence_home': 'Int16',
+              'team_strength_defence_away': 'Int16'},
+    'positions': {'position_id': 'object',
+                  'position_name': 'object',
+                  'position_name_long': 'object',
+                  'squad_select': 'Int8',
+                  'squad_min_play': 'Int8',
+                  'squad_max_play': 'Int8'},
+    'players_summary': dict({'player_id': 'object',
+                             'player_id_long': 'object',
+                             'first_name': 'object',
+                             'second_name': 'object',
+                             'position_id': 'category',
+                             'team_id': 'category',
+                             'team_id_long': 'category',
+                             'now_cost': 'Int16',
+                             'selected_by_percent': 'float32',
+                             'form': 'float32',
+                             'chance_of_playing_next_round': 'Int8',
+                             'chance_of_playing_this_round': 'Int8',
+                             'cost_change_event': 'Int8',
+                             'cost_change_event_fall': 'Int8',
+                             'cost_change_start': 'Int16',
+                             'cost_change_start_fall': 'Int16',
+                             'news': 'object',
+                             'news_added_datetime': 'datetime64[ns, UTC]',
+                             'ep_next': 'float32',
+                             'ep_this': 'float32',
+                             'in_dreamteam': 'bool',
+                             'dreamteam_count': 'Int8',
+                             'gameweek_points': 'Int16',
+                             'photo': 'object',
+                             'points_per_game': 'float32',
+                             'special': 'bool',
+                             'status': 'object',
+                             'total_points': 'Int16',
+                             'transfers_in': 'Int32',
+                             'transfers_out': 'Int32',
+                             'transfers_in_event': 'Int32',
+                             'transfers_out_event': 'Int32',
+                             'value_form': 'float32',
+                             'value_season': 'float32'}, **_STATS_DTYPES),
+    'players_previous_seasons': dict({'player_id_long': 'object',
+                                      'season_name': 'object',
+                                      'start_cost': 'Int16',
+                                      'end_cost': 'Int16',
+                                      'total_points': 'Int16'},
+                                     **_STATS_DTYPES),
+    'players_past': dict(_PLAYER_FIXTURE_DTYPES, fixture_id='object',
+                         **_PLAYER_MATCH_DTYPES, **_STATS_DTYPES),
+    'players_future': dict(_PLAYER_FIXTURE_DTYPES, fixture_id_long='object',
+                           finished='bool', minutes='Int8',
+                           provisional_start_time='bool',
+                           difficulty='Int8'),
+    'players_full': dict(_PLAYER_FIXTURE_DTYPES, fixture_id='object',
+                         gameweek_id='object', team_id='category',
+                         position_id='category', **_PLAYER_MATCH_DTYPES,
+                         **_STATS_DTYPES),
+    'team_results': {'team_id': 'object',
+                     'fixture_id': 'object',
+                     'fixture_id_long': 'category',
+                     'gameweek_id': 'category',
+                     'opponent_team_id': 'category',
+                     'goals_conceded': 'Int8',
+                     'goals_scored': 'Int8',
+                     'fixture_kickoff_datetime': 'datetime64[ns, UTC]',
+                     'played': 'bool',
+                     'fixture_home': 'bool',
+                     'win': 'Int8',
+                     'draw': 'Int8',
+                     'loss': 'Int8',
+                     'points': 'Int8',
+                     'goal_difference': 'Int8'},
+    'league_table': {'table_position': 'Int8',
+                     'team_id': 'object',
+                     'team_name_long': 'object',
+                     'points': 'Int16',
+                     'goal_difference': 'Int16',
+                     'played': 'Int8',
+                     'win': 'Int8',
+                     'draw': 'Int8',
+                     'loss': 'Int8',
+                     'goals_scored': 'Int16',
+                     'goals_conceded': 'Int16'}}
+# Name (without extension) of the file, saved with the transformed tables, in
+# which an incremental transform keeps what it needs for the next run
+TRANSFORM_STATE = 'transform_state'
+# Fields of each fixture which the player tables take from fixtures; if any
+# change, every player is rebuilt by an incremental transform
+FIXTURE_KEY_FIELDS = ('id', 'code', 'team_h', 'team_a')
+
+
+def load_player_records(data_name, data_loc, stream=False):
+    """Player past fixtures, future fixtures and previous seasons records (as
+    from player_dataframes) from the players JSON, or newline-delimited
+    JSON if stream"""
+    if stream:
+        player_items = iter_ndjson(data_name, data_loc)
+    else:
+        player_items = load_json(data_name, data_loc).items()
+    return player_dataframes(player_items)
+
+
+def build_fixtures(fixtures_data):
+    logging.info('Beginning transform of fixtures data')
+    fixtures_rename = {'code': 'fixture_id_long',
+                       'event': 'gameweek_id',
+                       'finished': 'fixture_finished',
+                       'finished_provisional': 'fixture_finished_provisional',
+                       'id': 'fixture_id',
+                       'minutes': 'fixture_minutes',
+                       'started': 'fixture_started',
+                       'team_a': 'away_team_id',
+                       'team_a_score': 'away_team_score',
+                       'team_h': 'home_team_id',
+                       'team_h_score': 'home_team_score',
+                       'team_h_difficulty': 'home_team_fixture_difficulty',
+                       'team_a_difficulty': 'away_team_fixture_difficulty'
+                       }
+
+    fixtures_drop = ['kickoff_time', 'provisional_start_time']
+    fixtures_str_cols = ['fixture_id',
+                         'fixture_id_long',
+                         'gameweek_id',
+                         'away_team_id',
+                         'home_team_id']
+
+    df_fixtures = pd.DataFrame(fixtures_data)
+    df_fixtures['fixture_kickoff_datetime'] =\
+        pd.to_datetime(df_fixtures['kickoff_time'], errors='coerce')
+    df_fixtures.drop(columns=['stats'] + fixtures_drop, inplace=True)
+    df_fixtures.rename(columns=fixtures_rename, inplace=True)
+    df_fixtures[fixtures_str_cols] = df_fixtures[fixtures_str_cols] \
+        .pipe(integerstr_to_int)
+    df_fixtures.sort_values(TABLE_INDEXES['fixtures'], inplace=True)
+
+    # Case exists where if a fixture has been postponed without being
+    # rescheduled, the gameweek will be null in certain tables (it won't
+    # appear in gameweeks). This is a non-fatal error, but it requires rows
+    # to be dropped from later table(s) (players_future) so a warning must be
+    # displayed.
+    if sum(df_fixtures.gameweek_id.isna()):
+        warn_msg = "At least one fixture does not have an assigned gameweek. " \
+                   "Records may be dropped in player tables to accommodate this."
+        warnings.warn(warn_msg)
+
+    logging.info('Completed transform of fixtures data')
+    return df_fixtures
+
+
+def build_gameweeks(main_data):
+    logging.info('Beginning gameweek of fixtures data')
+    gameweek_rename = {'id': 'gameweek_id',
+                       'name': 'gameweek_name',
+                       'finished': 'gameweek_finished',
+                       'data_checked': 'gameweek_data_checked',
+                       'highest_score': 'highest_scoring_entry_score',
+                       'is_previous': 'gameweek_previous',
+                       'is_current': 'gameweek_current',
+                       'is_next': 'gameweek_next',
+                       'most_selected': 'player_id_most_selected',
+                       'most_transferred_in': 'player_id_most_transferred_in',
+                       'top_element': 'player_id_highest_score',
+                       'most_captained': 'player_id_most_captained',
+                       'most_vice_captained': 'player_id_most_vice_captained'
+                       }
+    gameweek_drop = ['deadline_time',
+                     'deadline_time_epoch',
+                     'deadline_time_game_offset',
+                     'chip_plays',
+                     'top_element_info']
+    gameweek_str_cols = ['gameweek_id',
+                         'highest_scoring_entry',
+                         'player_id_most_selected',
+                         'player_id_most_transferred_in',
+                         'player_id_highest_score',
+                         'player_id_most_captained',
+                         'player_id_most_vice_captained']
+
+    df_gameweeks = pd.DataFrame(main_data['events'])
+    df_gameweeks['gameweek_deadline_time'] =\
+        pd.to_datetime(df_gameweeks['deadline_time'], errors='coerce')
+    df_gameweeks.drop(columns=gameweek_drop, inplace=True)
+    df_gameweeks.rename(columns=gameweek_rename, inplace=True)
+    df_gameweeks[gameweek_str_cols] = df_gameweeks[gameweek_str_cols]\
+        .pipe(integerstr_to_int)
+    df_gameweeks.sort_values(TABLE_INDEXES['gameweeks'], inplace=True)
+    logging.info('Completed transform of gameweek data')
+    return df_gameweeks
+
+
+def build_teams(main_data):
+    logging.info('Beginning transform of teams data')
+    teams_rename = {'code': 'team_id_long',
+                    'id': 'team_id',
+                    'name': 'team_name_long',
+                    'short_name': 'team_name',
+                    'strength': 'team_strength',
+                    'strength_overall_home': 'team_strength_overall_home',
+                    'strength_overall_away': 'team_strength_overall_away',
+                    'strength_attack_home': 'team_strength_attack_home',
+                    'strength_attack_away': 'team_strength_attack_away',
+                    'strength_defence_home': 'team_strength_defence_home',
+                    'strength_defence_away': 'team_strength_defence_away',
+                    }
+    teams_drop = ['draw', 'form', 'loss', 'played', 'points', 'position',
+                  'team_division', 'unavailable', 'win']
+    teams_str_cols = ['team_id_long', 'team_id']
+
+    df_teams = pd.DataFrame(main_data['teams'])
+    df_teams.rename(columns=teams_rename, inplace=True)
+    df_teams.drop(columns=teams_drop, inplace=True)
+    df_teams[teams_str_cols] = df_teams[teams_str_cols] \
+        .pipe(integerstr_to_int)
+    df_teams.sort_values(TABLE_INDEXES['teams'], inplace=True)
+    logging.info('Completed transform of teams data')
+    return df_teams
+
+
+def build_positions(main_data):
+    logging.info('Beginning transform of positions data')
+    positions_rename = {'id': 'position_id',
+                        'singular_name': 'position_name_long',
+                        'singular_name_short': 'position_name'}
+    positions_drop = ['plural_name', 'plural_name_short', 'ui_shirt_specific',
+                      'sub_positions_locked']
+    positions_str_cols = ['position_id']
+
+    df_positions = pd.DataFrame(main_data['element_types'])
+    df_positions.rename(columns=positions_rename, inplace=True)
+    df_positions.drop(columns=positions_drop, inplace=True)
+    df_positions[positions_str_cols] = df_positions[positions_str_cols] \
+        .pipe(integerstr_to_int)
+
+    df_positions.sort_values(TABLE_INDEXES['positions'], inplace=True)
+    logging.info('Completed transform of positions data')
+    return df_positions
+
+
+def build_players_summary(main_data):
+    """Single row per player with current stats for this point and
+    aggregated up to this point"""
+    logging.info('Beginning transform of player summary data')
+    players_sum_rename = {'code': 'player_id_long',
+                          'element_type': 'position_id',
+                          'event_points': 'gameweek_points',
+                          'id': 'player_id',
+                          'team': 'team_id',
+                          'team_code': 'team_id_long'}
+    players_sum_drop = ['squad_number', 'web_name']
+    players_sum_str_cols = ['player_id_long', 'position_id', 'player_id']
+
+    df_players_sum = pd.DataFrame(main_data['elements'])
+    df_players_sum['news_added_datetime'] = pd.to_datetime(
+        df_players_sum['news_added'],
+        errors='coerce')
+    df_players_sum.rename(columns=players_sum_rename, inplace=True)
+    df_players_sum.drop(columns=players_sum_drop, inplace=True)
+    df_players_sum[players_sum_str_cols] = df_players_sum[players_sum_str_cols] \
+        .pipe(integerstr_to_int)
+    df_players_sum.sort_values(TABLE_INDEXES['players_summary'], inplace=True)
+    logging.info('Completed transform of player summary data')
+    return df_players_sum
+
+
+def build_players_previous_seasons(player_records):
+    """Player performance in previous seasons"""
+    logging.info('Beginning transform of player previous seasons data')
+    players_prev_seasons_rename = {'element_code': 'player_id_long'}
+    players_prev_seasons_str_cols = ['player_id_long']
+
+    df_players_prev_seasons = player_records[2].rename(
+        columns=players_prev_seasons_rename)
+    df_players_prev_seasons[players_prev_seasons_str_cols] =\
+        df_players_prev_seasons[players_prev_seasons_str_cols]\
+            .pipe(integerstr_to_int)
+    df_players_prev_seasons.sort_values(
+        TABLE_INDEXES['players_previous_seasons'], inplace=True)
+    logging.info('Completed transform of player previous seasons data')
+    return df_players_prev_seasons
+
+
+def build_players_past(player_records, df_fixtures):
+    """Players in previous fixtures this season"""
+    logging.info('Beginning transform of previous player fixtures data')
+    players_past_rename = {'element': 'player_id',
+                           'fixture': 'fixture_id',
+                           'team_h_score': 'home_team_score',
+                           'team_a_score': 'away_team_score',
+                           'round': 'gameweek_id',
+                           'was_home': 'fixture_home'}
+    players_past_drop = ['kickoff_time', 'opponent_team']
+    players_past_str_cols = ['player_id', 'fixture_id', 'gameweek_id']
+
+    df_players_past = player_records[0].rename(columns=players_past_rename)
+    df_players_past['kickoff_datetime'] = pd.to_datetime(
+        df_players_past['kickoff_time'],
+        errors='coerce')
+    df_players_past.drop(columns=players_past_drop, inplace=True)
+    df_players_past[players_past_str_cols] = df_players_past[players_past_str_cols] \
+            .pipe(integerstr_to_int)
+    df_players_past = pd.merge(df_players_past, df_fixtures[
+        ['fixture_id', 'fixture_id_long', 'away_team_id', 'home_team_id']],
+                               how='inner',
+                               right_on='fixture_id',
+                               left_on='fixture_id'
+                               )
+    df_players_past.sort_values(TABLE_INDEXES['players_past'], inplace=True)
+    logging.info('Completed transform of previous player fixtures data')
+    return df_players_past
+
+
+def build_players_future(player_records, df_fixtures):
+    """Players' remaining fixtures"""
+    logging.info('Beginning transform of remaining player fixtures data')
+    player_future_rename = {'event': 'gameweek_id',
+                            'code': 'fixture_id_long',
+                            'team_h': 'home_team_id',
+                            'team_a': 'away_team_id',
+                            'team_h_score': 'home_team_score',
+                            'team_a_score': 'away_team_score',
+                            'is_home': 'fixture_home'}
+    players_future_drop = ['kickoff_time', 'event_name']
+    players_future_str_cols = ['fixture_id_long',
+                               'gameweek_id',
+                               'home_team_id',
+                               'away_team_id']
+    df_players_future = player_records[1].rename(columns=player_future_rename)
+    df_players_future['kickoff_datetime'] =\
+        pd.to_datetime(df_players_future['kickoff_time'], errors='coerce')
+    df_players_future.drop(columns=players_future_drop, inplace=True)
+
+    # Account for unscheduled games (otherwise there will be primary key
+    # issues with the gameweek later)
+    if sum(df_fixtures.gameweek_id.isna()):
+        missing_gameweek_player_rows = df_players_future['gameweek_id'].isna()
+        n_missing_gameweek_player_rows = np.sum(missing_gameweek_player_rows)
+        n_missing_gameweek_fixtures =\
+            df_players_future.loc[missing_gameweek_player_rows, 'fixture_id_long'].nunique()
+        logging.info(f"There are {n_missing_gameweek_player_rows} player rows having been "
+                     f"deleted due to {n_missing_gameweek_fixtures} fixtures which have not "
+                     f"been (re)scheduled. These will be deleted.")
+        df_players_future = df_players_future[~missing_gameweek_player_rows]
+
+    df_players_future[players_future_str_cols] = df_players_future[players_future_str_cols] \
+        .pipe(integerstr_to_int)
+
+    df_players_future = pd.merge(df_players_future,
+                                 df_fixtures[['fixture_id',
+                                              'fixture_id_long']],
+                                 how='inner',
+                                 on='fixture_id_long'
+                                 )
+    df_players_future.sort_values(TABLE_INDEXES['players_future'],
+                                  inplace=True)
+    logging.info('Completed transform of remaining player fixtures data')
+    return df_players_future
+
+
+def build_players_full(df_players_past, df_players_future, df_players_sum):
+    """One row per fixture for this season's previous and remaining
+    fixtures"""
+    logging.info('Combining previous and remaining player fixture data')
+    players_full_index = TABLE_INDEXES['players_full']
+    df_players_full = pd.concat((df_players_past, df_players_future),
+                                sort=False)
+
+    df_players_full.sort_values(['player_id', 'kickoff_datetime'],
+                                inplace=True)
+    df_players_full['team_id'] = np.where(df_players_full['fixture_home'],
+                                          df_players_full['home_team_id'],
+                                          df_players_full['away_team_id'])
+    df_players_full = pd.merge(df_players_full,
+                               df_players_sum[['player_id', 'position_id']],
+                               how='left',
+                               on='player_id')
+    # For current gameweek (depending on when data is taken), both past and
+    # future can contain the same row. This needs to be removed.
+    duplicate_rows = df_players_full.duplicated(subset=players_full_index,
+                                                keep=False)
+    drop_rows = pd.isna(df_players_full.total_points) & duplicate_rows
+    df_players_full = df_players_full[~drop_rows]
+    df_players_full.sort_values(players_full_index, inplace=True)
+    return df_players_full
+
+
+def _team_side_results(df_fixtures, side, columns):
+    """Results of each fixture for the home (or away) team"""
+    other = 'away' if side == 'home' else 'home'
+    results = df_fixtures[columns].copy()
+    results.rename(columns={'fixture_finished': 'played',
+                            f'{side}_team_id': 'team_id',
+                            f'{other}_team_id': 'opponent_team_id',
+                            f'{side}_team_score': 'goals_scored',
+                            f'{other}_team_score': 'goals_conceded'},
+                   inplace=True)
+    results['fixture_home'] = side == 'home'
+    results['win'] = results['played'] & (results['goals_scored'] >
+                                          results['goals_conceded'])
+    results['draw'] = results['played'] & (results['goals_scored'] ==
+                                           results['goals_conceded'])
+    results['loss'] = results['played'] & (results['goals_scored'] <
+                                           results['goals_conceded'])
+    results['points'] = results['win'] * 3 + results['draw'] * 1
+    results.loc[~results['played'], ['win', 'draw', 'loss']] = np.nan
+    results['goal_difference'] = results['goals_scored'] - \
+        results['goals_conceded']
+    return results
+
+
+def build_team_results(df_fixtures):
+    logging.info('Beginning transform of team results data')
+    team_results_cols = ['fixture_id_long',
+                         'fixture_id',
+                         'gameweek_id',
+                         'away_team_id',
+                         'home_team_id',
+                         'away_team_score',
+                         'home_team_score',
+                         'fixture_kickoff_datetime',
+                         'fixture_finished']
+    home = _team_side_results(df_fixtures, 'home', team_results_cols)
+    away = _team_side_results(df_fixtures, 'away', team_results_cols)
+
+    df_team_results = pd.concat([home, away], sort=False)
+    df_team_results.sort_values(['team_id', 'fixture_kickoff_datetime'],
+                                inplace=True)
+    logging.info('Completed transform of team results data')
+    return df_team_results
+
+
+def build_league_table(df_team_results, df_teams):
+    logging.info('Beginning transform of Premier League table data')
+    tbl_cols = ['points',
+                'goal_difference',
+                'played',
+                'win',
+                'loss',
+                'draw',
+                'goals_scored',
+                'goals_conceded']
+    df_table = pd.merge(df_team_results,
+                        df_teams[['team_id', 'team_name_long']],
+                        how='left',
+                        on='team_id')
+    df_table =\
+        df_table.groupby(['team_id', 'team_name_long'],
+                         as_index=False)[tbl_cols].sum()
+    df_table.sort_values(['points', 'goal_difference', 'goals_scored'],
+                         ascending=False,
+                         inplace=True)
+    df_table[tbl_cols] = df_table[tbl_cols].pipe(integerstr_to_int)
+    df_table.reset_index(drop=True, inplace=True)
+    df_table.index.rename('table_position', inplace=True)
+    logging.info('Completed transform of Premier League table data')
+    return df_table
+
+
+# Each transformed table's builder and the names of its inputs: raw data
+# (fixtures_data, main_data and player_records) or other tables
+TABLE_BUILDERS = {
+    'fixtures': (build_fixtures, ('fixtures_data',)),
+    'gameweeks': (build_gameweeks, ('main_data',)),
+    'teams': (build_teams, ('main_data',)),
+    'positions': (build_positions, ('main_data',)),
+    'players_summary': (build_players_summary, ('main_data',)),
+    'players_previous_seasons': (build_players_previous_seasons,
+                                 ('player_records',)),
+    'players_past': (build_players_past, ('player_records', 'fixtures')),
+    'players_future': (build_players_future, ('player_records', 'fixtures')),
+    'players_full': (build_players_full, ('players_past', 'players_future',
+                                          'players_summary')),
+    'team_results': (build_team_results, ('fixtures',)),
+    'league_table': (build_league_table, ('team_results', 'teams'))}
+
+
+def finish_table(table_name, df, data_loc, output_format='pickle'):
+    """Check a built table against its TABLE_RULES other than references
+    (evaluated once every table is built, by validate_tables), then set its
+    index (primary key) and save it with its TABLE_DTYPES (also the schema
+    of Parquet files). Returns the path saved to and the report entries of
+    the rules checked."""
+    report = validate_table(df, TABLE_RULES[table_name])
+    index = TABLE_INDEXES[table_name]
+    if index is not None:
+        df = df.set_index(index)
+    dtypes = TABLE_DTYPES[table_name]
+    return (save_data(compact_dtypes(df, table_name, dtypes), table_name,
+                      data_loc, output_format, dtypes), report)
+
+
+# Tables which an incremental transform rebuilds only for the players (or
+# fixtures) changed since the last run: the column identifying them, the kind
+# of change and the columns the table is sorted by
+INCREMENTAL_TABLES = {
+    'players_past': ('player_id', 'players', TABLE_INDEXES['players_past']),
+    'players_future': ('player_id', 'players',
+                       TABLE_INDEXES['players_future']),
+    'players_full': ('player_id', 'players', TABLE_INDEXES['players_full']),
+    'team_results': ('fixture_id', 'fixtures',
+                     ['team_id', 'fixture_kickoff_datetime'])}
+
+
+def load_players(data_name, data_loc, stream=False):
+    """Raw data for each player keyed by player id, from the players JSON or
+    newline-delimited JSON if stream"""
+    if stream:
+        return dict(iter_ndjson(data_name, data_loc))
+    return load_json(data_name, data_loc)
+
+
+def content_hash(data):
+    """Hash of JSON serialisable data, to tell whether it has changed"""
+    return hashlib.sha1(json_codec.dumps(data)).hexdigest()
+
+
+def _changed_keys(new, old):
+    """Keys which are new, changed or removed in new compared to old"""
+    return {k for k in new.keys() | old.keys() if new.get(k) != old.get(k)}
+
+
+def find_changes(previous, player_data, fixtures_data, main_data):
+    """Ids (as in the transformed tables) of the players and fixtures which
+    have changed since previous, the state of the last incremental transform
+    (all of them if None), with the content hashes to keep for the next run.
+    A player has changed if their raw data or position has."""
+    hashes = {'players': {k: content_hash(p) for k, p in player_data.items()},
+              'fixtures': {str(f['id']): content_hash(f)
+                           for f in fixtures_data},
+              'fixture_keys': {str(f['id']): [f.get(k)
+                                              for k in FIXTURE_KEY_FIELDS]
+                               for f in fixtures_data},
+              'positions': {str(p['id']): p['element_type']
+                            for p in main_data['elements']}}
+    if previous is None:
+        return {'players': set(hashes['players']),
+                'fixtures': set(hashes['fixtures']),
+                'hashes': hashes}
+
+    old = previous['hashes']
+    players = _changed_keys(hashes['players'], old['players']) | \
+        _changed_keys(hashes['positions'], old['positions'])
+    if hashes['fixture_keys'] != old['fixture_keys']:
+        players = set(hashes['players']) | set(old['players'])
+    fixtures = _changed_keys(hashes['fixtures'], old['fixtures'])
+    logging.info(f'{len(players)} players and {len(fixtures)} fixtures have '
+                 f'changed since the last transform')
+    return {'players': players, 'fixtures': fixtures, 'hashes': hashes}
+
+
+def changed_player_records(previous, player_data, changes):
+    """Player past and future fixtures records for the changed players only
+    (unless there is no previous state), and previous seasons records for
+    every player. Columns of the previous run's records are kept, so rows
+    built from few (or no) players match the previous table's."""
+    if previous is None:
+        return player_dataframes(player_data.items())
+    past, future, prev_seasons = player_dataframes(player_data.items(),
+                                                   changes['players'])
+    past, future = [df.reindex(columns=list(columns) + [
+                        col for col in df.columns if col not in columns])
+                    for df, columns in zip((past, future),
+                                           previous['record_columns'])]
+    return past, future, prev_seasons
+
+
+def build_changed_rows(table_name, previous, changes, *inputs):
+    """Build table_name from inputs (as its builder in TABLE_BUILDERS) for
+    only the changed players (or fixtures) and splice these rows into the
+    table from previous, the state of the last incremental transform, in
+    place of theirs. Inputs with the column identifying them are limited to
+    the changed ones. The whole table is built if there is no previous
+    state."""
+    func = TABLE_BUILDERS[table_name][0]
+    if previous is None:
+        return func(*inputs)
+    key, kind, sort_cols = INCREMENTAL_TABLES[table_name]
+    keys = changes[kind]
+    df_previous = previous['tables'][table_name]
+    if not keys:
+        logging.info(f'No rows of {table_name} have changed')
+        return df_previous
+
+    inputs = [x[x[key].isin(keys)]
+              if isinstance(x, pd.DataFrame) and key in x.columns else x
+              for x in inputs]
+    df_rows = func(*inputs)
+    logging.info(f'Rebuilt {len(df_rows)} rows of {table_name} for '
+                 f'{len(keys)} changed {kind}')
+    df_table = pd.concat([df_previous[~df_previous[key].isin(keys)], df_rows],
+                         sort=False, ignore_index=True)
+    df_table.sort_values(sort_cols, inplace=True)
+    return df_table
+
+
+def incremental_tasks(previous, players_name, data_loc, stream=False):
+    """Tasks replacing those which load player records and build the
+    INCREMENTAL_TABLES (for run_dag with TABLE_BUILDERS), so only players and
+    fixtures changed since previous, the state of the last incremental
+    transform, are rebuilt"""
+    tasks = {'player_data': (partial(load_players, players_name, data_loc,
+                                     stream), ()),
+             'changes': (partial(find_changes, previous),
+                         ('player_data', 'fixtures_data', 'main_data')),
+             'player_records': (partial(changed_player_records, previous),
+                                ('player_data', 'changes'))}
+    for name in INCREMENTAL_TABLES:
+        tasks[name] = (partial(build_changed_rows, name, previous),
+                       ('changes',) + TABLE_BUILDERS[name][1])
+    return tasks
+
+
+def load_transform_state(data_loc):
+    """State saved by the last incremental transform in data_loc, or None if
+    there is none"""
+    try:
+        with open(os.path.join(data_loc, f'{TRANSFORM_STATE}.pkl'), 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        logging.info(f'No previous transform state in {data_loc}, so all '
+                     f'tables will be built in full')
+        return None
+
+
+def save_transform_state(results, data_loc):
+    """Save what the next incremental transform needs from results (of
+    run_dag with incremental_tasks): content hashes, player record columns
+    and the INCREMENTAL_TABLES as built, before indexes are set"""
+    state = {'hashes': results['changes']['hashes'],
+             'record_columns': [list(df.columns)
+                                for df in results['player_records'][:2]],
+             'tables': {name: results[name] for name in INCREMENTAL_TABLES}}
+    pickle_data(state, TRANSFORM_STATE, data_loc)
@@ -0,0 +1,96 @@
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Codec used to compress each column chunk within a Parquet file
+DEFAULT_COMPRESSION = 'zstd'
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow must be installed to read or write '
+                          'Parquet files')
+
+
+def _arrow_type(values):
+    """Arrow type for a column (or index level) without a declared dtype,
+    from its pandas dtype, keeping categoricals as dictionaries and integer
+    and float widths. Object columns are strings unless they hold other
+    values (e.g. booleans with NaN for unplayed fixtures)."""
+    dtype = values.dtype
+    if isinstance(dtype, pd.api.types.CategoricalDtype):
+        return pa.dictionary(pa.int32(), _arrow_type(dtype.categories))
+    if pd.api.types.is_bool_dtype(dtype):
+        return pa.bool_()
+    if pd.api.types.is_integer_dtype(dtype) or \
+            pd.api.types.is_float_dtype(dtype):
+        # Nullable integer types (e.g. Int16) keep their width
+        return pa.from_numpy_dtype(getattr(dtype, 'numpy_dtype', dtype))
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        tz = getattr(dtype, 'tz', None)
+        return pa.timestamp('ns', tz=str(tz) if tz is not None else None)
+    non_null = pd.Series(values).dropna()
+    if non_null.map(lambda v: isinstance(v, str)).all():
+        return pa.string()
+    return pa.array(non_null, from_pandas=True).type
+
+
+def _declared_type(dtype):
+    """Arrow type for a column declared with a pandas dtype (as in
+    compact_dtypes), whatever values it happens to hold: categoricals are
+    dictionaries of their (text) ids and object columns strings"""
+    dtype = pd.api.types.pandas_dtype(dtype)
+    if isinstance(dtype, pd.api.types.CategoricalDtype):
+        return pa.dictionary(pa.int32(), pa.string())
+    if pd.api.types.is_object_dtype(dtype):
+        return pa.string()
+    if pd.api.types.is_bool_dtype(dtype):
+        return pa.bool_()
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        tz = getattr(dtype, 'tz', None)
+        return pa.timestamp('ns', tz=str(tz) if tz is not None else None)
+    return pa.from_numpy_dtype(getattr(dtype, 'numpy_dtype', dtype))
+
+
+def arrow_schema(df, dtypes=None):
+    """Explicit Arrow schema for df, including its (named) index levels and
+    the pandas metadata needed to restore the index on read. Columns
+    declared in dtypes, {column: dtype}, have the Arrow type of their dtype,
+    so the file has the same schema on every run; the types of any others,
+    and of index levels (keys, which are never null), are found from their
+    values."""
+    _require_pyarrow()
+    dtypes = dtypes or {}
+    schema = pa.Schema.from_pandas(df, preserve_index=True)
+    index = df.index
+    columns = {name: _arrow_type(index.get_level_values(i))
+               for i, name in enumerate(index.names) if name is not None}
+    columns.update({name: _arrow_type(df[name]) for name in df.columns})
+    columns.update({name: _declared_type(dtype)
+                    for name, dtype in dtypes.items() if name in df.columns})
+    fields = [pa.field(field.name, columns.get(field.name, field.type))
+              for field in schema]
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def write_table(df, path, compression=DEFAULT_COMPRESSION, dtypes=None):
+    """Write df, with its index, to path as Parquet using arrow_schema with
+    the declared dtypes"""
+    _require_pyarrow()
+    table = pa.Table.from_pandas(df, schema=arrow_schema(df, dtypes),
+                                 preserve_index=True)
+    pq.write_table(table, path, compression=compression)
+
+
+def read_table(path, columns=None):
+    """Read a Parquet file written by write_table into a DataFrame with its
+    index restored. Only columns (if given) are read from the file, along
+    with the index."""
+    _require_pyarrow()
+    table = pq.read_table(path, columns=columns, use_pandas_metadata=True)
+    return table.to_pandas()
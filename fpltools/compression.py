@@ -0,0 +1,52 @@
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression codec used for a file, chosen by its final extension
+CODEC_EXTENSIONS = {'gz': 'gzip', 'zst': 'zstd'}
+# Suffix to add to a file's extension to compress it with each codec
+CODEC_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def get_codec(filename):
+    """Name of the compression codec for filename, or None if uncompressed"""
+    return CODEC_EXTENSIONS.get(filename.rsplit('.', 1)[-1])
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError('zstandard must be installed to read or write '
+                          '.zst files')
+
+
+def open_file(path, mode='r'):
+    """Open path as open() would, compressing or decompressing as data is
+    written or read if the extension is that of a supported codec (.gz for
+    gzip, .zst for zstd). Text modes read and write UTF-8."""
+    codec = get_codec(path)
+    encoding = None if 'b' in mode else 'utf-8'
+    if codec is None:
+        return open(path, mode, encoding=encoding)
+    if 't' not in mode and 'b' not in mode:
+        mode = f'{mode}t'
+    if codec == 'gzip':
+        return gzip.open(path, mode, encoding=encoding)
+    _require_zstandard()
+    return zstandard.open(path, mode, encoding=encoding)
+
+
+def decompress_bytes(data, filename):
+    """Decompress data read in full from filename (e.g. an S3 object)
+    according to its extension"""
+    codec = get_codec(filename)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    if codec == 'zstd':
+        _require_zstandard()
+        # Frames written by a stream do not record their content size, so
+        # decompress as a stream too
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
@@ -20,5 +20,6 @@ API_URLS = {'event': '{}fixtures/?event={{}}/'.format(API_URL_BASE),
             'user_team': '{}my-team/{{}}/'.format(API_URL_BASE),
             'user_transfers': '{}entry/{{}}/transfers/'.format(API_URL_BASE),
             'transfers': '{}transfers/'.format(API_URL_BASE),
-            'teams': '{}teams/'.format(API_URL_BASE)
+            'teams': '{}teams/'.format(API_URL_BASE),
+            'league_classic': '{}leagues-classic/{{}}/standings/?page_standings={{}}'.format(API_URL_BASE)
             }
@@ -0,0 +1,42 @@
+"""
+JSON encoding and decoding shared by extract, transform and S3 download.
+
+Data is decoded straight from bytes (no intermediate str) and encoded to
+bytes. orjson is used if it is installed as it is several times faster than
+the standard library; otherwise the standard library json module is used.
+Either way the decoded data is the same.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def loads(data):
+    """Decode JSON from bytes (or str)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Encode obj as JSON bytes. As with the json module, non-string
+    dictionary keys (e.g. integer player ids) are converted to strings."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj).encode('utf-8')
+
+
+def load(fp):
+    """Decode JSON from a file opened in binary mode"""
+    return loads(fp.read())
+
+
+def dump(obj, fp):
+    """Encode obj as JSON to a file opened in binary mode"""
+    fp.write(dumps(obj))
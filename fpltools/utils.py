@@ -1,11 +1,15 @@
 import os
 import logging
-import json
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import boto3
 from botocore.exceptions import ClientError
 
+from fpltools.compression import decompress_bytes
+from fpltools import json_codec
+
 
 def get_datetime():
     return round(datetime.now().timestamp())
@@ -42,16 +46,16 @@ class AwsS3:
     @staticmethod
     def _generate_out_name(filename, bucket_folder, datetime_string):
         """Generate the output object name for a file. This is the original filename with any S3 folder specified as a
-        prefix, appending the current datetime before the extension"""
-        split_file = filename.split('.')
+        prefix, appending the current datetime before the extension (all of it, e.g. .json.gz)"""
+        split_file = filename.split('.', 1)
 
         # Currently require a file to have an extension - no problem extending this to all files but minor refactoring
         # would be needed
         if len(split_file) <= 1:
             raise RuntimeError(f"File to be uploaded must have an extension")
-        extension = split_file[-1]
+        name, extension = split_file
 
-        data_out_name = filename.replace(f".{extension}", f"_{datetime_string}.{extension}")
+        data_out_name = f"{name}_{datetime_string}.{extension}"
         if bucket_folder is not None:
             data_out_object = f'{bucket_folder}/{data_out_name}'
         else:
@@ -85,6 +89,143 @@ class AwsS3:
             _ = self._upload_file(fl, bucket, out_object)
 
 
+class AwsS3Pipeline:
+    """Upload files to S3 in the background while the caller carries on, so
+    that uploading overlaps with retrieving data. Objects are named as by
+    AwsS3.upload.
+
+    bucket: str
+        The S3 bucket to upload to
+    bucket_folder: str or None
+        If specified, the folder(s) within the S3 bucket to upload to
+    max_workers: int
+        Number of uploads (or parts of streamed files) to run at once
+    """
+
+    def __init__(self, bucket, bucket_folder, max_workers=4):
+        self.bucket = bucket
+        self.bucket_folder = bucket_folder
+        self._s3_client = boto3.client('s3')
+        self._datetime_upload = get_datetime_string_f()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+
+    def _out_name(self, path):
+        return AwsS3._generate_out_name(os.path.split(path)[1],
+                                        self.bucket_folder,
+                                        self._datetime_upload)
+
+    def _upload_file(self, path):
+        out_object = self._out_name(path)
+        self._s3_client.upload_file(path, self.bucket, out_object)
+        logging.info(f'Successfully uploaded {path} as {out_object}')
+
+    def upload(self, data_files):
+        """Queue one or more complete files to upload"""
+        if isinstance(data_files, str):
+            data_files = [data_files]
+        for fl in data_files:
+            logging.info(f'Queueing {fl} for upload')
+            self._futures.append(self._executor.submit(self._upload_file, fl))
+
+    def stream(self, path, part_size=8 * 1024 ** 2):
+        """Start uploading path, which is still being written, in parts as it
+        grows. Returns an S3StreamUpload which must be told of writes
+        (update) and when the file is complete (finish)."""
+        return S3StreamUpload(self, path, part_size)
+
+    def wait(self):
+        """Wait for all queued uploads, raising the first error if any
+        failed"""
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._futures = []
+            self._executor.shutdown()
+
+
+class S3StreamUpload:
+    """Multipart upload of a file as it is written. Bytes already written to
+    a file (even compressed) do not change as more is appended, so each part
+    is read from disk and uploaded in the background once part_size bytes are
+    available. Created by AwsS3Pipeline.stream."""
+
+    # S3 requires every part but the last to be at least 5MB
+    MIN_PART_SIZE = 5 * 1024 ** 2
+
+    def __init__(self, pipeline, path, part_size):
+        self.pipeline = pipeline
+        self.path = path
+        self.part_size = max(part_size, self.MIN_PART_SIZE)
+        self.out_object = pipeline._out_name(path)
+        self._client = pipeline._s3_client
+        self._upload_id = self._client.create_multipart_upload(
+            Bucket=pipeline.bucket, Key=self.out_object)['UploadId']
+        self._offset = 0
+        self._parts = []
+        self._part_futures = []
+        self._lock = threading.Lock()
+
+    def _upload_part(self, number, offset, size):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            body = f.read(size)
+        response = self._client.upload_part(
+            Bucket=self.pipeline.bucket, Key=self.out_object,
+            UploadId=self._upload_id, PartNumber=number, Body=body)
+        with self._lock:
+            self._parts.append({'ETag': response['ETag'],
+                                'PartNumber': number})
+
+    def _queue_part(self, size):
+        number = self._offset // self.part_size + 1
+        self._part_futures.append(self.pipeline._executor.submit(
+            self._upload_part, number, self._offset, size))
+        self._offset += size
+
+    def update(self):
+        """Queue any complete parts written since the last update"""
+        while os.path.getsize(self.path) - self._offset >= self.part_size:
+            self._queue_part(self.part_size)
+
+    def finish(self):
+        """Queue the remainder of the (closed) file and complete the upload
+        once every part has been uploaded"""
+        self.update()
+        remaining = os.path.getsize(self.path) - self._offset
+        if remaining > 0 or self._offset == 0:
+            self._queue_part(remaining)
+
+        def _complete():
+            try:
+                for future in self._part_futures:
+                    future.result()
+                parts = sorted(self._parts, key=lambda p: p['PartNumber'])
+                self._client.complete_multipart_upload(
+                    Bucket=self.pipeline.bucket, Key=self.out_object,
+                    UploadId=self._upload_id,
+                    MultipartUpload={'Parts': parts})
+            except Exception:
+                self.abort()
+                raise
+            logging.info(f'Successfully uploaded {self.path} as '
+                         f'{self.out_object}')
+        self.pipeline._futures.append(
+            self.pipeline._executor.submit(_complete))
+
+    def abort(self):
+        """Abandon the upload, e.g. if the file will not be completed. Parts
+        not yet started are cancelled and those in progress waited for, as a
+        part finishing after the abort would be kept (and charged for)."""
+        for future in self._part_futures:
+            future.cancel()
+        wait(self._part_futures)
+        self._client.abort_multipart_upload(
+            Bucket=self.pipeline.bucket, Key=self.out_object,
+            UploadId=self._upload_id)
+
+
 class AwsS3Download:
 
     def __init__(self):
@@ -111,5 +252,11 @@ class AwsS3Download:
         item = self.get_latest(bucket, prefix)
         object_contents = self.__s3.get_object(Bucket=bucket,
                                              Key=item)
-        item_contents = object_contents['Body'].read().decode('utf-8')
-        return json.loads(item_contents)
+        # Decoded directly from bytes to avoid a copy of the data as a str
+        item_contents = decompress_bytes(object_contents['Body'].read(), item)
+        if '.ndjson' in item:
+            # Players streamed during extract, one {"id", "data"} per line
+            records = (json_codec.loads(line)
+                       for line in item_contents.splitlines() if line.strip())
+            return {str(r['id']): r['data'] for r in records}
+        return json_codec.loads(item_contents)